@@ -3,6 +3,7 @@ from discord.ext import commands
 import logging
 import json
 import os
+from bot_commands.member_cache import member_resolver
 
 class AutoRole(commands.Cog):
     def __init__(self, bot):
@@ -118,7 +119,8 @@ class AutoRole(commands.Cog):
                 if reaction_role["emoji"] == str(payload.emoji):
                     role = guild.get_role(reaction_role["role_id"])
                     if role:
-                        member = guild.get_member(payload.user_id)
+                        # Reaction adds carry the member, the cache is only a fallback
+                        member = await member_resolver.resolve(guild, payload.user_id, payload.member)
                         if member:
                             if role in member.roles:
                                 # Debugging output
@@ -131,6 +133,7 @@ class AutoRole(commands.Cog):
                                 logging.info(f"Removed reaction for {member.name} as they already have the {role.name} role.")
                             else:
                                 await member.add_roles(role)
+                                member_resolver.forget(guild.id, member.id)
                                 logging.info(f"Assigned role {role.name} to {member.name} for reacting with {reaction_role['emoji']}.")
 
     @commands.Cog.listener()
@@ -145,39 +148,12 @@ class AutoRole(commands.Cog):
                 if reaction_role["emoji"] == str(payload.emoji):
                     role = guild.get_role(reaction_role["role_id"])
                     if role:
-                        member = guild.get_member(payload.user_id)
+                        # Reaction removes don't carry the member, it's fetched unless it's cached
+                        member = await member_resolver.resolve(guild, payload.user_id, payload.member)
                         if member:
                             await member.remove_roles(role)
+                            member_resolver.forget(guild.id, member.id)
                             logging.info(f"Removed role {role.name} from {member.name} for removing reaction {reaction_role['emoji']}.")
 
 async def setup(bot):
     await bot.add_cog(AutoRole(bot))
-
-# Custom logging handler to handle Unicode characters
-class UnicodeHandler(logging.StreamHandler):
-    def emit(self, record):
-        try:
-            msg = self.format(record)
-            stream = self.stream
-            stream.write(msg + self.terminator)
-            self.flush()
-        except UnicodeEncodeError:
-            msg = self.format(record)
-            msg = msg.encode('utf-8', errors='replace').decode('ascii', errors='replace')
-            stream.write(msg + self.terminator)
-            self.flush()
-
-# Configure logging with UTF-8 encoding
-file_handler = logging.FileHandler('bot.log', encoding='utf-8')
-console_handler = UnicodeHandler()
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s:%(message)s',
-    handlers=[console_handler, file_handler]
-)
-
-# Ensure the console handler uses UTF-8 encoding
-for handler in logging.getLogger().handlers:
-    if isinstance(handler, logging.StreamHandler):
-        handler.stream = open(handler.stream.fileno(), 'w', encoding='utf-8', closefd=False)
@@ -0,0 +1,41 @@
+import discord
+from discord.ext import commands
+from bot_commands.cluster_ipc import cluster_client
+from bot_commands.restart import OWNER_ID
+
+class Cluster(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name='clusterstats', help='Shows shards and guilds of every cluster process (owner only)')
+    async def clusterstats(self, ctx):
+        if ctx.author.id != OWNER_ID:
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        results = await cluster_client.request('stats')
+        embed = discord.Embed(title="Cluster Stats", color=discord.Color.blurple())
+        guilds = members = 0
+        for result in sorted(results, key=lambda result: result['cluster']):
+            stats = result.get('result')
+            if stats is None:
+                embed.add_field(name=f"Cluster {result['cluster']}", value=f"Unavailable: {result.get('error')}", inline=False)
+                continue
+            guilds += stats['guilds']
+            members += stats['members']
+            latency = f"{stats['latency_ms']:.0f}ms" if stats['latency_ms'] is not None else "n/a"
+            shards = stats['shards']
+            shard_range = f"{shards[0]}-{shards[-1]}" if len(shards) > 1 else str(shards[0])
+            embed.add_field(
+                name=f"Cluster {result['cluster']}" + (" (this one)" if result['cluster'] == cluster_client.cluster_id else ""),
+                value=(
+                    f"Shards: `{shard_range}` of `{stats['shard_count']}` Latency: `{latency}`\n"
+                    f"Guilds: `{stats['guilds']}` Members: `{stats['members']}` Voice: `{stats['voice']}`"
+                ),
+                inline=False
+            )
+        embed.set_footer(text=f"{len(results)} clusters, {guilds} guilds, {members} members")
+        await ctx.send(embed=embed)
+
+async def setup(bot):
+    await bot.add_cog(Cluster(bot))
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+# Set by cluster.py for every worker process it starts
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', 0))
+CLUSTER_IPC = os.getenv('CLUSTER_IPC')  # host:port of the supervisor
+CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+# Clusters that don't answer a query in time are reported as timed out
+CLUSTER_QUERY_TIMEOUT = 10.0
+CLUSTER_RECONNECT_DELAY = 2.0
+
+def cluster_path(path):
+    """path with the cluster ID added before its extension when running under cluster.py.
+
+    Cluster processes share the working directory, so files each of them writes need their own name.
+    """
+    if os.getenv('CLUSTER_ID') is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{CLUSTER_ID}{extension}"
+
+class ClusterClient:
+    """Worker side of the IPC channel to the cluster supervisor.
+
+    request() runs a named handler in every cluster process and returns their results.
+    Outside a cluster only this process is asked, so callers work the same either way.
+    Messages are JSON lines:
+
+        worker -> supervisor: hello, ready, query (fan out), response (to a request)
+        supervisor -> worker: request (run a handler), results (answers to a query)
+    """
+
+    def __init__(self):
+        self.enabled = CLUSTER_IPC is not None
+        self.cluster_id = CLUSTER_ID
+        self.bot = None
+        self.handlers = {'stats': self.stats}
+        self._writer = None
+        self._connected = asyncio.Event()
+        self._pending = {}  # query ID -> future of the results
+        self._task = None
+
+    async def start(self, bot):
+        self.bot = bot
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._writer:
+            self._writer.close()
+
+    def _send(self, op, **fields):
+        if self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(json.dumps({'op': op, **fields}).encode() + b'\n')
+        return True
+
+    async def _run(self):
+        host, port = CLUSTER_IPC.rsplit(':', 1)
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, int(port), limit=1024 * 1024)
+            except OSError as e:
+                logging.warning(f"Could not reach the cluster supervisor: {e}")
+                await asyncio.sleep(CLUSTER_RECONNECT_DELAY)
+                continue
+
+            self._writer = writer
+            self._send('hello', cluster=self.cluster_id, secret=CLUSTER_SECRET)
+            self._connected.set()
+            logging.info(f"Cluster {self.cluster_id} connected to the supervisor")
+            try:
+                while line := await reader.readline():
+                    self._handle(json.loads(line))
+            except (ConnectionError, ValueError) as e:
+                logging.error(f"Cluster IPC connection failed: {e}")
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("Lost the connection to the cluster supervisor."))
+                self._pending.clear()
+            await asyncio.sleep(CLUSTER_RECONNECT_DELAY)
+
+    def _handle(self, message):
+        op = message['op']
+        if op == 'request':
+            asyncio.create_task(self._answer(message))
+        elif op == 'results':
+            future = self._pending.pop(message['id'], None)
+            if future and not future.done():
+                future.set_result(message['results'])
+
+    async def _answer(self, message):
+        result = await self.run_handler(message['name'], message.get('fields', {}))
+        self._send('response', id=message['id'], result=result)
+
+    async def run_handler(self, name, fields):
+        handler = self.handlers.get(name)
+        if handler is None:
+            return {'cluster': self.cluster_id, 'error': f"No handler for {name}"}
+        try:
+            return {'cluster': self.cluster_id, 'result': await handler(**fields)}
+        except Exception as e:
+            logging.error(f"Cluster handler {name} failed: {e}")
+            return {'cluster': self.cluster_id, 'error': str(e) or type(e).__name__}
+
+    async def request(self, name, timeout=CLUSTER_QUERY_TIMEOUT, **fields):
+        """Run handler name in every cluster, returns [{'cluster', 'result' or 'error'}]."""
+        if not self.enabled:
+            return [await self.run_handler(name, fields)]
+        await asyncio.wait_for(self._connected.wait(), timeout)
+        query_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[query_id] = future
+        if not self._send('query', id=query_id, name=name, fields=fields, timeout=timeout):
+            self._pending.pop(query_id, None)
+            raise ConnectionError("Not connected to the cluster supervisor.")
+        try:
+            # The supervisor answers for clusters that time out, the margin covers the round trip
+            return await asyncio.wait_for(future, timeout + 5)
+        finally:
+            self._pending.pop(query_id, None)
+
+    def post_ready(self):
+        if self.bot is not None:
+            self._send('ready', cluster=self.cluster_id, shards=self.shard_ids(), guilds=len(self.bot.guilds))
+
+    def shard_ids(self):
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        if shard_ids is None:
+            return list(range(self.bot.shard_count or 1))
+        return list(shard_ids)
+
+    async def stats(self):
+        bot = self.bot
+        return {
+            'shards': self.shard_ids(),
+            'shard_count': bot.shard_count or 1,
+            'guilds': len(bot.guilds),
+            'members': sum(guild.member_count or 0 for guild in bot.guilds),
+            'voice': len(bot.voice_clients),
+            'latency_ms': bot.latency * 1000 if bot.latency == bot.latency else None,  # NaN before the first heartbeat
+        }
+
+# Kept across extension reloads, the connection belongs to the process
+cluster_client = ClusterClient()
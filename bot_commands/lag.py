@@ -0,0 +1,51 @@
+import discord
+from discord.ext import commands
+from bot_commands.lag_monitor import lag_monitor, LAG_THRESHOLD_MS
+from bot_commands.restart import OWNER_ID
+
+# Offenders listed by !lag, newest first
+SHOWN_OFFENDERS = 10
+
+class Lag(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name='lag', help="Shows event loop lag and what blocked the loop, or a stack with !lag <number> (owner only)")
+    async def lag(self, ctx, number: int = None):
+        if ctx.author.id != OWNER_ID:
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        offenders = list(reversed(lag_monitor.offenders))
+        if number is not None:
+            if not 1 <= number <= len(offenders):
+                await ctx.send(f"There is no stall number {number}, {len(offenders)} are kept.")
+                return
+            offender = offenders[number - 1]
+            # Keep the end of the stack, the blocking call is the innermost frame
+            stack = offender['stack'][-1800:]
+            await ctx.send(f"Stall {number}: `{offender['lag_ms']:.0f}ms` in `{offender['where']}`\n```py\n{stack}```")
+            return
+
+        stats = lag_monitor.summary()
+        embed = discord.Embed(title="Event Loop Lag", color=discord.Color.blurple())
+        embed.add_field(
+            name="Heartbeat",
+            value=(
+                f"Beats: `{stats['beats']}` Stalls over {LAG_THRESHOLD_MS:.0f}ms: `{stats['stalls']}`\n"
+                f"Lag: p50 `{stats['lag_p50_ms']:.0f}ms` p99 `{stats['lag_p99_ms']:.0f}ms` max `{stats['lag_max_ms']:.0f}ms`"
+            ),
+            inline=False
+        )
+        lines = []
+        for number, offender in enumerate(offenders[:SHOWN_OFFENDERS], start=1):
+            source = offender['command'] or offender['task'] or "callback"
+            lines.append(
+                f"`{number}.` `{offender['lag_ms']:.0f}ms` <t:{int(offender['when'])}:R> `{offender['where']}` ({source})"
+            )
+        # Field values are limited to 1024 characters
+        embed.add_field(name="Recent stalls", value="\n".join(lines)[:1024] or "None", inline=False)
+        await ctx.send(embed=embed)
+
+async def setup(bot):
+    await bot.add_cog(Lag(bot))
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from bot_commands.histogram import Histogram
+
+# How often the loop is asked to run the heartbeat, the lag is how late it ran
+BEAT_INTERVAL = 0.05
+# How often the watchdog thread checks the heartbeat, well below the threshold so no stall is missed
+WATCH_INTERVAL = 0.02
+# Stalls longer than this have the blocking stack captured
+LAG_THRESHOLD_MS = 200.0
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 200, 500, 1000, 5000)
+MAX_OFFENDERS = 50
+STACK_DEPTH = 15
+
+THIS_FILE = os.path.abspath(__file__)
+REPO_ROOT = os.path.dirname(os.path.dirname(THIS_FILE))
+
+class LagMonitor:
+    """Measures how late the event loop runs a heartbeat and catches what blocks it.
+
+    A watchdog thread checks the heartbeat. When it is more than LAG_THRESHOLD_MS late the
+    loop is still blocked, so the loop thread's stack is the code blocking it. The stack is
+    kept with the running task and command in a ring buffer shown by !lag.
+    """
+
+    def __init__(self):
+        self.lag = Histogram(LAG_BUCKETS_MS)
+        self.offenders = deque(maxlen=MAX_OFFENDERS)
+        self.stalls = 0
+        self._commands = weakref.WeakKeyDictionary()  # task -> command it is invoking
+        self._loop = None
+        self._loop_thread = None
+        self._last_beat = 0.0
+        self._stall = None  # offender being recorded while the loop is blocked
+        self._lock = threading.Lock()
+        self._beat_task = None
+
+    def start(self):
+        """Start monitoring the running loop, call from a coroutine on it."""
+        if self._beat_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._beat_task = asyncio.create_task(self._beat())
+        threading.Thread(target=self._watch, name='lag-watchdog', daemon=True).start()
+
+    async def note_command(self, ctx):
+        """Bot.before_invoke hook, so a stall in a command's task is attributed to the command."""
+        task = asyncio.current_task()
+        if task is not None and ctx.command is not None:
+            self._commands[task] = f"!{ctx.command.qualified_name}"
+
+    async def _beat(self):
+        while True:
+            expected = time.perf_counter() + BEAT_INTERVAL
+            await asyncio.sleep(BEAT_INTERVAL)
+            now = time.perf_counter()
+            lag_ms = max(0.0, (now - expected) * 1000)
+            self.lag.observe(lag_ms)
+            with self._lock:
+                self._last_beat = now
+                stall, self._stall = self._stall, None
+            if stall is not None:
+                stall['lag_ms'] = lag_ms
+                logging.warning(
+                    f"Event loop blocked for {lag_ms:.0f}ms in {stall['where']}"
+                    + (f" ({stall['command']})" if stall['command'] else "")
+                )
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            with self._lock:
+                blocked_ms = (time.perf_counter() - self._last_beat - BEAT_INTERVAL) * 1000
+                if blocked_ms < LAG_THRESHOLD_MS or self._stall is not None:
+                    continue
+                stall = self._stall = self._capture(blocked_ms)
+            self.stalls += 1
+            self.offenders.append(stall)
+
+    def _capture(self, blocked_ms):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.extract_stack(frame) if frame is not None else []
+        # A plain callback runs outside any task
+        task = asyncio.current_task(self._loop)
+        return {
+            'when': time.time(),
+            'lag_ms': blocked_ms,  # Replaced with the whole stall once the loop runs the heartbeat again
+            'where': self._where(stack),
+            'task': task.get_name() if task is not None else None,
+            'command': self._commands.get(task) if task is not None else None,
+            'stack': ''.join(traceback.format_list(stack[-STACK_DEPTH:])),
+        }
+
+    @staticmethod
+    def _where(stack):
+        """The innermost frame in the bot's own code, otherwise the innermost frame."""
+        for entry in reversed(stack):
+            if entry.filename.startswith(REPO_ROOT) and entry.filename != THIS_FILE:
+                return f"{os.path.relpath(entry.filename, REPO_ROOT)}:{entry.lineno} in {entry.name}"
+        if stack:
+            return f"{os.path.basename(stack[-1].filename)}:{stack[-1].lineno} in {stack[-1].name}"
+        return "unknown"
+
+    def summary(self):
+        return {
+            'beats': self.lag.count,
+            'stalls': self.stalls,
+            'lag_p50_ms': self.lag.percentile(0.5),
+            'lag_p99_ms': self.lag.percentile(0.99),
+            'lag_max_ms': self.lag.max,
+        }
+
+# Started once in setup_hook and kept across extension reloads
+lag_monitor = LagMonitor()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+import discord
+
+# Which members discord.py keeps in memory (.env MEMBER_CACHE):
+#   full  - every member, guilds are chunked at startup. Memory grows with the total member count
+#   voice - only members in voice channels, which the music cog needs, no chunking (default)
+#   none  - no members beyond the bot itself, no chunking
+DEFAULT_MEMBER_CACHE = 'voice'
+MEMBER_CACHE_POLICIES = {
+    'full': (discord.MemberCacheFlags.all, True),
+    'voice': (lambda: discord.MemberCacheFlags(voice=True, joined=False), False),
+    'none': (discord.MemberCacheFlags.none, False),
+}
+
+# Members fetched over the API for events whose member isn't cached
+MEMBER_LRU_SIZE = 1024
+MEMBER_LRU_TTL = 300.0  # seconds, roles seen by the bot can be this stale
+
+def member_cache_options():
+    """Keyword arguments for the bot's member_cache_flags and chunk_guilds_at_startup."""
+    policy = os.getenv('MEMBER_CACHE', DEFAULT_MEMBER_CACHE).lower()
+    if policy not in MEMBER_CACHE_POLICIES:
+        logging.warning(f"Unknown MEMBER_CACHE policy {policy}, using {DEFAULT_MEMBER_CACHE}")
+        policy = DEFAULT_MEMBER_CACHE
+    flags, chunk = MEMBER_CACHE_POLICIES[policy]
+    return {'member_cache_flags': flags(), 'chunk_guilds_at_startup': chunk}
+
+class MemberResolver:
+    """Looks a member up in discord.py's cache, then in a small LRU of fetched members, then fetches it."""
+
+    def __init__(self, max_size=MEMBER_LRU_SIZE, ttl=MEMBER_LRU_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._members = OrderedDict()  # (guild ID, user ID) -> (member, fetched at)
+        self._fetching = {}  # (guild ID, user ID) -> task, so concurrent events fetch once
+        self.hits = 0
+        self.fetches = 0
+
+    async def resolve(self, guild, user_id, member=None):
+        """The member for user_id in guild, or None if they left. member is used when the event carried one."""
+        if member is not None:
+            return member
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+
+        key = (guild.id, user_id)
+        cached = self._members.get(key)
+        if cached is not None:
+            if time.monotonic() - cached[1] < self.ttl:
+                self._members.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            del self._members[key]
+
+        task = self._fetching.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(guild, user_id))
+            self._fetching[key] = task
+            task.add_done_callback(lambda _: self._fetching.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, guild, user_id):
+        self.fetches += 1
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            return None
+        except discord.HTTPException as e:
+            logging.error(f"Could not fetch member {user_id} in guild {guild.id}: {e}")
+            return None
+        key = (guild.id, user_id)
+        self._members[key] = (member, time.monotonic())
+        self._members.move_to_end(key)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+        return member
+
+    def forget(self, guild_id, user_id):
+        """Drop a fetched member whose roles the bot just changed."""
+        self._members.pop((guild_id, user_id), None)
+
+# Shared by the cogs and kept across extension reloads
+member_resolver = MemberResolver()
@@ -1,61 +1,179 @@
 import discord
 from discord.ext import commands, tasks
 from discord.ui import View, Button, Modal, TextInput
-import yt_dlp
+import io
+import os
 import shutil
 import logging
-import requests
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
-from fake_useragent import UserAgent
 import re
+import json
+import time
 import asyncio
+import random
+from collections import Counter
+from bot_commands.music_audio import GaplessSource, PrebufferedSource, open_ffmpeg_source, PREROLL_SECONDS
+from bot_commands.music_audio_cache import audio_cache
+from bot_commands.music_node_client import audio_nodes, NodeVoiceClient, AudioNodeUnavailable
+from bot_commands.music_filters import EQ_PRESETS, VOLUME_MIN, VOLUME_MAX
+from bot_commands.music_metrics import MeteredSource, playback_totals, host_load, export_prometheus
+from bot_commands.music_cache import metadata_cache, inflight_lookups, normalize_url, normalize_query, stream_ttl, METADATA_TTL
+from bot_commands.music_extractor import extractor_pool
+from bot_commands.music_spotify import spotify_scraper, spotify_track_id, spotify_collection
+from bot_commands.music_queue import FIELD_LIMIT
+from bot_commands.music_scheduler import ProgressScheduler, PROGRESS_INTERVAL, PROGRESS_WHEEL_SLOTS, SLOW_EDIT_SECONDS
+from bot_commands.music_state import GuildState, GUILD_STATE_IDLE_TIMEOUT
+from bot_commands.restart import OWNER_ID
+
+# How many upcoming queue entries get their stream URL resolved ahead of time.
+# Stream URLs expire, so keep this small.
+PREFETCH_DEPTH = 1
+
+# Playlists are enumerated in chunks, playback starts once the first chunk is queued
+PLAYLIST_FIRST_CHUNK = 10
+# How many URLs (or playlist chunks) are looked up at the same time while filling the queue
+INGEST_CONCURRENCY = 4
+# Refresh the controls embed after this many URLs have been queued
+INGEST_PROGRESS_EVERY = 5
+
+# State changes within this many seconds are rendered into a single embed edit
+EMBED_DEBOUNCE = 0.75
+
+FFMPEG_OPTIONS = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn',
+}
+# Streams in these codecs are sent to Discord as they are, everything else is decoded to PCM and encoded by discord.py
+PASSTHROUGH_CODECS = ('opus',)
+# A lost voice connection is retried this many times with full jitter backoff, up to BACKOFF_MAX between tries
+VOICE_RECOVERY_ATTEMPTS = 6
+VOICE_RECOVERY_BACKOFF_BASE = 1.0
+VOICE_RECOVERY_BACKOFF_MAX = 20.0
+# How long discord.py gets to either reconnect or drop its voice client after the gateway reports the bot left voice
+VOICE_DISCONNECT_SETTLE = 3.0
+
+def cleanup_opened_source(future):
+    """Done callback for a source opened for a caller that was cancelled meanwhile."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().cleanup()
 
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.guild_states = {}  # Dictionary to hold the state for each guild
         self.ffmpeg_path = shutil.which("ffmpeg") or r'C:\\Program Files\\ffmpeg-7.0.1-essentials_build\\ffmpeg-7.0.1-essentials_build\\bin\\ffmpeg.exe'
+        self.progress_scheduler = ProgressScheduler()
         logging.info("Music Cog initialized")
 
         self.update_embed_task.start()
-
-    def cog_unload(self):
+        self.save_cache_task.start()
+        self.evict_idle_task.start()
+
+    async def cog_load(self):
+        # One persistent view handles the buttons of every controls embed, including those sent before
+        # a restart. Registering it again on reload replaces the previous one, so the view store stays constant.
+        self.bot.add_view(MusicControlView())
+        # Embeds are sent with a stopped copy, which renders the buttons without being stored per message
+        self.controls_view = MusicControlView()
+        self.controls_view.stop()
+        if audio_nodes.enabled:
+            await audio_nodes.start(self.ffmpeg_path)
+
+    async def cog_unload(self):
         self.update_embed_task.cancel()
+        self.evict_idle_task.cancel()
+        for guild_state in self.guild_states.values():
+            guild_state.release()
+        self.save_cache_task.cancel()
+        metadata_cache.save()
+        spotify_scraper.track_map.save()
+        audio_cache.save()
+        await spotify_scraper.close()
 
     def get_guild_state(self, guild_id):
-        """Get the state for the specified guild."""
-        if guild_id not in self.guild_states:
-            self.guild_states[guild_id] = {
-                'is_playing': False,
-                'is_paused': False,
-                'current_channel': None,
-                'queue': [],
-                'current_song': None,
-                'embed_message': None,
-                'embed_update_pending': False,
-                'song_start_time': None,
-                'song_duration': 0,
-                'paused_time': None,
-                'elapsed_paused_time': 0,
-            }
-        return self.guild_states[guild_id]
-
-    @tasks.loop(seconds=10.0)
-    async def update_embed_task(self):
-        for guild_id in self.guild_states:
-            guild_state = self.get_guild_state(guild_id)
-            if guild_state['is_playing'] and guild_state['embed_message']:
-                await self.update_progress_bar(guild_id)
+        """Get the state for the specified guild.
 
-    async def update_progress_bar(self, guild_id):
+        Looking it up doesn't count as activity, only commands and button presses keep it
+        from being evicted, so background refreshes of a forgotten embed don't.
+        """
+        guild_state = self.guild_states.get(guild_id)
+        if guild_state is None:
+            guild_state = self.guild_states[guild_id] = GuildState()
+        return guild_state
+
+    async def cog_before_invoke(self, ctx):
+        if ctx.guild is not None:
+            self.get_guild_state(ctx.guild.id).touch()
+
+    @tasks.loop(seconds=PROGRESS_INTERVAL / PROGRESS_WHEEL_SLOTS)
+    async def update_embed_task(self):
+        # Each tick only refreshes the guilds in the current slot of the progress wheel
+        started = time.perf_counter()
+        due = self.progress_scheduler.advance()
+        results = await asyncio.gather(*(self.refresh_progress(guild_id) for guild_id in due))
+
+        edits = sum(1 for edited, _ in results if edited)
+        slow = sum(1 for _, was_slow in results if was_slow)
+        if self.progress_scheduler.record_tick(time.perf_counter() - started, edits, len(results) - edits, slow):
+            self.update_embed_task.change_interval(seconds=self.progress_scheduler.tick_interval)
+
+    async def refresh_progress(self, guild_id):
+        """Refresh one guild's progress bar, returns (edited, slow)."""
+        guild_state = self.guild_states.get(guild_id)
+        if not guild_state or not guild_state.current_song or not guild_state.embed_message:
+            self.progress_scheduler.discard(guild_id)
+            return False, False
+        if not guild_state.is_playing:
+            return False, False
+
+        started = time.perf_counter()
+        try:
+            edited = await self.update_progress_bar(guild_id)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to update progress bar: {e}")
+            return False, e.status == 429
+        return edited, time.perf_counter() - started > SLOW_EDIT_SECONDS
+
+    @tasks.loop(minutes=5.0)
+    async def evict_idle_task(self):
+        for guild_id, guild_state in list(self.guild_states.items()):
+            guild = self.bot.get_guild(guild_id)
+            if guild_state.is_playing and guild and not self.voice_connected(guild):
+                # Claims to play without a voice connection, the disconnect was missed somehow
+                self.start_recovery(guild)
+
+            if guild_state.is_playing or guild_state.recovery_task or guild_state.idle_for() < GUILD_STATE_IDLE_TIMEOUT:
+                continue
+
+            voice_client = guild.voice_client if guild else None
+            if voice_client is not None:
+                if voice_client.is_playing():
+                    continue
+                # Disconnecting also stops a paused player and its ffmpeg process
+                guild_state.leaving = True
+                await voice_client.disconnect()
+                logging.info(f"Left idle voice channel in guild {guild_id}")
+
+            if self.guild_states.get(guild_id) is guild_state:
+                guild_state.release()
+                del self.guild_states[guild_id]
+                self.progress_scheduler.discard(guild_id)
+                logging.info(f"Evicted idle music state of guild {guild_id}")
+
+    @tasks.loop(minutes=5.0)
+    async def save_cache_task(self):
+        await asyncio.to_thread(metadata_cache.save)
+        await asyncio.to_thread(spotify_scraper.track_map.save)
+        await asyncio.to_thread(audio_cache.save)
+
+    def build_controls_embed(self, guild_id):
         guild_state = self.get_guild_state(guild_id)
         progress, elapsed_time, total_time = self.get_song_progress(guild_id)
         progress_bar = self.format_progress_bar(progress)
 
         embed = discord.Embed(
             title="🎶 Music Controls 🎶", 
-            description=f"**Now playing:** `{guild_state['current_song'] if guild_state['current_song'] else 'None'}`", 
+            description=f"**Now playing:** `{guild_state.current_song if guild_state.current_song else 'None'}`", 
             color=discord.Color.blurple()
         )
         embed.add_field(
@@ -64,26 +182,170 @@ class Music(commands.Cog):
             inline=False
         )
 
-        if guild_state['queue']:
-            queue_list = "\n".join([f"{i+1}. {title}" for i, (_, title, _) in enumerate(guild_state['queue'])])
-            embed.add_field(name="📜 Queue", value=queue_list, inline=False)
-        else:
-            embed.add_field(name="📜 Queue", value="No songs in queue.", inline=False)
+        embed.add_field(name="📜 Queue", value=self.queue_page_text(guild_state.queue, 0), inline=False)
+
+        for ingest in guild_state.ingests:
+            embed.add_field(
+                name="📥 " + ingest['label'],
+                value=f"{ingest['done']}/{ingest['total']} loaded, {ingest['queued']} songs queued",
+                inline=False
+            )
 
         embed.set_footer(text="Use the buttons below to control the music.")
+        return embed
 
-        if guild_state['embed_message']:
-            try:
-                # Edit the existing embed message
-                await guild_state['embed_message'].edit(embed=embed)
-                logging.info("Updated progress bar in existing embed")
-            except discord.errors.NotFound:
-                logging.error("Embed message not found. It might have been deleted.")
-                guild_state['embed_message'] = None
+    async def update_progress_bar(self, guild_id):
+        if await self.render_controls(guild_id, send_if_missing=False):
+            logging.info("Updated progress bar in existing embed")
+            return True
+        return False
+
+    @commands.command(name="musicstats", help="Shows music subsystem statistics (owner only)")
+    async def musicstats(self, ctx):
+        if ctx.author.id != OWNER_ID:
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        stats = metadata_cache.stats()
+        embed = discord.Embed(title="🎶 Music Stats 🎶", color=discord.Color.blurple())
+        state_bytes = sum(guild_state.memory_size() for guild_state in self.guild_states.values())
+        embed.add_field(
+            name="Guild states",
+            value=(
+                f"States: `{len(self.guild_states)}` "
+                f"Playing: `{sum(1 for guild_state in self.guild_states.values() if guild_state.is_playing)}` "
+                f"Size: `{state_bytes / 1024:.1f} KiB`"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="Metadata cache",
+            value=(
+                f"Entries: `{stats['entries']}`\n"
+                f"Hits: `{stats['hits']}` Misses: `{stats['misses']}` ({stats['hit_rate']:.0%})\n"
+                f"Evictions: `{stats['evictions']}`"
+            ),
+            inline=False
+        )
+        lookups = inflight_lookups.stats()
+        embed.add_field(
+            name="Lookups",
+            value=f"In flight: `{lookups['in_flight']}` Started: `{lookups['started']}` Coalesced: `{lookups['coalesced']}`",
+            inline=False
+        )
+        extractor = extractor_pool.stats()
+        embed.add_field(
+            name="Extractor pool",
+            value=(
+                f"Workers: `{extractor['workers']}` Pending: `{extractor['pending']}`\n"
+                f"Completed: `{extractor['completed']}` Failed: `{extractor['failed']}` "
+                f"Timeouts: `{extractor['timeouts']}` Rejected: `{extractor['rejected']}`"
+            ),
+            inline=False
+        )
+        spotify = spotify_scraper.stats()
+        embed.add_field(
+            name="Spotify",
+            value=(
+                f"Requests: `{spotify['requests']}` Retries: `{spotify['retries']}` Full parses: `{spotify['full_parses']}`\n"
+                f"Mapped tracks: `{spotify['mapped_tracks']}` Hits: `{spotify['map_hits']}` Misses: `{spotify['map_misses']}`"
+            ),
+            inline=False
+        )
+        progress = self.progress_scheduler.stats()
+        embed.add_field(
+            name="Progress refresh",
+            value=(
+                f"Guilds: `{progress['guilds']}` Period: `{progress['period']:.0f}s` Pressure: `{progress['pressure']}`\n"
+                f"Tick: last `{progress['last_tick_ms']:.1f}ms` avg `{progress['avg_tick_ms']:.1f}ms` max `{progress['max_tick_ms']:.1f}ms`\n"
+                f"Edits: `{progress['edits']}` Unchanged: `{progress['skipped']}` Slow: `{progress['slow_edits']}`"
+            ),
+            inline=False
+        )
+        paths = Counter()
+        for guild_state in self.guild_states.values():
+            paths.update(guild_state.source_paths)
+        here = self.guild_states[ctx.guild.id].source_paths if ctx.guild and ctx.guild.id in self.guild_states else Counter()
+        embed.add_field(
+            name="Playback paths",
+            value=(
+                f"Opus passthrough: `{paths['opus']}` PCM transcode: `{paths['pcm']}` Disk: `{paths['disk']}`\n"
+                f"This guild: `{here['opus']}` passthrough, `{here['pcm']}` transcoded, `{here['disk']}` from disk"
+            ),
+            inline=False
+        )
+        disk = audio_cache.stats()
+        embed.add_field(
+            name="Audio cache",
+            value=(
+                f"Songs: `{disk['songs']}` Size: `{disk['bytes'] / 1024 / 1024:.0f}/{disk['max_bytes'] / 1024 / 1024:.0f} MiB` "
+                f"Downloading: `{disk['downloading']}`\n"
+                f"Hits: `{disk['hits']}` Misses: `{disk['misses']}` Stored: `{disk['stored']}` "
+                f"Evictions: `{disk['evictions']}` Failed: `{disk['failed']}`"
+            ) if disk['enabled'] else "Disabled",
+            inline=False
+        )
+        if audio_nodes.enabled:
+            embed.add_field(
+                name="Audio nodes",
+                value="\n".join(
+                    f"Node {index}: {'up' if node['alive'] else 'down'} PID `{node['pid']}` Guilds: `{node['guilds']}` "
+                    f"Restarts: `{node['restarts']}` Sent: `{node['sent']}` Received: `{node['received']}`"
+                    for index, node in enumerate(audio_nodes.stats())
+                ) or "Not started",
+                inline=False
+            )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="playbackstats", help="Shows audio playback health, or exports it with 'export' (owner only)")
+    async def playbackstats(self, ctx, mode: str = None):
+        if ctx.author.id != OWNER_ID:
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        if mode == 'export':
+            metrics = {'all': playback_totals}
+            metrics.update({guild_id: guild_state.metrics for guild_id, guild_state in self.guild_states.items()})
+            data = io.BytesIO(export_prometheus(metrics).encode())
+            await ctx.send(file=discord.File(data, filename="playback_metrics.prom"))
+            return
+
+        embed = discord.Embed(title="🎶 Playback Health 🎶", color=discord.Color.blurple())
+        here = self.guild_states[ctx.guild.id].metrics if ctx.guild and ctx.guild.id in self.guild_states else None
+        for name, metrics in (("All guilds", playback_totals), ("This guild", here)):
+            if metrics is None:
+                continue
+            stats = metrics.summary()
+            embed.add_field(
+                name=name,
+                value=(
+                    f"Frames: `{stats['frames']}` Late: `{stats['late_frames']}` Dropped: `{stats['dropped_frames']}` "
+                    f"Underruns: `{stats['underruns']}`\n"
+                    f"Frame read: p50 `{stats['frame_read_p50_ms']:.1f}ms` p99 `{stats['frame_read_p99_ms']:.1f}ms` "
+                    f"max `{stats['frame_read_max_ms']:.1f}ms`\n"
+                    f"Tracks: `{stats['tracks']}` First audio: p50 `{stats['first_audio_p50_ms']:.0f}ms` "
+                    f"max `{stats['first_audio_max_ms']:.0f}ms`\n"
+                    f"Resolve wait: p50 `{stats['resolve_wait_p50_ms']:.0f}ms` max `{stats['resolve_wait_max_ms']:.0f}ms`"
+                ),
+                inline=False
+            )
+        load = host_load()
+        load_average = " ".join(f"{value:.2f}" for value in load['load_average']) if load['load_average'] else "n/a"
+        embed.add_field(
+            name="Host",
+            value=(
+                f"ffmpeg processes: `{load['ffmpeg_processes']}` Threads: `{load['threads']}`\n"
+                f"Load average: `{load_average}` CPU time: `{load['process_cpu_seconds']:.0f}s`"
+            ),
+            inline=False
+        )
+        if audio_nodes.enabled:
+            embed.set_footer(text="Frames and ffmpeg processes of audio nodes are not included")
+        await ctx.send(embed=embed)
 
     def is_valid_spotify_url(self, url: str) -> bool:
-        """Check if the given URL is a valid Spotify track URL."""
-        return re.match(r'https?://open\.spotify\.com/track/[a-zA-Z0-9]+', url) is not None
+        """Check if the given URL is a valid Spotify track, album or playlist URL."""
+        return re.match(r'https?://open\.spotify\.com/(intl-\w+/)?(track|album|playlist)/[a-zA-Z0-9]+', url) is not None
 
     @commands.command(name="play", help="Plays a song from a YouTube or Spotify URL, or shows the current queue if no URL is provided")
     async def play(self, ctx, url: str = None):
@@ -93,21 +355,22 @@ class Music(commands.Cog):
         guild_state = self.get_guild_state(guild_id)
 
         if url is None:
-            await self.send_or_update_embed(ctx)
+            await self.send_or_update_embed(ctx, resend=True)
             return
 
         if 'spotify' in url and not self.is_valid_spotify_url(url):
-            await ctx.send("Invalid Spotify URL. Please provide a valid Spotify track URL.")
+            await ctx.send("Invalid Spotify URL. Please provide a valid Spotify track, album or playlist URL.")
             logging.warning("Invalid Spotify URL provided")
             return
 
-        guild_state['current_channel'] = ctx.author.voice.channel
-        if not guild_state['current_channel']:
+        guild_state.current_channel = ctx.author.voice.channel
+        if not guild_state.current_channel:
             await ctx.send("You need to be in a voice channel to play music.")
             logging.warning("User not in a voice channel")
             return
 
-        await self.join(ctx)
+        if not await self.join(ctx):
+            return
         
         if 'spotify' in url:
             await self.process_spotify_url(ctx, url)
@@ -116,111 +379,364 @@ class Music(commands.Cog):
         
         await self.send_or_update_embed(ctx)
 
-    async def fetch_spotify_track_info(self, url: str):
-        def fetch_info():
-            ua = UserAgent()
-            headers = {
-                "User-Agent": ua.random
-            }
-            response = requests.get(url, headers=headers)
-            if response.status_code != 200:
-                raise Exception(f"Status code {response.status_code}")
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Attempt to extract the song title and artist name
-            track_title_meta = soup.find('meta', property='og:title')
-            track_artist_meta = soup.find('meta', property='og:description')
-
-            track_title = track_title_meta['content'] if track_title_meta else None
-            track_artist = track_artist_meta['content'].split(' · ')[0] if track_artist_meta else None
-
-            if not track_title or not track_artist:
-                if not track_title:
-                    track_title = soup.title.string if soup.title else None
-                if not track_artist:
-                    possible_artist_selectors = [
-                        'meta[property="music:musician"]',
-                        'meta[name="twitter:audio:artist_name"]',
-                        'meta[property="og:audio:artist"]',
-                        'div.creator-name',
-                        'span[data-testid="creator-link"]',
-                        'a[href*="/artist/"]'
-                    ]
-                    for selector in possible_artist_selectors:
-                        artist_tag = soup.select_one(selector)
-                        if artist_tag:
-                            track_artist = artist_tag.get('content') or artist_tag.text.strip()
-                            if track_artist:
-                                break
-                if not track_title or not track_artist:
-                    raise Exception("Title or artist not found")
-
-            return f"{track_title} {track_artist}"
-
-        max_retries = 10
-        for attempt in range(max_retries):
-            try:
-                return await asyncio.to_thread(fetch_info)
-            except Exception as e:
-                logging.error(f"Encountered error: {str(e)}. Retrying: {attempt + 1}/{max_retries}")
-                if attempt == max_retries - 1:
-                    raise Exception(f"Failed to fetch Spotify track information after {max_retries} retries: {str(e)}")
-
     async def process_spotify_url(self, ctx, url: str):
-        guild_id = ctx.guild.id
-        guild_state = self.get_guild_state(guild_id)
-        
-        if 'track' in url:
+        collection = spotify_collection(url)
+        if collection:
+            kind = collection[0]
             try:
-                track_info = await self.fetch_spotify_track_info(url)
-                youtube_url = await self.search_youtube(track_info)
-                await self.process_url(ctx, youtube_url)
+                cache_key = f"spotify-list:{normalize_url(url)}"
+                track_urls = metadata_cache.get(cache_key)
+                if track_urls is None:
+                    track_urls = await inflight_lookups.do(cache_key, spotify_scraper.fetch_collection_tracks, url)
+                    metadata_cache.set(cache_key, track_urls, METADATA_TTL)
             except Exception as e:
                 await ctx.send(f"An error occurred while processing the Spotify URL: {str(e)}")
                 logging.error(f"An error occurred while processing the Spotify URL: {str(e)}")
+                return
+            label = f"Loading Spotify {kind}"
+        elif spotify_track_id(url):
+            track_urls = [url]
+            label = "Loading"
         else:
-            await ctx.send("Invalid Spotify URL. Only track URLs are supported.")
+            await ctx.send("Invalid Spotify URL. Only track, album and playlist URLs are supported.")
+            return
+
+        # Tracks are matched on YouTube concurrently and queued in order as they resolve
+        failed = await self.ingest(ctx, track_urls, label, loader=self.load_spotify_entries)
+        for track_url, error in failed:
+            logging.error(f"An error occurred while processing the Spotify URL {track_url}: {str(error)}")
+        if len(failed) == 1 and len(track_urls) == 1:
+            await ctx.send(f"An error occurred while processing the Spotify URL: {str(failed[0][1])}")
+        elif failed:
+            await ctx.send(f"Could not find {len(failed)} of {len(track_urls)} Spotify tracks on YouTube.")
+
+    async def load_spotify_entries(self, url, start=1):
+        youtube_url = await self.spotify_to_youtube(url)
+        return await self.load_entries(youtube_url)
+
+    async def spotify_to_youtube(self, url: str):
+        """Find the YouTube video for a Spotify track, remembering the match per track ID."""
+        track_id = spotify_track_id(url)
+        video_id = spotify_scraper.track_map.get(track_id) if track_id else None
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
+
+        track_info = await inflight_lookups.do(f"spotify:{track_id or url}", spotify_scraper.fetch_track_info, url)
+        youtube_url = await self.search_youtube(track_info)
+        if track_id:
+            spotify_scraper.track_map.set(track_id, normalize_url(youtube_url).split(':', 1)[1])
+        return youtube_url
 
     async def search_youtube(self, query: str):
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'noplaylist': True,
-            'quiet': True,
-            'default_search': 'ytsearch',
-            'extract_flat': 'in_playlist'
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, query, download=False)
-            video_url = f"https://www.youtube.com/watch?v={info['entries'][0]['id']}"
+        cache_key = f"search:{normalize_query(query)}"
+        video_url = metadata_cache.get(cache_key)
+        if video_url:
             return video_url
+        return await inflight_lookups.do(cache_key, self.extract_search_result, query, cache_key)
+
+    async def extract_search_result(self, query: str, cache_key: str):
+        info = await extractor_pool.extract('search', query)
+        video_url = f"https://www.youtube.com/watch?v={info['entries'][0]['id']}"
+        metadata_cache.set(cache_key, video_url, METADATA_TTL)
+        return video_url
 
     async def play_next(self, ctx):
         guild_id = ctx.guild.id
+        if not self.voice_connected(ctx.guild):
+            # The player stopped because the bot left or lost the voice channel, don't recreate evicted state
+            if guild_id in self.guild_states:
+                self.guild_states[guild_id].is_playing = False
+                self.start_recovery(ctx.guild)
+            return
         guild_state = self.get_guild_state(guild_id)
+        guild_state.play_ctx = ctx
+
+        # Claim the player before awaiting so concurrent process_url calls only queue
+        guild_state.is_playing = True
+        guild_state.is_paused = False
+
+        # Whatever was being pre-rolled did not make it in time, the entry is opened directly
+        self.cancel_preroll(guild_state)
 
-        if guild_state['queue']:
-            guild_state['is_playing'] = True
-            guild_state['is_paused'] = False
-            guild_state['paused_time'] = None
-            guild_state['elapsed_paused_time'] = 0
-            source, guild_state['current_song'], guild_state['song_duration'] = guild_state['queue'].pop(0)
-            guild_state['song_start_time'] = datetime.utcnow()
-            ctx.voice_client.play(source, after=lambda e: self.bot.loop.create_task(self.play_next(ctx)))
-            logging.info(f"Playing next song: {guild_state['current_song']}")
+        while guild_state.queue:
+            entry = guild_state.queue.popleft()
+            guild_state.metrics.track_opening()
+            url, song_title, duration = entry
+            # Set after a voice recovery, the interrupted song continues where it stopped
+            start, guild_state.resume_position = guild_state.resume_position, 0
+            try:
+                if audio_nodes.enabled:
+                    source = await self.source_spec(guild_id, url, duration, start)
+                else:
+                    source = await self.open_source(guild_id, url, duration, start)
+            except Exception as e:
+                await ctx.send(f"Could not play {song_title}: {str(e)}")
+                logging.error(f"Failed to open source for {url}: {str(e)}")
+                continue
+
+            if not self.voice_connected(ctx.guild):
+                # The connection dropped while the source was opening, keep the entry for the recovery
+                if not audio_nodes.enabled:
+                    source.cleanup()
+                guild_state.queue.appendleft(entry)
+                guild_state.resume_position = start
+                guild_state.is_playing = False
+                self.start_recovery(ctx.guild)
+                return
+
+            guild_state.paused_time = None
+            guild_state.elapsed_paused_time = 0
+            guild_state.current_song = song_title
+            guild_state.current_entry = entry
+            guild_state.song_duration = duration
+            guild_state.song_start_time = datetime.utcnow() - timedelta(seconds=start)
+            player = None
+            if not audio_nodes.enabled:
+                # The player keeps this source across tracks, pre-rolled tracks are switched to inside it
+                player = GaplessSource(
+                    source,
+                    max(0, duration - start),
+                    on_advance=lambda entry: self.bot.loop.call_soon_threadsafe(self.track_advanced, ctx, player, entry)
+                )
+            # Audio nodes open the source spec themselves and play tracks one by one
+            guild_state.player = player
+            # Local playback is timed frame by frame for !playbackstats
+            audio = MeteredSource(player, guild_state.metrics) if player else source
+            ctx.voice_client.play(audio, after=lambda e: self.bot.loop.create_task(self.play_next(ctx)))
+            logging.info(f"Playing next song: {guild_state.current_song}")
+            self.prefetch_upcoming(guild_id)
+            self.progress_scheduler.add(guild_id)
             await self.send_or_update_embed(ctx)
-        else:
-            guild_state['is_playing'] = False
-            guild_state['current_song'] = None
-            guild_state['song_start_time'] = None
-            await ctx.send("Queue is empty, no more songs to play.")
-            logging.info("Queue is empty")
+            return
+
+        guild_state.is_playing = False
+        guild_state.current_song = None
+        guild_state.current_entry = None
+        guild_state.song_start_time = None
+        guild_state.player = None
+        await ctx.send("Queue is empty, no more songs to play.")
+        logging.info("Queue is empty")
+        await self.send_or_update_embed(ctx)
+
+    def track_advanced(self, ctx, player, entry):
+        """Called on the event loop after the player switched to the pre-rolled entry."""
+        guild_state = self.guild_states.get(ctx.guild.id)
+        if guild_state is None or guild_state.player is not player:
+            return
+
+        guild_state.preroll_task = None
+        guild_state.preroll_entry = None
+        if guild_state.queue and guild_state.queue[0] == entry:
+            guild_state.queue.popleft()
+
+        _, song_title, duration = entry
+        guild_state.paused_time = None
+        guild_state.elapsed_paused_time = 0
+        guild_state.current_song = song_title
+        guild_state.current_entry = entry
+        guild_state.song_duration = duration
+        guild_state.song_start_time = datetime.utcnow()
+        logging.info(f"Playing next song without gap: {song_title}")
+        self.prefetch_upcoming(ctx.guild.id)
+        self.bot.loop.create_task(self.send_or_update_embed(ctx))
+
+    def schedule_preroll(self, guild_id):
+        """Open the next queue entry PREROLL_SECONDS before the current track is expected to end."""
+        guild_state = self.get_guild_state(guild_id)
+        upcoming = guild_state.queue.peek(1)
+        entry = upcoming[0] if upcoming else None
+        if entry == guild_state.preroll_entry:
+            return
+
+        self.cancel_preroll(guild_state)
+        if entry is None or guild_state.player is None:
+            return
+
+        _, elapsed_time, total_time = self.get_song_progress(guild_id)
+        delay = max(0, total_time - elapsed_time - PREROLL_SECONDS) if total_time else 0
+        guild_state.preroll_entry = entry
+        guild_state.preroll_task = asyncio.create_task(self.preroll(guild_id, guild_state.player, entry, delay))
+
+    def cancel_preroll(self, guild_state):
+        if guild_state.preroll_task:
+            guild_state.preroll_task.cancel()
+        guild_state.preroll_task = None
+        guild_state.preroll_entry = None
+        if guild_state.player:
+            guild_state.player.queue_next(None)
+
+    async def preroll(self, guild_id, player, entry, delay):
+        await asyncio.sleep(delay)
+        url, song_title, duration = entry
+        try:
+            source = PrebufferedSource(await self.open_source(guild_id, url, duration))
+        except Exception as e:
+            logging.warning(f"Pre-roll failed for {song_title}, it will be opened when it is due: {e}")
+            return
+        if source.is_opus() != player.is_opus():
+            # The player can't switch between Opus passthrough and PCM, play_next starts this one on its own
+            source.cleanup()
+            logging.info(f"Not pre-rolling {song_title}, it is {'Opus' if source.is_opus() else 'PCM'} unlike the current song")
+            return
+
+        try:
+            await asyncio.to_thread(source.fill)
+        except asyncio.CancelledError:
+            source.cleanup()
+            raise
+
+        guild_state = self.guild_states.get(guild_id)
+        if guild_state is None or guild_state.player is not player or guild_state.preroll_entry != entry:
+            source.cleanup()
+            return
+        player.queue_next(source, entry, duration)
+        logging.info(f"Pre-rolled next song: {song_title}")
+
+    def voice_connected(self, guild):
+        voice_client = guild.voice_client
+        return voice_client is not None and voice_client.is_connected()
+
+    def playback_position(self, guild_state):
+        """Seconds into the current song, not counting time spent paused."""
+        if not guild_state.song_start_time:
+            return 0
+        end = guild_state.paused_time if guild_state.is_paused and guild_state.paused_time else datetime.utcnow()
+        return max(0, (end - guild_state.song_start_time).total_seconds() - guild_state.elapsed_paused_time)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        if member.id != self.bot.user.id or before.channel == after.channel:
+            return
+        guild_state = self.guild_states.get(member.guild.id)
+        if guild_state is None:
+            return
+
+        if after.channel is not None:
+            # Moved to another channel, a recovery rejoins that one
+            guild_state.current_channel = after.channel
+        elif guild_state.leaving:
+            guild_state.leaving = False
+        elif not guild_state.recovery_task and not guild_state.disconnect_check:
+            # Either a moderator or a deleted channel removed the bot, or discord.py is reconnecting a lost voice websocket
+            guild_state.disconnect_check = asyncio.create_task(self.check_disconnect(member.guild, guild_state))
+
+    async def check_disconnect(self, guild, guild_state):
+        """Leave the queue alone while discord.py reconnects, clear it if the server disconnected the bot."""
+        try:
+            await asyncio.sleep(VOICE_DISCONNECT_SETTLE)
+        finally:
+            guild_state.disconnect_check = None
+        if guild_state.leaving or self.guild_states.get(guild.id) is not guild_state or self.voice_connected(guild):
+            return
+        if guild.voice_client is not None:
+            # discord.py kept its voice client, so it is reconnecting a lost connection. Recover if it got nowhere
+            logging.warning(f"Lost the voice connection in guild {guild.id}")
+            self.start_recovery(guild)
+            return
+
+        # discord.py drops its voice client only when it did not ask to leave, the disconnect was deliberate
+        logging.info(f"Disconnected from voice by the server in guild {guild.id}, clearing the queue")
+        self.cancel_preroll(guild_state)
+        self.progress_scheduler.discard(guild.id)
+        guild_state.player = None
+        guild_state.is_playing = False
+        guild_state.is_paused = False
+        guild_state.queue.clear()
+        self.clear_prefetched(guild.id)
+        guild_state.cancel_ingests()
+        guild_state.current_song = None
+        guild_state.current_entry = None
+        guild_state.song_start_time = None
+        guild_state.paused_time = None
+        guild_state.elapsed_paused_time = 0
+        ctx = guild_state.play_ctx
+        if ctx is not None:
+            await ctx.send("Disconnected from the voice channel by the server, cleared the queue.")
             await self.send_or_update_embed(ctx)
 
+    def start_recovery(self, guild):
+        """Reconcile the state of a guild whose voice connection dropped and start reconnecting."""
+        guild_state = self.guild_states.get(guild.id)
+        # While a disconnect reported by the gateway is being checked, it decides whether to recover
+        if guild_state is None or guild_state.leaving or guild_state.recovery_task or guild_state.disconnect_check:
+            return
+        voice_client = guild.voice_client
+        if voice_client is not None and (voice_client.is_playing() or voice_client.is_paused()):
+            return  # The player is still alive, discord.py is reconnecting it by itself
+
+        entry = guild_state.current_entry if guild_state.current_song else None
+        position = self.playback_position(guild_state) if entry else 0
+
+        # Nothing plays until the connection is back, so stop refreshing the embed for it
+        guild_state.is_playing = False
+        guild_state.is_paused = False
+        guild_state.player = None
+        self.cancel_preroll(guild_state)
+        self.progress_scheduler.discard(guild.id)
+
+        if entry is None and not guild_state.queue:
+            guild_state.current_song = None
+            guild_state.current_entry = None
+            guild_state.song_start_time = None
+            return
+        guild_state.recovery_task = asyncio.create_task(self.recover_voice(guild, guild_state, entry, position))
+
+    async def recover_voice(self, guild, guild_state, entry, position):
+        channel = guild_state.current_channel
+        ctx = guild_state.play_ctx
+        try:
+            for attempt in range(VOICE_RECOVERY_ATTEMPTS):
+                await asyncio.sleep(random.uniform(0, min(VOICE_RECOVERY_BACKOFF_MAX, VOICE_RECOVERY_BACKOFF_BASE * 2 ** attempt)))
+                if guild_state.leaving or self.guild_states.get(guild.id) is not guild_state:
+                    return
+                if self.voice_connected(guild):
+                    break  # discord.py reconnected by itself, or someone used a music command meanwhile
+                try:
+                    if guild.voice_client is not None:
+                        await guild.voice_client.disconnect(force=True)
+                    await self.connect_voice(channel)
+                    break
+                except Exception as e:
+                    logging.warning(f"Voice reconnect {attempt + 1}/{VOICE_RECOVERY_ATTEMPTS} in guild {guild.id} failed: {e}")
+            else:
+                logging.error(f"Giving up on the voice connection in guild {guild.id}")
+                guild_state.current_song = None
+                guild_state.current_entry = None
+                guild_state.song_start_time = None
+                if ctx is not None:
+                    await ctx.send("Lost the voice connection and could not reconnect. The queue is kept, use play to start again.")
+                    await self.send_or_update_embed(ctx)
+                return
+        finally:
+            guild_state.recovery_task = None
+
+        logging.info(f"Recovered the voice connection in guild {guild.id}, resuming at {position:.0f}s")
+        if entry is not None:
+            guild_state.queue.appendleft(entry)
+            guild_state.resume_position = position
+        if ctx is not None and not guild_state.is_playing and not guild_state.is_paused:
+            await self.play_next(ctx)
+
+    async def connect_voice(self, channel):
+        guild_state = self.get_guild_state(channel.guild.id)
+        guild_state.current_channel = channel
+        guild_state.leaving = False
+        if audio_nodes.enabled:
+            # The connection and player live in an audio node, this process only relays gateway events
+            return await channel.connect(cls=NodeVoiceClient)
+        return await channel.connect()
+
     async def join(self, ctx):
+        """Join the author's voice channel if needed, returns False when that failed."""
         if ctx.voice_client is None:
-            await ctx.author.voice.channel.connect()
+            try:
+                await self.connect_voice(ctx.author.voice.channel)
+            except AudioNodeUnavailable as e:
+                await ctx.send(str(e))
+                logging.error(f"Could not join {ctx.author.voice.channel}: {e}")
+                return False
             logging.info(f"Bot joined {ctx.author.voice.channel}")
+        return True
 
     @commands.command(name="pause", help="Pauses the current song")
     async def pause(self, ctx):
@@ -233,11 +749,11 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_playing'] and not guild_state['is_paused']:
+        if guild_state.is_playing and not guild_state.is_paused:
             ctx.voice_client.pause()
-            guild_state['is_paused'] = True
-            guild_state['is_playing'] = False
-            guild_state['paused_time'] = datetime.utcnow()
+            guild_state.is_paused = True
+            guild_state.is_playing = False
+            guild_state.paused_time = datetime.utcnow()
             await ctx.send("Paused the song.")
             logging.info("Song paused")
         else:
@@ -257,12 +773,12 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_paused']:
+        if guild_state.is_paused:
             ctx.voice_client.resume()
-            guild_state['is_paused'] = False
-            guild_state['is_playing'] = True
-            if guild_state['paused_time']:
-                guild_state['elapsed_paused_time'] += (datetime.utcnow() - guild_state['paused_time']).total_seconds()
+            guild_state.is_paused = False
+            guild_state.is_playing = True
+            if guild_state.paused_time:
+                guild_state.elapsed_paused_time += (datetime.utcnow() - guild_state.paused_time).total_seconds()
             await ctx.send("Resumed the song.")
             logging.info("Song resumed")
         else:
@@ -282,8 +798,10 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_playing'] or guild_state['is_paused']:
-            ctx.voice_client.stop()
+        if guild_state.is_playing or guild_state.is_paused:
+            # A pre-rolled next song is switched to inside the player, otherwise stopping starts play_next
+            if guild_state.is_paused or not (guild_state.player and guild_state.player.skip()):
+                ctx.voice_client.stop()
             await ctx.send("Skipped the song.")
             logging.info("Song skipped")
         else:
@@ -303,15 +821,18 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_playing'] or guild_state['is_paused']:
+        if guild_state.is_playing or guild_state.is_paused:
             ctx.voice_client.stop()
-            guild_state['is_playing'] = False
-            guild_state['is_paused'] = False
-            guild_state['queue'] = []
-            guild_state['current_song'] = None
-            guild_state['song_start_time'] = None
-            guild_state['paused_time'] = None
-            guild_state['elapsed_paused_time'] = 0
+            guild_state.is_playing = False
+            guild_state.is_paused = False
+            guild_state.queue.clear()
+            self.clear_prefetched(guild_id)
+            guild_state.cancel_ingests()
+            guild_state.current_song = None
+            guild_state.current_entry = None
+            guild_state.song_start_time = None
+            guild_state.paused_time = None
+            guild_state.elapsed_paused_time = 0
             await ctx.send("Stopped the song and cleared the queue.")
             logging.info("Stopped the song and cleared the queue")
         else:
@@ -331,46 +852,153 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
+        guild_state.leaving = True
         await ctx.voice_client.disconnect()
-        guild_state['is_playing'] = False
-        guild_state['is_paused'] = False
-        guild_state['queue'] = []
-        guild_state['current_song'] = None
-        guild_state['song_start_time'] = None
-        guild_state['paused_time'] = None
-        guild_state['elapsed_paused_time'] = 0
+        guild_state.is_playing = False
+        guild_state.is_paused = False
+        guild_state.queue.clear()
+        self.clear_prefetched(guild_id)
+        guild_state.cancel_ingests()
+        guild_state.current_song = None
+        guild_state.current_entry = None
+        guild_state.song_start_time = None
+        guild_state.paused_time = None
+        guild_state.elapsed_paused_time = 0
         await ctx.send("Disconnected from the voice channel and cleared the queue.")
         logging.info("Disconnected from the voice channel and cleared the queue")
 
         await self.send_or_update_embed(ctx)
 
-    @commands.command(name="addlist", help="Adds multiple songs to the queue from a list of YouTube URLs")
-    async def addlist(self, ctx, *, urls: str):
+    @commands.command(name="queue", help="Shows a page of the queue")
+    async def queue(self, ctx, page: int = 1):
+        guild_state = self.get_guild_state(ctx.guild.id)
+        queue = guild_state.queue
+        page = min(max(page, 1), queue.page_count())
+        embed = discord.Embed(title="📜 Queue", description=self.queue_page_text(queue, page - 1), color=discord.Color.blurple())
+        await ctx.send(embed=embed)
+
+    @commands.command(name="remove", help="Removes the song at the given queue position")
+    async def remove(self, ctx, position: int):
         guild_id = ctx.guild.id
         guild_state = self.get_guild_state(guild_id)
+        queue = guild_state.queue
+
+        if not 1 <= position <= len(queue):
+            await ctx.send(f"Invalid position. The queue has {len(queue)} songs.")
+            return
+
+        _, title, _ = queue.remove(position - 1)
+        await ctx.send(f"Removed {title} from the queue.")
+        logging.info(f"Removed {title} from the queue")
+        self.prefetch_upcoming(guild_id)
+        await self.send_or_update_embed(ctx)
+
+    @commands.command(name="move", help="Moves a song to another queue position")
+    async def move(self, ctx, source: int, destination: int):
+        guild_id = ctx.guild.id
+        guild_state = self.get_guild_state(guild_id)
+        queue = guild_state.queue
+
+        if not 1 <= source <= len(queue) or not 1 <= destination <= len(queue):
+            await ctx.send(f"Invalid position. The queue has {len(queue)} songs.")
+            return
+
+        _, title, _ = queue.move(source - 1, destination - 1)
+        await ctx.send(f"Moved {title} to position {destination}.")
+        logging.info(f"Moved {title} to position {destination}")
+        self.prefetch_upcoming(guild_id)
+        await self.send_or_update_embed(ctx)
+
+    @commands.command(name="shuffle", help="Shuffles the queue")
+    async def shuffle(self, ctx):
+        guild_id = ctx.guild.id
+        guild_state = self.get_guild_state(guild_id)
+
+        if not guild_state.queue:
+            await ctx.send("No songs in queue.")
+            return
+
+        guild_state.queue.shuffle()
+        await ctx.send("Shuffled the queue.")
+        logging.info("Shuffled the queue")
+        self.prefetch_upcoming(guild_id)
+        await self.send_or_update_embed(ctx)
+
+    @commands.command(name="volume", help="Shows or sets the playback volume in percent")
+    async def volume(self, ctx, percent: int = None):
+        guild_state = self.get_guild_state(ctx.guild.id)
+        if percent is None:
+            await ctx.send(f"Volume is {guild_state.filters.volume}%.")
+            return
+        if not VOLUME_MIN <= percent <= VOLUME_MAX:
+            await ctx.send(f"Volume must be between {VOLUME_MIN} and {VOLUME_MAX}.")
+            return
+
+        guild_state.filters.update(volume=percent)
+        await ctx.send(f"Volume set to {percent}%.")
+        logging.info(f"Volume set to {percent}% in guild {ctx.guild.id}")
+        self.apply_filters(ctx)
+
+    @commands.command(name="normalize", help="Turns loudness normalization on or off")
+    async def normalize(self, ctx):
+        guild_state = self.get_guild_state(ctx.guild.id)
+        guild_state.filters.update(normalize=not guild_state.filters.normalize)
+        state = "on" if guild_state.filters.normalize else "off"
+        await ctx.send(f"Loudness normalization is {state}.")
+        logging.info(f"Normalization turned {state} in guild {ctx.guild.id}")
+        self.apply_filters(ctx)
+
+    @commands.command(name="eq", help="Shows or sets the equalizer preset")
+    async def eq(self, ctx, preset: str = None):
+        guild_state = self.get_guild_state(ctx.guild.id)
+        presets = ", ".join(EQ_PRESETS)
+        if preset is None:
+            await ctx.send(f"Equalizer preset is {guild_state.filters.eq}. Presets: {presets}")
+            return
+        preset = preset.lower()
+        if preset not in EQ_PRESETS:
+            await ctx.send(f"Unknown preset. Presets: {presets}")
+            return
+
+        guild_state.filters.update(eq=preset)
+        await ctx.send(f"Equalizer set to {preset}.")
+        logging.info(f"Equalizer set to {preset} in guild {ctx.guild.id}")
+        self.apply_filters(ctx)
+
+    def apply_filters(self, ctx):
+        """Make new filter settings audible on the song that is playing."""
+        guild_state = self.get_guild_state(ctx.guild.id)
+        if not guild_state.is_playing or guild_state.current_entry is None or ctx.voice_client is None:
+            return
+        # A pre-rolled song may have been opened as passed-through Opus, it is opened again
+        self.cancel_preroll(guild_state)
+        if not audio_nodes.enabled and guild_state.player and not guild_state.player.is_opus():
+            self.schedule_preroll(ctx.guild.id)
+            return  # PCM sources read the settings on every frame
 
+        # Passed-through Opus and audio node sources fix their filters when opened, reopen at the same position
+        guild_state.queue.appendleft(guild_state.current_entry)
+        guild_state.resume_position = self.playback_position(guild_state)
+        ctx.voice_client.stop()
+
+    @commands.command(name="addlist", help="Adds multiple songs to the queue from a list of YouTube URLs")
+    async def addlist(self, ctx, *, urls: str):
         url_list = urls.split()  # Split the input string by spaces to get individual URLs
-        successful_adds = []
-        failed_adds = []
 
         # Ensure the bot is connected to a voice channel before adding songs
         if ctx.voice_client is None:
             if ctx.author.voice:
-                await ctx.author.voice.channel.connect()
-                logging.info(f"Bot joined {ctx.author.voice.channel}")
+                if not await self.join(ctx):
+                    return
             else:
                 await ctx.send("You need to be in a voice channel to add songs to the queue.")
                 logging.warning("User not in a voice channel")
                 return
 
-        for url in url_list:
-            try:
-                await self.process_url(ctx, url)
-                successful_adds.append(url)
-            except Exception as e:
-                logging.error(f"Error adding URL {url}: {e}")
-                failed_adds.append(url)
-        
+        failed = await self.ingest(ctx, url_list, "Adding list")
+        failed_adds = [url for url, _ in failed]
+        successful_adds = [url for url in url_list if url not in failed_adds]
+
         await ctx.send(f"Successfully added: {', '.join(successful_adds)}")
         if failed_adds:
             await ctx.send(f"Failed to add: {', '.join(failed_adds)}")
@@ -378,84 +1006,244 @@ class Music(commands.Cog):
         await self.send_or_update_embed(ctx)
 
     async def process_url(self, ctx, url):
+        failed = await self.ingest(ctx, [url], "Loading")
+        for _, error in failed:
+            await ctx.send(f"An error occurred while processing the URL: {str(error)}")
+
+    async def ingest(self, ctx, urls, label, loader=None):
+        """Queue every URL in order, starting playback as soon as the first entries are known.
+
+        URLs are loaded with at most INGEST_CONCURRENCY lookups at once, by default through
+        load_entries. Playlists are enumerated in chunks, so only the first PLAYLIST_FIRST_CHUNK
+        entries are waited on before playback starts. Returns a list of (url, error) for URLs
+        that failed.
+        """
+        loader = loader or self.load_entries
         guild_id = ctx.guild.id
         guild_state = self.get_guild_state(guild_id)
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': 'downloads/%(title)s.%(ext)s',
-            'noplaylist': False,  # Allow playlist extraction
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-            except Exception as e:
-                await ctx.send(f"An error occurred while processing the URL: {str(e)}")
-                logging.error(f"An error occurred while processing the URL: {str(e)}")
-                return
-            
-            if 'entries' in info:  # This means the URL is a playlist
-                for entry in info['entries']:
-                    try:
-                        audio_url = entry['url']
-                        song_title = entry.get('title', 'Unknown Title')
-                        duration = entry.get('duration', 0)  # duration in seconds
-
-                        ffmpeg_options = {
-                            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-                            'options': '-vn',
-                        }
-                        source = await asyncio.to_thread(discord.FFmpegPCMAudio, audio_url, executable=self.ffmpeg_path, **ffmpeg_options)
-
-                        if guild_state['is_playing'] or guild_state['is_paused']:
-                            guild_state['queue'].append((source, song_title, duration))
-                        else:
-                            guild_state['current_song'] = song_title
-                            guild_state['song_duration'] = duration
-                            guild_state['song_start_time'] = datetime.utcnow()
-                            guild_state['is_playing'] = True
-                            ctx.voice_client.play(source, after=lambda e: self.bot.loop.create_task(self.play_next(ctx)))
-                            await self.send_or_update_embed(ctx)
-                    except Exception as e:
-                        logging.error(f"An error occurred while processing the entry: {str(e)}")
-                        continue
-            else:
+        # Only clearing the queue stops an ingest, a later !play or !addlist runs alongside it
+        progress = {'label': label, 'done': 0, 'total': len(urls), 'queued': 0, 'cancelled': False, 'tasks': []}
+        guild_state.ingests.append(progress)
+        semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+        async def load(url, start):
+            async with semaphore:
+                return await loader(url, start)
+
+        def start_load(url, start):
+            task = asyncio.create_task(load(url, start))
+            progress['tasks'].append(task)
+            return task
+
+        pending = [(url, start_load(url, 1)) for url in urls]
+        failed = []
+        index = 0
+        try:
+            while index < len(pending):
+                url, task = pending[index]
+                index += 1
                 try:
-                    audio_url = info['url']
-                    song_title = info.get('title', 'Unknown Title')
-                    duration = info.get('duration', 0)  # duration in seconds
-
-                    ffmpeg_options = {
-                        'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-                        'options': '-vn',
-                    }
-                    source = await asyncio.to_thread(discord.FFmpegPCMAudio, audio_url, executable=self.ffmpeg_path, **ffmpeg_options)
-
-                    if guild_state['is_playing'] or guild_state['is_paused']:
-                        guild_state['queue'].append((source, song_title, duration))
-                    else:
-                        guild_state['current_song'] = song_title
-                        guild_state['song_duration'] = duration
-                        guild_state['song_start_time'] = datetime.utcnow()
-                        guild_state['is_playing'] = True
-                        ctx.voice_client.play(source, after=lambda e: self.bot.loop.create_task(self.play_next(ctx)))
-                        await self.send_or_update_embed(ctx)
+                    entries, next_start = await task
+                except asyncio.CancelledError:
+                    # cancel_ingests() cancelled the lookup, anything else cancelling this task is passed on
+                    if not progress['cancelled']:
+                        raise
                 except Exception as e:
-                    await ctx.send(f"An error occurred while processing the URL: {str(e)}")
-                    logging.error(f"An error occurred while processing the URL: {str(e)}")
+                    logging.error(f"Error adding URL {url}: {e}")
+                    failed.append((url, e))
+                    progress['done'] += 1
+                    continue
+
+                if progress['cancelled']:
+                    logging.info(f"Stopped loading {label.lower()}, the queue was cleared")
+                    break
+
+                # Results are consumed in input order, so the queue keeps the order the user gave
+                for entry in entries:
+                    guild_state.queue.append((entry['webpage_url'], entry['title'], entry['duration']))
+                progress['queued'] += len(entries)
+                progress['done'] += 1
+                if next_start:
+                    pending.insert(index, (url, start_load(url, next_start)))
+                    progress['total'] += 1
+                logging.info(f"Queued {len(entries)} entries from {url}")
+
+                if not guild_state.is_playing and not guild_state.is_paused:
+                    await self.play_next(ctx)
+                else:
+                    self.prefetch_upcoming(guild_id)
+                    if progress['done'] % INGEST_PROGRESS_EVERY == 0:
+                        await self.send_or_update_embed(ctx)
+        finally:
+            for _, task in pending[index:]:
+                task.cancel()
+            if progress in guild_state.ingests:
+                guild_state.ingests.remove(progress)
+
+        return failed
+
+    async def load_entries(self, url, start=1):
+        """Load one chunk of queue entries for url.
+
+        Returns (entries, next_start), next_start is set when the URL is a playlist
+        that may have more entries past this chunk.
+        """
+        items = f"{start}-{start + PLAYLIST_FIRST_CHUNK - 1}" if start == 1 else f"{start}:"
+        cache_key = f"info:{normalize_url(url)}#{items}"
+        info = metadata_cache.get(cache_key)
+        if info is None:
+            info = await inflight_lookups.do(cache_key, self.extract_info, url, items, cache_key)
+        else:
+            logging.info(f"Using cached info for {url} ({items})")
+
+        if start == 1 and info['playlist'] and len(info['entries']) >= PLAYLIST_FIRST_CHUNK:
+            return info['entries'], start + PLAYLIST_FIRST_CHUNK
+        return info['entries'], None
+
+    async def extract_info(self, url, items, cache_key):
+        info = await extractor_pool.extract('info', url, {'playlist_items': items})
+        info = self.compact_info(info, url)
+        metadata_cache.set(cache_key, info, METADATA_TTL)
+        return info
+
+    def compact_info(self, info, url):
+        """Keep only the fields the queue needs, so cached entries stay small and JSON friendly."""
+        if 'entries' in info:  # This means the URL is a playlist
+            raw_entries = [entry for entry in info['entries'] if entry]
+        else:
+            raw_entries = [info]
+
+        entries = []
+        for entry in raw_entries:
+            page_url = entry.get('webpage_url') or entry.get('url') or url
+            entries.append({
+                'webpage_url': page_url,
+                'title': entry.get('title', 'Unknown Title'),
+                'duration': entry.get('duration') or 0,  # duration in seconds
+            })
+
+        if 'entries' not in info and info.get('url'):
+            # A single video comes back fully resolved, keep its stream for play_next
+            metadata_cache.set(f"stream:{normalize_url(entries[0]['webpage_url'])}", self.stream_entry(info), stream_ttl(info['url']))
+
+        return {'playlist': 'entries' in info, 'entries': entries}
+
+    def stream_entry(self, info):
+        # yt_dlp already knows the audio codec of the format it picked, so no ffprobe run is needed
+        return {'url': info['url'], 'codec': info.get('acodec')}
+
+    async def resolve_stream_url(self, url):
+        """Return {'url', 'codec'} for a queue entry's audio stream."""
+        cache_key = f"stream:{normalize_url(url)}"
+        stream = metadata_cache.get(cache_key)
+        if isinstance(stream, str):  # Cached before codecs were recorded
+            stream = {'url': stream, 'codec': None}
+        if stream:
+            return stream
+        return await inflight_lookups.do(cache_key, self.extract_stream_url, url, cache_key)
+
+    async def extract_stream_url(self, url, cache_key):
+        info = await extractor_pool.extract('stream', url)
+        stream = self.stream_entry(info)
+        metadata_cache.set(cache_key, stream, stream_ttl(info['url']))
+        return stream
+
+    def prefetch_upcoming(self, guild_id):
+        """Resolve the stream URLs of the next PREFETCH_DEPTH queue entries in the background."""
+        guild_state = self.get_guild_state(guild_id)
+        prefetched = guild_state.prefetched
+        upcoming = {url for url, _, _ in guild_state.queue.peek(PREFETCH_DEPTH)}
+
+        for url in list(prefetched):
+            if url not in upcoming:
+                prefetched.pop(url).cancel()
+
+        for url in upcoming:
+            # Songs in the audio cache are played from disk and need no stream URL
+            if url not in prefetched and url not in audio_cache:
+                prefetched[url] = asyncio.create_task(self.resolve_stream_url(url))
+
+        self.schedule_preroll(guild_id)
+
+    def clear_prefetched(self, guild_id):
+        guild_state = self.get_guild_state(guild_id)
+        for task in guild_state.prefetched.values():
+            task.cancel()
+        guild_state.prefetched.clear()
+        self.cancel_preroll(guild_state)
+
+    async def open_source(self, guild_id, url, duration=0, start=0):
+        """Open the ffmpeg source for a queue entry in this process."""
+        spec = await self.source_spec(guild_id, url, duration, start)
+        filters = self.get_guild_state(guild_id).filters
+        opening = asyncio.ensure_future(asyncio.to_thread(open_ffmpeg_source, spec, self.ffmpeg_path, filters))
+        try:
+            return await asyncio.shield(opening)
+        except asyncio.CancelledError:
+            # The thread still starts ffmpeg, close it once it has or the process runs until EOF
+            opening.add_done_callback(cleanup_opened_source)
+            raise
+
+    async def source_spec(self, guild_id, url, duration=0, start=0):
+        """Describe how ffmpeg should open a queue entry, using its prefetched stream URL when available.
+
+        A non-zero start seeks that many seconds into the song.
+        """
+        spec = await self.locate_source(guild_id, url, duration)
+        if start:
+            # Placed before the input, ffmpeg seeks in the stream instead of decoding up to the position
+            spec['before_options'] = f"-ss {start:.2f} {spec.get('before_options') or ''}".strip()
+        return spec
+
+    async def locate_source(self, guild_id, url, duration=0):
+        guild_state = self.get_guild_state(guild_id)
+        task = guild_state.prefetched.pop(url, None)
+        # Filters work on decoded PCM, so nothing is passed through while any are on
+        filters = guild_state.filters.to_dict() if guild_state.filters.active else None
+
+        cached_path = audio_cache.get(url)
+        if cached_path:
+            if task is not None:
+                task.cancel()
+            guild_state.source_paths['disk'] += 1
+            logging.info(f"Opening {url} from the audio cache")
+            # Cached files are always Opus, so they are passed through as well
+            return {'input': os.path.abspath(cached_path), 'passthrough': not filters, 'options': '-vn', 'filters': filters}
+
+        stream = None
+        waited_since = time.perf_counter()
+        if task is not None:
+            try:
+                stream = await task
+            except Exception as e:
+                logging.warning(f"Prefetch failed for {url}, resolving again: {e}")
+
+        if stream is None:
+            stream = await self.resolve_stream_url(url)
+        guild_state.metrics.record_resolve_wait((time.perf_counter() - waited_since) * 1000)
+
+        codec = stream['codec']
+        if (not codec or codec == 'none') and not filters:
+            try:
+                codec, _ = await discord.FFmpegOpusAudio.probe(stream['url'], executable=self.ffmpeg_path)
+            except Exception as e:
+                logging.warning(f"Could not probe codec of {url}, transcoding: {e}")
+
+        # Opus packets are remuxed by ffmpeg and sent as they are, nothing is decoded or encoded
+        passthrough = codec in PASSTHROUGH_CODECS and not filters
+        path = 'opus' if passthrough else 'pcm'
+        guild_state.source_paths[path] += 1
+        logging.info(f"Opening {url} with {path} playback (codec {codec})")
+        audio_cache.store_later(url, duration)
+        return {'input': stream['url'], 'passthrough': passthrough, 'filters': filters, **FFMPEG_OPTIONS}
 
     def get_song_progress(self, guild_id):
         guild_state = self.get_guild_state(guild_id)
-        if guild_state['song_start_time'] and guild_state['song_duration'] > 0:
-            elapsed_time = (datetime.utcnow() - guild_state['song_start_time']).total_seconds() - guild_state['elapsed_paused_time']
-            progress = min(elapsed_time / guild_state['song_duration'], 1.0)
-            return progress, elapsed_time, guild_state['song_duration']
+        if guild_state.song_start_time and guild_state.song_duration > 0:
+            elapsed_time = (datetime.utcnow() - guild_state.song_start_time).total_seconds() - guild_state.elapsed_paused_time
+            progress = min(elapsed_time / guild_state.song_duration, 1.0)
+            return progress, elapsed_time, guild_state.song_duration
         return 0, 0, 0
 
     def format_progress_bar(self, progress):
@@ -467,54 +1255,72 @@ class Music(commands.Cog):
     def format_time(self, seconds):
         return str(timedelta(seconds=int(seconds)))
 
-    async def send_or_update_embed(self, ctx_or_interaction):
-        guild_id = ctx_or_interaction.guild.id
-        guild_state = self.get_guild_state(guild_id)
-
-        if guild_state['embed_update_pending']:
-            return
-
-        guild_state['embed_update_pending'] = True
+    def queue_page_text(self, queue, page):
+        text = queue.render_page(page)
+        if not queue:
+            return text
+        footer = f"\n\nPage {page + 1}/{queue.page_count()} · {len(queue)} songs · `{self.format_time(queue.total_duration)}` total"
+        return text[:FIELD_LIMIT - len(footer)] + footer
 
-        progress, elapsed_time, total_time = self.get_song_progress(guild_id)
-        progress_bar = self.format_progress_bar(progress)
+    async def send_or_update_embed(self, ctx_or_interaction, resend=False):
+        """Schedule a render of the controls embed.
 
-        embed = discord.Embed(
-            title="🎶 Music Controls 🎶", 
-            description=f"**Now playing:** `{guild_state['current_song'] if guild_state['current_song'] else 'None'}`", 
-            color=discord.Color.blurple()
-        )
-        embed.add_field(
-            name="Progress", 
-            value=f"`{self.format_time(elapsed_time)}` {progress_bar} `{self.format_time(total_time)}`", 
-            inline=False
-        )
+        Changes made within EMBED_DEBOUNCE seconds are coalesced into one render. With
+        resend the old controls message is replaced by a new one at the bottom of the channel.
+        """
+        guild_id = ctx_or_interaction.guild.id
+        guild_state = self.get_guild_state(guild_id)
 
-        if guild_state['queue']:
-            queue_list = "\n".join([f"{i+1}. {title}" for i, (_, title, _) in enumerate(guild_state['queue'])])
-            embed.add_field(name="📜 Queue", value=queue_list, inline=False)
-        else:
-            embed.add_field(name="📜 Queue", value="No songs in queue.", inline=False)
+        guild_state.embed_channel = ctx_or_interaction.channel
+        guild_state.render_pending = True
+        guild_state.render_resend = guild_state.render_resend or resend
+        if guild_state.render_task is None or guild_state.render_task.done():
+            guild_state.render_task = asyncio.create_task(self.render_loop(guild_id))
 
-        embed.set_footer(text="Use the buttons below to control the music.")
+    async def render_loop(self, guild_id):
+        guild_state = self.get_guild_state(guild_id)
+        while guild_state.render_pending:
+            await asyncio.sleep(EMBED_DEBOUNCE)
+            guild_state.render_pending = False
+            try:
+                await self.render_controls(guild_id)
+            except discord.HTTPException as e:
+                logging.error(f"Failed to render music controls embed: {e}")
 
-        view = MusicControlView(self)
+    async def render_controls(self, guild_id, send_if_missing=True):
+        """Bring the controls message up to date, returns True if an API call was made."""
+        guild_state = self.get_guild_state(guild_id)
+        embed = self.build_controls_embed(guild_id)
+        payload = json.dumps(embed.to_dict(), sort_keys=True)
+        message = guild_state.embed_message
 
-        # If embed_message exists, delete it and then send a new one
-        if guild_state['embed_message']:
+        if guild_state.render_resend and message:
+            guild_state.embed_message = None
             try:
-                await guild_state['embed_message'].delete()
+                await message.delete()
             except discord.NotFound:
                 pass
+            message = None
+
+        if message:
+            if payload == guild_state.embed_payload:
+                return False
+            try:
+                await message.edit(embed=embed)
+                guild_state.embed_payload = payload
+                return True
+            except discord.NotFound:
+                logging.error("Embed message not found. It might have been deleted.")
+                guild_state.embed_message = None
 
-        if isinstance(ctx_or_interaction, discord.ext.commands.Context):
-            guild_state['embed_message'] = await ctx_or_interaction.send(embed=embed, view=view)
-            logging.info("Sent new music controls embed")
-        elif isinstance(ctx_or_interaction, discord.Interaction):
-            guild_state['embed_message'] = await ctx_or_interaction.followup.send(embed=embed, view=view)
-            logging.info("Sent new music controls embed via interaction")
+        if not send_if_missing or guild_state.embed_channel is None:
+            return False
 
-        guild_state['embed_update_pending'] = False
+        guild_state.render_resend = False
+        guild_state.embed_message = await guild_state.embed_channel.send(embed=embed, view=self.controls_view)
+        guild_state.embed_payload = payload
+        logging.info("Sent new music controls embed")
+        return True
 
     async def pause_interaction(self, interaction: discord.Interaction):
         logging.info("Pause interaction invoked")
@@ -527,11 +1333,11 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_playing'] and not guild_state['is_paused']:
+        if guild_state.is_playing and not guild_state.is_paused:
             voice_client.pause()
-            guild_state['is_paused'] = True
-            guild_state['is_playing'] = False
-            guild_state['paused_time'] = datetime.utcnow()
+            guild_state.is_paused = True
+            guild_state.is_playing = False
+            guild_state.paused_time = datetime.utcnow()
             await interaction.response.send_message("Paused the song.", ephemeral=True)
             logging.info("Paused the song via interaction")
         else:
@@ -551,12 +1357,12 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_paused']:
+        if guild_state.is_paused:
             voice_client.resume()
-            guild_state['is_paused'] = False
-            guild_state['is_playing'] = True
-            if guild_state['paused_time']:
-                guild_state['elapsed_paused_time'] += (datetime.utcnow() - guild_state['paused_time']).total_seconds()
+            guild_state.is_paused = False
+            guild_state.is_playing = True
+            if guild_state.paused_time:
+                guild_state.elapsed_paused_time += (datetime.utcnow() - guild_state.paused_time).total_seconds()
             await interaction.response.send_message("Resumed the song.", ephemeral=True)
             logging.info("Resumed the song via interaction")
         else:
@@ -576,8 +1382,10 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_playing'] or guild_state['is_paused']:
-            voice_client.stop()
+        if guild_state.is_playing or guild_state.is_paused:
+            # A pre-rolled next song is switched to inside the player, otherwise stopping starts play_next
+            if guild_state.is_paused or not (guild_state.player and guild_state.player.skip()):
+                voice_client.stop()
             await interaction.response.send_message("Skipped the song.", ephemeral=True)
             logging.info("Skipped the song via interaction")
         else:
@@ -597,15 +1405,18 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
-        if guild_state['is_playing'] or guild_state['is_paused']:
+        if guild_state.is_playing or guild_state.is_paused:
             voice_client.stop()
-            guild_state['is_playing'] = False
-            guild_state['is_paused'] = False
-            guild_state['queue'] = []
-            guild_state['current_song'] = None
-            guild_state['song_start_time'] = None
-            guild_state['paused_time'] = None
-            guild_state['elapsed_paused_time'] = 0
+            guild_state.is_playing = False
+            guild_state.is_paused = False
+            guild_state.queue.clear()
+            self.clear_prefetched(guild_id)
+            guild_state.cancel_ingests()
+            guild_state.current_song = None
+            guild_state.current_entry = None
+            guild_state.song_start_time = None
+            guild_state.paused_time = None
+            guild_state.elapsed_paused_time = 0
             await interaction.response.send_message("Stopped the song and cleared the queue.", ephemeral=True)
             logging.info("Stopped the song and cleared the queue via interaction")
         else:
@@ -625,14 +1436,18 @@ class Music(commands.Cog):
             logging.warning("Bot not connected to a voice channel")
             return
 
+        guild_state.leaving = True
         await voice_client.disconnect()
-        guild_state['is_playing'] = False
-        guild_state['is_paused'] = False
-        guild_state['queue'] = []
-        guild_state['current_song'] = None
-        guild_state['song_start_time'] = None
-        guild_state['paused_time'] = None
-        guild_state['elapsed_paused_time'] = 0
+        guild_state.is_playing = False
+        guild_state.is_paused = False
+        guild_state.queue.clear()
+        self.clear_prefetched(guild_id)
+        guild_state.cancel_ingests()
+        guild_state.current_song = None
+        guild_state.current_entry = None
+        guild_state.song_start_time = None
+        guild_state.paused_time = None
+        guild_state.elapsed_paused_time = 0
         await interaction.response.send_message("Disconnected from the voice channel and cleared the queue.", ephemeral=True)
         logging.info("Disconnected from the voice channel and cleared the queue via interaction")
 
@@ -643,33 +1458,46 @@ class Music(commands.Cog):
         await interaction.response.send_modal(AddQueueModal(self, interaction))
 
 class MusicControlView(View):
-    def __init__(self, music_cog):
+    """Buttons of the controls embed. Holds no state, the cog and guild are taken from each interaction."""
+
+    def __init__(self):
         super().__init__(timeout=None)
-        self.music_cog = music_cog
+
+    @staticmethod
+    def music_cog(interaction):
+        # Looked up per press, so the buttons follow reloads of the music extension
+        return interaction.client.get_cog('Music')
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if self.music_cog(interaction) is None or interaction.guild is None:
+            await interaction.response.send_message("Music controls are not available right now.", ephemeral=True)
+            return False
+        self.music_cog(interaction).get_guild_state(interaction.guild.id).touch()
+        return True
 
     @discord.ui.button(label="Pause", style=discord.ButtonStyle.primary, custom_id="pause_button", emoji="⏸️")
     async def pause_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.music_cog.pause_interaction(interaction)
+        await self.music_cog(interaction).pause_interaction(interaction)
 
     @discord.ui.button(label="Resume", style=discord.ButtonStyle.success, custom_id="resume_button", emoji="▶️")
     async def resume_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.music_cog.resume_interaction(interaction)
+        await self.music_cog(interaction).resume_interaction(interaction)
 
     @discord.ui.button(label="Skip", style=discord.ButtonStyle.danger, custom_id="skip_button", emoji="⏭️")
     async def skip_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.music_cog.skip_interaction(interaction)
+        await self.music_cog(interaction).skip_interaction(interaction)
 
     @discord.ui.button(label="Stop", style=discord.ButtonStyle.secondary, custom_id="stop_button", emoji="⏹️")
     async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.music_cog.stop_interaction(interaction)
+        await self.music_cog(interaction).stop_interaction(interaction)
 
     @discord.ui.button(label="Leave", style=discord.ButtonStyle.secondary, custom_id="leave_button", emoji="🚪")
     async def leave_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.music_cog.leave_interaction(interaction)
+        await self.music_cog(interaction).leave_interaction(interaction)
 
     @discord.ui.button(label="Add to Queue", style=discord.ButtonStyle.primary, custom_id="add_queue_button", emoji="➕")
     async def add_queue_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.music_cog.add_queue_interaction(interaction)
+        await self.music_cog(interaction).add_queue_interaction(interaction)
 
 class AddQueueModal(Modal):
     def __init__(self, music_cog, interaction):
@@ -681,6 +1509,7 @@ class AddQueueModal(Modal):
     async def on_submit(self, interaction: discord.Interaction):
         url = self.children[0].value
         logging.info(f"Modal URL: {url}")
+        self.music_cog.get_guild_state(interaction.guild.id).touch()
 
         # Acknowledge the interaction first
         await interaction.response.defer(ephemeral=True)
@@ -688,7 +1517,12 @@ class AddQueueModal(Modal):
         # Ensuring bot is in the voice channel
         if interaction.guild.voice_client is None:
             if interaction.user.voice:
-                await interaction.user.voice.channel.connect()
+                try:
+                    await self.music_cog.connect_voice(interaction.user.voice.channel)
+                except AudioNodeUnavailable as e:
+                    await interaction.followup.send(str(e), ephemeral=True)
+                    logging.error(f"Could not join {interaction.user.voice.channel}: {e}")
+                    return
                 logging.info(f"Bot joined {interaction.user.voice.channel}")
             else:
                 await interaction.followup.send("You need to be in a voice channel to add songs to the queue.", ephemeral=True)
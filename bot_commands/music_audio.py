@@ -0,0 +1,174 @@
+import threading
+from collections import deque
+import discord
+from bot_commands.music_filters import FilterSettings, FilteredSource
+from bot_commands.music_metrics import track_ffmpeg
+
+# Frames are 20 ms of 48 kHz stereo 16-bit PCM (or one Opus packet)
+FRAMES_PER_SECOND = 50
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+
+# The next track is opened this many seconds before the current one is expected to end
+PREROLL_SECONDS = 8.0
+# Frames read from the next track ahead of time, so the switch never waits on the network
+PREBUFFER_FRAMES = 50
+# Overlap between two PCM tracks, 0 switches straight from one to the other
+CROSSFADE_SECONDS = 0.0
+
+class PrebufferedSource(discord.AudioSource):
+    """Wraps a source whose first frames are read ahead of time by fill()."""
+
+    def __init__(self, source, frames=PREBUFFER_FRAMES):
+        self.source = source
+        self.frames = frames
+        self._buffer = deque()
+
+    def fill(self):
+        """Blocking, run it in a thread before the source is handed to the player."""
+        while len(self._buffer) < self.frames:
+            data = self.source.read()
+            self._buffer.append(data)
+            if not data:
+                break
+
+    def read(self):
+        if self._buffer:
+            return self._buffer.popleft()
+        return self.source.read()
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self._buffer.clear()
+        self.source.cleanup()
+
+def crossfade(outgoing, incoming, start, end):
+    """Mix two PCM frames, fading outgoing out and incoming in from start to end (0.0-1.0)."""
+    # Only crossfades need numpy, it is imported on the first one
+    import numpy as np
+    a = np.frombuffer(outgoing, dtype=np.int16)
+    b = np.frombuffer(incoming, dtype=np.int16)
+    length = max(len(a), len(b))
+    if len(a) < length:
+        a = np.pad(a, (0, length - len(a)))
+    if len(b) < length:
+        b = np.pad(b, (0, length - len(b)))
+
+    # One gain per stereo sample pair, so both channels fade together
+    gain = np.repeat(np.linspace(start, end, length // 2, dtype=np.float32), 2)
+    mixed = a * (1.0 - gain) + b * gain
+    return np.clip(mixed, -32768, 32767).astype(np.int16).tobytes()
+
+class GaplessSource(discord.AudioSource):
+    """Source that stays attached to the voice player across tracks.
+
+    The next track is handed over with queue_next() while the current one is still
+    playing. When the current track runs out, read() switches to the next one on the
+    same frame, so there is no gap and the player's `after` callback only fires when
+    nothing was queued. on_advance(token) is called from the player thread on every switch.
+    The voice player picks Opus passthrough or PCM encoding once, from the first track, so
+    only tracks of the same kind can follow it.
+    """
+
+    def __init__(self, source, duration=0, on_advance=None, crossfade_seconds=CROSSFADE_SECONDS):
+        self.current = source
+        self.opus = source.is_opus()
+        self.on_advance = on_advance
+        self.fade_frames = int(crossfade_seconds * FRAMES_PER_SECOND)
+        self.track_frames = int(duration * FRAMES_PER_SECOND)
+        self.frames_read = 0
+        self._next = None  # (source, token, duration)
+        self._skip = False
+        self._lock = threading.Lock()
+
+    def queue_next(self, source, token=None, duration=0):
+        """Set (or with None, drop) the track to switch to once the current one ends."""
+        if source is not None and source.is_opus() != self.opus:
+            raise ValueError("The next track must be Opus exactly when the current one is")
+        with self._lock:
+            previous, self._next = self._next, (source, token, duration) if source else None
+        if previous:
+            previous[0].cleanup()
+
+    def has_next(self):
+        return self._next is not None
+
+    def skip(self):
+        """Switch to the queued next track on the next frame. Returns False if there is none."""
+        if self._next is None:
+            return False
+        self._skip = True
+        return True
+
+    def _advance(self, frames_read=0, expected=None):
+        """Switch to the next track, only if it is still expected when one is given."""
+        with self._lock:
+            if expected is not None and self._next is not expected:
+                return False
+            upcoming, self._next = self._next, None
+        if upcoming is None:
+            return False
+
+        source, token, duration = upcoming
+        self.current.cleanup()
+        self.current = source
+        self.track_frames = int(duration * FRAMES_PER_SECOND)
+        self.frames_read = frames_read
+        if self.on_advance:
+            self.on_advance(token)
+        return True
+
+    def _fade_position(self, upcoming):
+        if not self.fade_frames or not self.track_frames or upcoming is None:
+            return None
+        if self.current.is_opus() or upcoming[0].is_opus():
+            return None  # Opus packets cannot be mixed
+        position = self.frames_read - (self.track_frames - self.fade_frames)
+        return position if position > 0 else None
+
+    def read(self):
+        if self._skip:
+            self._skip = False
+            self._advance()
+
+        data = self.current.read()
+        self.frames_read += 1
+
+        # queue_next() runs on the event loop and cleans up the track it replaces, so hold the lock while reading it
+        with self._lock:
+            upcoming = self._next
+            position = self._fade_position(upcoming)
+            incoming = upcoming[0].read() if position is not None else None
+        if position is not None:
+            if not data or position >= self.fade_frames:
+                self._advance(frames_read=position, expected=upcoming)
+                return incoming
+            return crossfade(data, incoming, (position - 1) / self.fade_frames, position / self.fade_frames)
+
+        if not data and self._advance():
+            data = self.current.read()
+            self.frames_read += 1
+        return data
+
+    def is_opus(self):
+        return self.opus
+
+    def cleanup(self):
+        self.current.cleanup()
+        self.queue_next(None)
+
+def open_ffmpeg_source(spec, executable='ffmpeg', filters=None):
+    """Open the ffmpeg source described by spec, blocking while ffmpeg starts.
+
+    spec is {'input', 'passthrough', 'before_options', 'options', 'filters'}. Passthrough inputs
+    are Opus and only remuxed, anything else is decoded to PCM for discord.py to encode.
+    PCM goes through the filters, a live FilterSettings or else the spec's snapshot of one.
+    """
+    options = {'before_options': spec.get('before_options'), 'options': spec.get('options')}
+    if spec.get('passthrough'):
+        return track_ffmpeg(discord.FFmpegOpusAudio(spec['input'], codec='copy', executable=executable, **options))
+    source = track_ffmpeg(discord.FFmpegPCMAudio(spec['input'], executable=executable, **options))
+    if filters is None and spec.get('filters'):
+        filters = FilterSettings.from_dict(spec['filters'])
+    return FilteredSource(source, filters) if filters is not None else source
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from bot_commands.cluster_ipc import cluster_path
+from bot_commands.music_cache import normalize_url
+from bot_commands.music_extractor import ExtractorPool
+
+# Set to True to keep played songs on disk as Opus files and play repeats from there
+AUDIO_CACHE_ENABLED = False
+AUDIO_CACHE_DIR = 'audio_cache'
+AUDIO_CACHE_INDEX = 'index.json'
+# Total size of the cached files, the least recently played ones are deleted past this
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Longer songs (mixes, streams) are never written to disk
+AUDIO_CACHE_MAX_DURATION = 15 * 60
+AUDIO_CACHE_DOWNLOAD_WORKERS = 1
+AUDIO_CACHE_DOWNLOAD_QUEUE = 16
+AUDIO_CACHE_DOWNLOAD_TIMEOUT = 300.0
+
+VIDEO_ID_RE = re.compile(r'^[\w-]{11}$')
+
+def cache_id(url: str):
+    """YouTube video ID of a queue entry URL, None for anything that cannot be cached."""
+    key = normalize_url(url)
+    if not key.startswith('youtube:'):
+        return None
+    video_id = key.split(':', 1)[1]
+    # The ID becomes a file name, so only accept what YouTube IDs look like
+    return video_id if VIDEO_ID_RE.match(video_id) else None
+
+class AudioCache:
+    """Opus files of played songs keyed by video ID, bounded by a byte budget with LRU eviction.
+
+    A song is downloaded in the background the first time it is played from the network,
+    and played from disk after that. The index keeps the LRU order and sizes across restarts.
+    """
+
+    def __init__(self, directory=cluster_path(AUDIO_CACHE_DIR), max_bytes=AUDIO_CACHE_MAX_BYTES, enabled=AUDIO_CACHE_ENABLED):
+        self.directory = directory
+        self.index_path = os.path.join(directory, AUDIO_CACHE_INDEX)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries = OrderedDict()  # video ID -> [file name, size, last used]
+        self._downloads = {}  # video ID -> task writing it
+        self._dirty = False
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evictions = 0
+        self.failed = 0
+        # Downloads get their own workers so they never hold up lookups for songs about to play
+        self.pool = ExtractorPool(
+            workers=AUDIO_CACHE_DOWNLOAD_WORKERS,
+            queue_size=AUDIO_CACHE_DOWNLOAD_QUEUE,
+            timeout=AUDIO_CACHE_DOWNLOAD_TIMEOUT,
+        )
+
+        if self.enabled:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url):
+        return self.enabled and cache_id(url) in self._entries
+
+    def get(self, url):
+        """Path of the cached file for url, or None. Counts as a play for the LRU order."""
+        if not self.enabled:
+            return None
+        video_id = cache_id(url)
+        entry = self._entries.get(video_id) if video_id else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        path = os.path.join(self.directory, entry[0])
+        if not os.path.exists(path):
+            self._drop(video_id)
+            self.misses += 1
+            return None
+
+        entry[2] = time.time()
+        self._entries.move_to_end(video_id)
+        self._dirty = True
+        self.hits += 1
+        return path
+
+    def store_later(self, url, duration=0):
+        """Start writing url to disk in the background, unless it is cached or being written already."""
+        if not self.enabled or (duration and duration > AUDIO_CACHE_MAX_DURATION):
+            return
+        video_id = cache_id(url)
+        if video_id is None or video_id in self._entries or video_id in self._downloads:
+            return
+
+        task = asyncio.create_task(self._store(video_id, url))
+        self._downloads[video_id] = task
+        task.add_done_callback(lambda done: self._downloads.pop(video_id, None))
+
+    async def _store(self, video_id, url):
+        params = {'outtmpl': {'default': os.path.join(self.directory, f'{video_id}.%(ext)s')}}
+        try:
+            info = await self.pool.extract('download', url, params, download=True)
+            path = info['requested_downloads'][0]['filepath']
+            size = os.path.getsize(path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logging.warning(f"Failed to cache audio for {url}: {e}")
+            return
+
+        self._entries[video_id] = [os.path.basename(path), size, time.time()]
+        self.total_bytes += size
+        self.stored += 1
+        logging.info(f"Cached audio for {url} ({size / 1024 / 1024:.1f} MiB)")
+        self._evict()
+        await asyncio.to_thread(self.save)
+
+    def _drop(self, video_id):
+        file_name, size, _ = self._entries.pop(video_id)
+        self.total_bytes -= size
+        self._dirty = True
+        return file_name
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            video_id = next(iter(self._entries))
+            file_name = self._drop(video_id)
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except OSError as e:
+                # A file still open for playback cannot be removed on Windows, load() sweeps it later
+                logging.warning(f"Could not remove cached audio {file_name}: {e}")
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            data = []
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to load audio cache index {self.index_path}: {e}")
+            data = []
+
+        for video_id, file_name, size, last_used in data:
+            if os.path.exists(os.path.join(self.directory, file_name)):
+                self._entries[video_id] = [file_name, size, last_used]
+                self.total_bytes += size
+
+        # Interrupted downloads and files the index lost track of are only taking up space
+        known = {entry[0] for entry in self._entries.values()}
+        for file_name in os.listdir(self.directory):
+            if file_name != AUDIO_CACHE_INDEX and file_name not in known:
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                except OSError:
+                    pass
+
+        self._evict()
+        logging.info(f"Loaded {len(self._entries)} cached songs ({self.total_bytes / 1024 / 1024:.1f} MiB) from {self.directory}")
+
+    def save(self):
+        if not self.enabled or not self._dirty:
+            return
+        self._dirty = False
+        data = [[video_id, *entry] for video_id, entry in self._entries.items()]
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            self._dirty = True
+            logging.error(f"Failed to save audio cache index {self.index_path}: {e}")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'songs': len(self._entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stored': self.stored,
+            'evictions': self.evictions,
+            'failed': self.failed,
+            'downloading': len(self._downloads),
+        }
+
+# Shared by every guild, and kept across reloads of the music extension
+audio_cache = AudioCache()
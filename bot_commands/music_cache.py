@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from bot_commands.cluster_ipc import cluster_path
+
+# Where the metadata cache is persisted between restarts, set to None to keep it in memory only
+CACHE_FILE = 'music_cache.json'
+CACHE_MAX_ENTRIES = 5000
+
+# Playlist listings and search results do not expire upstream, keep them for a while
+METADATA_TTL = 6 * 60 * 60
+# Used for stream URLs that carry no expiry information
+DEFAULT_STREAM_TTL = 30 * 60
+# Stream URLs are dropped this long before upstream expires them
+STREAM_EXPIRY_MARGIN = 5 * 60
+
+class TTLCache:
+    """LRU cache where every entry also expires after its own TTL."""
+
+    def __init__(self, max_entries=1024, default_ttl=METADATA_TTL, persist_path=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.persist_path = persist_path
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.persist_path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def purge_expired(self):
+        now = time.time()
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to load cache file {self.persist_path}: {e}")
+            return
+
+        now = time.time()
+        for key, expires_at, value in data:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+        logging.info(f"Loaded {len(self._entries)} cached entries from {self.persist_path}")
+
+    def save(self):
+        if not self.persist_path:
+            return
+        self.purge_expired()
+        data = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items()]
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logging.error(f"Failed to save cache file {self.persist_path}: {e}")
+
+def normalize_url(url: str) -> str:
+    """Build a cache key that is the same for every spelling of the same video or playlist."""
+    url = url.strip()
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    query = parse_qs(parsed.query)
+
+    if host == 'youtu.be' and parsed.path.strip('/'):
+        return f"youtube:{parsed.path.strip('/')}"
+    if host in ('youtube.com', 'music.youtube.com'):
+        if 'v' in query:
+            return f"youtube:{query['v'][0]}"
+        if parsed.path.startswith('/shorts/'):
+            return f"youtube:{parsed.path.split('/')[2]}"
+        if 'list' in query:
+            return f"youtube-list:{query['list'][0]}"
+
+    return f"{parsed.scheme.lower()}://{host}{parsed.path}" + (f"?{parsed.query}" if parsed.query else '')
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+def stream_ttl(stream_url: str) -> float:
+    """TTL for a resolved stream URL, based on the expiry googlevideo encodes in it."""
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if not expire:
+        return DEFAULT_STREAM_TTL
+    try:
+        return int(expire[0]) - time.time() - STREAM_EXPIRY_MARGIN
+    except ValueError:
+        return DEFAULT_STREAM_TTL
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one shared task."""
+
+    def __init__(self):
+        self._inflight = {}  # key -> task running the first caller's lookup
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, func, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        # Shielded so one caller giving up does not cancel the lookup for everyone else
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when every caller has gone away
+
+    def stats(self):
+        return {
+            'in_flight': len(self._inflight),
+            'started': self.started,
+            'coalesced': self.coalesced,
+        }
+
+# Shared by every guild, and kept across reloads of the music extension
+metadata_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES, persist_path=cluster_path(CACHE_FILE) if CACHE_FILE else None)
+inflight_lookups = SingleFlight()
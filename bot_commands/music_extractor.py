@@ -0,0 +1,191 @@
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+EXTRACTOR_WORKERS = 2
+# Workers are replaced after this many jobs to keep yt_dlp memory growth in check
+EXTRACTOR_MAX_JOBS_PER_WORKER = 200
+# Jobs allowed to wait or run at once, anything past that is refused instead of piling up
+EXTRACTOR_QUEUE_SIZE = 64
+EXTRACTOR_TIMEOUT = 30.0
+
+# yt_dlp options for every kind of lookup, each worker keeps one warm YoutubeDL per preset
+PRESETS = {
+    # Playlists are enumerated flat: entries only carry their page URL, title and
+    # duration, the stream itself is resolved right before the entry is played.
+    'info': {
+        'format': 'bestaudio[acodec=opus]/bestaudio/best',
+        'noplaylist': False,  # Allow playlist extraction
+        'extract_flat': 'in_playlist',
+        'quiet': True,
+    },
+    'stream': {
+        # Opus formats can be passed through to Discord without transcoding
+        'format': 'bestaudio[acodec=opus]/bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+    },
+    # Used by the on-disk audio cache, files are named after the video ID and always end up as Opus
+    'download': {
+        'format': 'bestaudio[acodec=opus]/bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'opus',
+        }],
+        'outtmpl': 'audio_cache/%(id)s.%(ext)s',
+        'noplaylist': True,
+        'noprogress': True,
+        'quiet': True,
+    },
+    'search': {
+        'format': 'bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+        'default_search': 'ytsearch',
+        'extract_flat': 'in_playlist',
+    },
+}
+
+# Bulky fields nobody in the bot reads, dropped before results are sent back to the bot process
+_DROPPED_FIELDS = ('formats', 'thumbnails', 'automatic_captions', 'subtitles', 'heatmap', 'requested_formats')
+
+class ExtractorBusy(Exception):
+    """Raised when the extractor queue is full."""
+
+class ExtractionError(Exception):
+    """Raised when yt_dlp fails to extract a URL in a worker."""
+
+# Worker process side
+
+_ydl_instances = {}
+
+def _init_worker(retired):
+    import yt_dlp
+    for preset, opts in PRESETS.items():
+        _ydl_instances[preset] = yt_dlp.YoutubeDL(dict(opts))
+    # A job stuck in yt_dlp can't be cancelled, the worker exits once the bot gave up on its pool
+    threading.Thread(target=_exit_when_retired, args=(retired,), daemon=True).start()
+
+def _exit_when_retired(retired):
+    retired.wait()
+    os._exit(1)
+
+def _extract(preset, url, params=None, download=False):
+    ydl = _ydl_instances[preset]
+    # Per-job options (e.g. playlist_items) are applied to the warm instance for this job only
+    saved = {key: ydl.params.get(key) for key in params or {}}
+    ydl.params.update(params or {})
+    try:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=download))
+    except Exception as e:
+        # yt_dlp errors hold tracebacks that cannot be pickled back to the bot process
+        raise ExtractionError(str(e)) from None
+    finally:
+        ydl.params.update(saved)
+    for field in _DROPPED_FIELDS:
+        info.pop(field, None)
+    return info
+
+# Bot process side
+
+class ExtractorPool:
+    """Long-lived pool of worker processes running yt_dlp extraction off the event loop's GIL."""
+
+    def __init__(self, workers=EXTRACTOR_WORKERS, max_jobs_per_worker=EXTRACTOR_MAX_JOBS_PER_WORKER,
+                 queue_size=EXTRACTOR_QUEUE_SIZE, timeout=EXTRACTOR_TIMEOUT):
+        self.workers = workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._retired = None  # Event the current pool's workers exit on
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Worker recycling needs fresh interpreters, fork is not allowed with max_tasks_per_child
+            context = multiprocessing.get_context('spawn')
+            self._retired = context.Event()
+            try:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._retired,),
+                    max_tasks_per_child=self.max_jobs_per_worker,
+                )
+            except TypeError:  # Python < 3.11 has no worker recycling
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._retired,),
+                )
+            logging.info(f"Started yt_dlp extractor pool with {self.workers} workers")
+        return self._executor
+
+    async def extract(self, preset, url, params=None, download=False):
+        if self.pending >= self.queue_size:
+            self.rejected += 1
+            raise ExtractorBusy("Too many music lookups are queued, try again in a moment.")
+
+        self.pending += 1
+        executor = self._get_executor()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, _extract, preset, url, params, download)
+            # Cancelling (timeout or caller cancelled) drops the job if a worker has not picked it up yet
+            info = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # A job already running can't be cancelled and would hold its worker for good
+            self._retire_executor(executor)
+            raise
+        except BrokenProcessPool:
+            logging.error("Extractor pool broke, it will be restarted on the next lookup")
+            self.failed += 1
+            self._executor = None
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        return info
+
+    def _retire_executor(self, executor):
+        """Send new jobs to a fresh pool and have the old one's workers exit once its other jobs had their time."""
+        if self._executor is not executor:
+            return  # Already replaced after an earlier timeout
+        self._executor = None
+        executor.shutdown(wait=False, cancel_futures=False)
+        logging.warning("Extractor job timed out, replacing the worker pool")
+        # Jobs still running after another full timeout are stuck as well, their workers exit on this
+        asyncio.get_running_loop().call_later(self.timeout, self._retired.set)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+        }
+
+# Shared by every guild, and kept across reloads of the music extension
+extractor_pool = ExtractorPool()
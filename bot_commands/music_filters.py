@@ -0,0 +1,152 @@
+import math
+import discord
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+VOLUME_MIN = 0
+VOLUME_MAX = 200
+
+# Gains in dB for the (bass, mid, treble) bands
+EQ_PRESETS = {
+    'flat': (0.0, 0.0, 0.0),
+    'bass': (6.0, 0.0, -1.0),
+    'treble': (-1.0, 0.0, 5.0),
+    'vocal': (-3.0, 4.0, 1.0),
+    'loud': (4.0, -1.0, 3.0),
+}
+# Band edges in Hz: full bass gain below the first, full mid gain between the next two, full treble above the last
+EQ_BAND_EDGES = (150, 400, 2500, 5000)
+# Linear phase FIR length, long enough to resolve the bass band (about 100 Hz at 48 kHz)
+EQ_TAPS = 511
+# FFT size for overlap-save filtering of one frame plus the EQ_TAPS - 1 samples before it
+EQ_FFT_SIZE = 2048
+
+# Normalization steers the running loudness towards this RMS (about -20 dBFS)
+NORMALIZE_TARGET_RMS = 0.1 * 32768
+NORMALIZE_MAX_GAIN = 4.0
+# Share of each frame's loudness taken into the running estimate, about one second of memory
+NORMALIZE_SMOOTHING = 0.02
+# Frames quieter than this do not move the estimate, so pauses in a song are not blown up
+NORMALIZE_SILENCE_RMS = 0.003 * 32768
+
+class FilterSettings:
+    """Per-guild playback filters. Every change bumps version, so playing sources pick it up."""
+
+    __slots__ = ('volume', 'normalize', 'eq', 'version')
+
+    def __init__(self, volume=100, normalize=False, eq='flat'):
+        self.volume = volume
+        self.normalize = normalize
+        self.eq = eq
+        self.version = 0
+
+    @property
+    def active(self):
+        return self.volume != 100 or self.normalize or self.eq != 'flat'
+
+    def update(self, **changes):
+        for name, value in changes.items():
+            setattr(self, name, value)
+        self.version += 1
+
+    def to_dict(self):
+        return {'volume': self.volume, 'normalize': self.normalize, 'eq': self.eq}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+def design_eq(gains_db):
+    """Linear phase FIR taps for three band gains in dB, by frequency sampling."""
+    import numpy as np
+    freqs = np.fft.rfftfreq(EQ_FFT_SIZE * 2, 1 / SAMPLE_RATE)
+    bass, mid, treble = gains_db
+    low, mid_low, mid_high, high = EQ_BAND_EDGES
+    # Gains are interpolated on a log frequency axis, the way the bands are heard
+    curve_db = np.interp(
+        np.log2(np.maximum(freqs, 20.0)),
+        np.log2([20.0, low, mid_low, mid_high, high, SAMPLE_RATE / 2]),
+        [bass, bass, mid, mid, treble, treble],
+    )
+    response = 10 ** (curve_db / 20)
+    impulse = np.fft.irfft(response)
+    taps = np.roll(impulse, EQ_TAPS // 2)[:EQ_TAPS] * np.hamming(EQ_TAPS)
+    return taps.astype(np.float32)
+
+class FilterChain:
+    """Volume, loudness normalization and EQ over 20 ms stereo int16 frames, all vectorized.
+
+    Everything that depends only on the settings (volume gain, EQ spectrum) is computed once here.
+    """
+
+    def __init__(self, settings):
+        # numpy is imported by the first chain, so loading the music cog doesn't pay for it
+        import numpy as np
+        self.version = settings.version
+        self.gain = settings.volume / 100
+        self.normalize = settings.normalize
+        self.eq_spectrum = None
+        self.history = None
+        gains = EQ_PRESETS.get(settings.eq, EQ_PRESETS['flat'])
+        if any(gains):
+            # Precomputed once, each frame then costs one forward and one inverse real FFT
+            self.eq_spectrum = np.fft.rfft(design_eq(gains), EQ_FFT_SIZE)[:, None]
+            self.history = np.zeros((EQ_TAPS - 1, CHANNELS), dtype=np.float32)
+        self.loudness = NORMALIZE_TARGET_RMS ** 2  # Running mean square
+        self.normalize_gain = 1.0
+
+    def _equalize(self, frame):
+        import numpy as np
+        block = np.concatenate((self.history, frame))
+        self.history = block[-(EQ_TAPS - 1):]
+        filtered = np.fft.irfft(np.fft.rfft(block, EQ_FFT_SIZE, axis=0) * self.eq_spectrum, EQ_FFT_SIZE, axis=0)
+        # Overlap-save: outputs before EQ_TAPS - 1 wrap around the block and are dropped
+        return filtered[EQ_TAPS - 1:EQ_TAPS - 1 + len(frame)]
+
+    def process(self, data):
+        import numpy as np
+        # A read-only view of the frame's bytes, the int16 samples are not copied until converted
+        samples = np.frombuffer(memoryview(data), dtype=np.int16)
+        if len(samples) % CHANNELS:
+            return data
+        frame = samples.reshape(-1, CHANNELS).astype(np.float32)
+
+        if self.eq_spectrum is not None:
+            frame = self._equalize(frame)
+
+        gain = self.gain
+        if self.normalize:
+            power = float(np.mean(frame * frame))
+            if power > NORMALIZE_SILENCE_RMS ** 2:
+                self.loudness += (power - self.loudness) * NORMALIZE_SMOOTHING
+            target = min(NORMALIZE_MAX_GAIN, NORMALIZE_TARGET_RMS / math.sqrt(self.loudness))
+            # Ramp across the frame from the previous gain, a sudden step would click
+            gain = np.linspace(self.normalize_gain, target, len(frame), dtype=np.float32)[:, None] * self.gain
+            self.normalize_gain = target
+
+        frame *= gain
+        np.clip(frame, -32768, 32767, out=frame)
+        return frame.astype(np.int16).tobytes()
+
+class FilteredSource(discord.AudioSource):
+    """Runs a PCM source through the guild's filter chain, following changes to its settings."""
+
+    def __init__(self, source, settings):
+        self.source = source
+        self.settings = settings
+        self.chain = FilterChain(settings)
+
+    def read(self):
+        data = self.source.read()
+        if not data or not self.settings.active:
+            return data
+        if self.chain.version != self.settings.version:
+            self.chain = FilterChain(self.settings)
+        return self.chain.process(data)
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.source.cleanup()
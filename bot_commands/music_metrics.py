@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import weakref
+import discord
+from bot_commands.histogram import Histogram
+
+FRAME_MS = 20.0
+# A read slower than this still made it, but the player sent the frame late
+LATE_FRAME_MS = FRAME_MS
+# A read blocking this long means ffmpeg had nothing buffered, the stream ran dry
+UNDERRUN_MS = 100.0
+# Longer gaps between reads are pauses or reconnects, not the player falling behind
+STALL_IGNORE_MS = 1000.0
+
+FRAME_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+TRACK_BUCKETS_MS = (50, 100, 250, 500, 1000, 2000, 5000, 10000, 30000)
+
+class PlaybackMetrics:
+    """Audio path health of one guild, also added up into a parent for the whole bot.
+
+    Frames are recorded from the voice player thread. Counters may lose an update under
+    contention, which is fine for health numbers and keeps the per-frame cost low.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.frame_read = Histogram(FRAME_BUCKETS_MS)
+        self.first_audio = Histogram(TRACK_BUCKETS_MS)
+        self.resolve_wait = Histogram(TRACK_BUCKETS_MS)
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.underruns = 0
+        self.tracks = 0
+        self._opening_since = None
+
+    def _chain(self):
+        return (self, self.parent) if self.parent else (self,)
+
+    def record_frame(self, read_ms, gap_ms):
+        # Reads are due every FRAME_MS, a longer gap means the player fell behind by whole frames
+        dropped = int(gap_ms / FRAME_MS) - 1 if FRAME_MS * 2 <= gap_ms < STALL_IGNORE_MS else 0
+        for metrics in self._chain():
+            metrics.frame_read.observe(read_ms)
+            metrics.frames += 1
+            if read_ms > LATE_FRAME_MS:
+                metrics.late_frames += 1
+            if read_ms > UNDERRUN_MS:
+                metrics.underruns += 1
+            metrics.dropped_frames += dropped
+
+    def track_opening(self):
+        """Mark the start of opening a track, its first audible frame completes the measurement."""
+        self._opening_since = time.perf_counter()
+
+    def first_frame(self):
+        if self._opening_since is None:
+            return
+        elapsed = (time.perf_counter() - self._opening_since) * 1000
+        self._opening_since = None
+        for metrics in self._chain():
+            metrics.first_audio.observe(elapsed)
+            metrics.tracks += 1
+
+    def record_resolve_wait(self, wait_ms):
+        for metrics in self._chain():
+            metrics.resolve_wait.observe(wait_ms)
+
+    def summary(self):
+        return {
+            'frames': self.frames,
+            'late_frames': self.late_frames,
+            'dropped_frames': self.dropped_frames,
+            'underruns': self.underruns,
+            'tracks': self.tracks,
+            'frame_read_p50_ms': self.frame_read.percentile(0.5),
+            'frame_read_p99_ms': self.frame_read.percentile(0.99),
+            'frame_read_max_ms': self.frame_read.max,
+            'first_audio_p50_ms': self.first_audio.percentile(0.5),
+            'first_audio_max_ms': self.first_audio.max,
+            'resolve_wait_p50_ms': self.resolve_wait.percentile(0.5),
+            'resolve_wait_max_ms': self.resolve_wait.max,
+        }
+
+class MeteredSource(discord.AudioSource):
+    """Times every read() the voice player makes and records it in the guild's metrics."""
+
+    def __init__(self, source, metrics):
+        self.source = source
+        self.metrics = metrics
+        self._last_read = None
+
+    def read(self):
+        started = time.perf_counter()
+        data = self.source.read()
+        finished = time.perf_counter()
+        gap = (started - self._last_read) * 1000 if self._last_read is not None else 0.0
+        self._last_read = started
+        self.metrics.record_frame((finished - started) * 1000, gap)
+        if data:
+            self.metrics.first_frame()
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+# Sources whose ffmpeg processes are counted, entries go away with the sources
+_ffmpeg_sources = weakref.WeakSet()
+
+def track_ffmpeg(source):
+    _ffmpeg_sources.add(source)
+    return source
+
+def live_ffmpeg_processes():
+    count = 0
+    for source in list(_ffmpeg_sources):
+        # discord.py sets the process to a falsy placeholder once it is cleaned up
+        process = getattr(source, '_process', None)
+        if process and process.poll() is None:
+            count += 1
+    return count
+
+def host_load():
+    """Load figures to line playback problems up against."""
+    try:
+        load = os.getloadavg()
+    except (AttributeError, OSError):  # Not available on Windows
+        load = None
+    return {
+        'load_average': load,
+        'process_cpu_seconds': time.process_time(),
+        'threads': threading.active_count(),
+        'ffmpeg_processes': live_ffmpeg_processes(),
+    }
+
+def export_prometheus(metrics_by_guild):
+    """Render {guild label: PlaybackMetrics} in the Prometheus text exposition format."""
+    lines = []
+    counters = ('frames', 'late_frames', 'dropped_frames', 'underruns', 'tracks')
+    for name in counters:
+        lines.append(f"# TYPE music_{name}_total counter")
+        for guild, metrics in metrics_by_guild.items():
+            lines.append(f'music_{name}_total{{guild="{guild}"}} {getattr(metrics, name)}')
+
+    for name in ('frame_read', 'first_audio', 'resolve_wait'):
+        lines.append(f"# TYPE music_{name}_ms histogram")
+        for guild, metrics in metrics_by_guild.items():
+            histogram = getattr(metrics, name)
+            cumulative = 0
+            for bound, count in zip(list(histogram.bounds) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'music_{name}_ms_bucket{{guild="{guild}",le="{bound}"}} {cumulative}')
+            lines.append(f'music_{name}_ms_sum{{guild="{guild}"}} {histogram.sum:.3f}')
+            lines.append(f'music_{name}_ms_count{{guild="{guild}"}} {histogram.count}')
+
+    load = host_load()
+    lines.append("# TYPE music_ffmpeg_processes gauge")
+    lines.append(f"music_ffmpeg_processes {load['ffmpeg_processes']}")
+    lines.append("# TYPE process_cpu_seconds_total counter")
+    lines.append(f"process_cpu_seconds_total {load['process_cpu_seconds']:.3f}")
+    lines.append("# TYPE process_threads gauge")
+    lines.append(f"process_threads {load['threads']}")
+    if load['load_average']:
+        lines.append("# TYPE node_load1 gauge")
+        lines.append(f"node_load1 {load['load_average'][0]:.2f}")
+    return "\n".join(lines) + "\n"
+
+# Totals over every guild, kept across reloads of the music extension and guild state eviction
+playback_totals = PlaybackMetrics()
@@ -0,0 +1,218 @@
+"""Audio node process, owning voice connections and playback for the music cog.
+
+Started by bot_commands.music_node_client as `python -m bot_commands.music_node --port <port>`.
+The bot forwards its voice gateway events here and sends playback commands, and the node
+asks the bot to send voice state updates on its behalf. Messages are JSON lines:
+
+    bot -> node: hello, connect, voice_state, voice_server, play, pause, resume, stop, disconnect
+    node -> bot: gateway, connected, connect_failed, track_end, disconnected
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import aiohttp
+import discord
+from bot_commands.music_audio import open_ffmpeg_source
+
+# Bot connections that do not say hello with the right secret in time are dropped
+HELLO_TIMEOUT = 5.0
+# Longest accepted message, voice events and source specs are far below this
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+# discord.VoiceClient expects a logged in client around it. The node has no gateway
+# connection, so these stand in for the few parts of the client the voice code touches.
+
+class _User:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class _Member:
+    voice = None  # The node never sees member voice states, the connection's own flags are used
+
+class _HTTP:
+    def __init__(self):
+        self._session = None
+
+    async def ws_connect(self, url, *, compress=0):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return await self._session.ws_connect(url, max_msg_size=0, timeout=30.0, autoclose=False, compress=compress)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+class _ConnectionState:
+    def __init__(self, node, user_id):
+        self.node = node
+        self.loop = asyncio.get_running_loop()
+        self.user = _User(user_id)
+        self.http = node.http
+
+    def _remove_voice_client(self, guild_id):
+        # Called by VoiceClient.cleanup(), whether we left, were kicked or the connection failed
+        if self.node.sessions.pop(guild_id, None) is not None:
+            self.node.post('disconnected', guild_id=guild_id)
+
+class _Client:
+    def __init__(self, node, user_id):
+        self._connection = _ConnectionState(node, user_id)
+
+class _Guild:
+    def __init__(self, node, guild_id):
+        self.node = node
+        self.id = guild_id
+        self.me = _Member()
+
+    def get_channel(self, channel_id):
+        return _Channel(self, channel_id)
+
+    async def change_voice_state(self, *, channel, self_mute=False, self_deaf=False):
+        # Only the bot's gateway connection can send this, so it is asked to
+        self.node.post(
+            'gateway',
+            guild_id=self.id,
+            channel_id=channel.id if channel else None,
+            self_mute=self_mute,
+            self_deaf=self_deaf,
+        )
+
+class _Channel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+
+    def _get_voice_client_key(self):
+        return self.guild.id, 'guild_id'
+
+class AudioNodeServer:
+    def __init__(self, secret, ffmpeg_path):
+        self.secret = secret
+        self.http = _HTTP()
+        self.sessions = {}  # guild ID -> VoiceClient
+        self.ffmpeg_path = ffmpeg_path
+        self._writer = None
+        self._done = asyncio.Event()
+
+    def post(self, op, **fields):
+        if self._writer is None or self._writer.is_closing():
+            return
+        self._writer.write(json.dumps({'op': op, **fields}).encode() + b'\n')
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_bot, host, port, limit=MAX_MESSAGE_SIZE)
+        logging.info(f"Audio node listening on {host}:{port}")
+        async with server:
+            await self._done.wait()
+        await self.http.close()
+
+    async def handle_bot(self, reader, writer):
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT))
+        except (asyncio.TimeoutError, ValueError):
+            writer.close()
+            return
+        if hello.get('op') != 'hello' or hello.get('secret') != self.secret:
+            logging.warning("Audio node refused a connection without the right secret")
+            writer.close()
+            return
+        if self._writer is not None:
+            writer.close()
+            return
+
+        self._writer = writer
+        logging.info("Bot connected to audio node")
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                try:
+                    await self.dispatch(message)
+                except Exception as e:
+                    logging.error(f"Audio node failed to handle {message.get('op')}: {e}")
+        finally:
+            # The bot went away, so nobody is left to send voice state updates for us
+            logging.info("Bot disconnected from audio node, shutting down")
+            for voice_client in list(self.sessions.values()):
+                voice_client.stop()
+            self._writer = None
+            writer.close()
+            self._done.set()
+
+    async def dispatch(self, message):
+        op = message['op']
+        guild_id = message['guild_id']
+        voice_client = self.sessions.get(guild_id)
+
+        if op == 'connect':
+            asyncio.create_task(self.connect(message))
+        elif voice_client is None:
+            if op == 'play':
+                self.post('track_end', guild_id=guild_id, track=message['track'], error="Not connected to voice.")
+            elif op == 'disconnect':
+                self.post('disconnected', guild_id=guild_id)
+        elif op == 'voice_state':
+            await voice_client.on_voice_state_update(message['data'])
+        elif op == 'voice_server':
+            await voice_client.on_voice_server_update(message['data'])
+        elif op == 'play':
+            await self.play(voice_client, guild_id, message['track'], message['source'])
+        elif op == 'pause':
+            voice_client.pause()
+        elif op == 'resume':
+            voice_client.resume()
+        elif op == 'stop':
+            voice_client.stop()
+        elif op == 'disconnect':
+            await voice_client.disconnect(force=message.get('force', False))
+
+    async def connect(self, message):
+        guild_id = message['guild_id']
+        guild = _Guild(self, guild_id)
+        voice_client = discord.VoiceClient(_Client(self, message['user_id']), guild.get_channel(message['channel_id']))
+        self.sessions[guild_id] = voice_client
+        try:
+            await voice_client.connect(
+                reconnect=message.get('reconnect', True),
+                timeout=message.get('timeout', 30.0),
+                self_deaf=message.get('self_deaf', False),
+                self_mute=message.get('self_mute', False),
+            )
+        except Exception as e:
+            logging.error(f"Audio node failed to connect to voice in guild {guild_id}: {e}")
+            self.sessions.pop(guild_id, None)
+            self.post('connect_failed', guild_id=guild_id, error=str(e) or type(e).__name__)
+            return
+        self.post('connected', guild_id=guild_id)
+
+    async def play(self, voice_client, guild_id, track, spec):
+        loop = asyncio.get_running_loop()
+
+        def after(error):
+            loop.call_soon_threadsafe(
+                lambda: self.post('track_end', guild_id=guild_id, track=track, error=str(error) if error else None)
+            )
+
+        try:
+            source = await asyncio.to_thread(open_ffmpeg_source, spec, self.ffmpeg_path)
+        except Exception as e:
+            after(e)
+            return
+        if voice_client.is_playing() or voice_client.is_paused():
+            voice_client.stop()
+        voice_client.play(source, after=after)
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio node for the music cog")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s %(levelname)s:[node {args.port}] %(message)s')
+    asyncio.run(AudioNodeServer(os.environ.get('AUDIO_NODE_SECRET', ''), args.ffmpeg).serve(args.host, args.port))
+
+if __name__ == '__main__':
+    main()
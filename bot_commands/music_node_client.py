@@ -0,0 +1,312 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sys
+import discord
+
+# Set to True to run voice connections and playback in separate audio node processes
+AUDIO_NODE_ENABLED = False
+# Guilds are spread over this many node processes, so playback uses that many cores
+AUDIO_NODE_COUNT = 2
+AUDIO_NODE_HOST = '127.0.0.1'
+AUDIO_NODE_BASE_PORT = 47800
+# Every cluster started by cluster.py runs its own nodes, on the ports after the previous cluster's
+AUDIO_NODE_PORT_OFFSET = int(os.getenv('CLUSTER_ID', 0)) * AUDIO_NODE_COUNT
+AUDIO_NODE_START_TIMEOUT = 10.0
+# A node that dies is started again after this long
+AUDIO_NODE_RESTART_DELAY = 5.0
+AUDIO_NODE_DISCONNECT_TIMEOUT = 10.0
+# Longest wait for a node that is down or restarting before a message to it fails
+AUDIO_NODE_SEND_TIMEOUT = 10.0
+
+class AudioNodeUnavailable(discord.ClientException):
+    """Raised when a message can't be sent because the audio node is down."""
+
+class AudioNode:
+    """Bot side of the connection to one audio node process."""
+
+    def __init__(self, index, secret, ffmpeg_path):
+        self.index = index
+        self.port = AUDIO_NODE_BASE_PORT + AUDIO_NODE_PORT_OFFSET + index
+        self.secret = secret
+        self.ffmpeg_path = ffmpeg_path
+        self.clients = {}  # guild ID -> NodeVoiceClient
+        self.process = None
+        self.restarts = 0
+        self.sent = 0
+        self.received = 0
+        self._writer = None
+        self._reader_task = None
+        self._ready = asyncio.Event()
+        self._closing = False
+
+    @property
+    def alive(self):
+        return self._ready.is_set()
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'bot_commands.music_node', '--host', AUDIO_NODE_HOST, '--port', str(self.port),
+            '--ffmpeg', self.ffmpeg_path,
+            env={**os.environ, 'AUDIO_NODE_SECRET': self.secret},
+        )
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + AUDIO_NODE_START_TIMEOUT
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(AUDIO_NODE_HOST, self.port, limit=1024 * 1024)
+                break
+            except OSError:
+                if loop.time() > deadline or self.process.returncode is not None:
+                    raise RuntimeError(f"Audio node {self.index} did not start on port {self.port}")
+                await asyncio.sleep(0.2)
+
+        self._writer = writer
+        writer.write(json.dumps({'op': 'hello', 'secret': self.secret}).encode() + b'\n')
+        self._ready.set()
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+        logging.info(f"Audio node {self.index} started with PID {self.process.pid} on port {self.port}")
+
+    async def close(self):
+        self._closing = True
+        self._ready.clear()
+        if self._writer is not None:
+            self._writer.close()
+        if self.process is not None and self.process.returncode is None:
+            try:
+                await asyncio.wait_for(self.process.wait(), 5.0)
+            except asyncio.TimeoutError:
+                self.process.kill()
+
+    async def send(self, op, ready_timeout=AUDIO_NODE_SEND_TIMEOUT, **fields):
+        try:
+            await asyncio.wait_for(self._ready.wait(), ready_timeout)
+        except asyncio.TimeoutError:
+            raise AudioNodeUnavailable(f"Audio node {self.index} is not running, try again in a moment.") from None
+        self.sent += 1
+        self._writer.write(json.dumps({'op': op, **fields}).encode() + b'\n')
+        await self._writer.drain()
+
+    def post(self, op, **fields):
+        if not self.alive:
+            # Whatever the message was for ended with the node
+            logging.warning(f"Dropped {op} for audio node {self.index}, it is not running")
+            return
+        asyncio.create_task(self.send(op, **fields))
+
+    async def _read_loop(self, reader):
+        try:
+            while line := await reader.readline():
+                self.received += 1
+                message = json.loads(line)
+                client = self.clients.get(message['guild_id'])
+                if client is not None:
+                    client.handle(message)
+        finally:
+            self._ready.clear()
+
+        # The node exited, every voice connection it held is gone with it
+        for client in list(self.clients.values()):
+            client.handle({'op': 'disconnected', 'guild_id': client.guild.id})
+        if self._closing:
+            return
+        logging.error(f"Audio node {self.index} exited, restarting it in {AUDIO_NODE_RESTART_DELAY:.0f}s")
+        await asyncio.sleep(AUDIO_NODE_RESTART_DELAY)
+        self.restarts += 1
+        try:
+            await self.start()
+        except Exception as e:
+            logging.error(f"Failed to restart audio node {self.index}: {e}")
+
+    def stats(self):
+        return {
+            'alive': self.alive,
+            'pid': self.process.pid if self.process else None,
+            'guilds': len(self.clients),
+            'restarts': self.restarts,
+            'sent': self.sent,
+            'received': self.received,
+        }
+
+class AudioNodePool:
+    """The audio node processes. Lives outside the cog, so playback carries on through extension reloads."""
+
+    def __init__(self, count=AUDIO_NODE_COUNT, enabled=AUDIO_NODE_ENABLED):
+        self.enabled = enabled
+        self.count = count
+        self.nodes = []
+        self._lock = asyncio.Lock()
+
+    async def start(self, ffmpeg_path='ffmpeg'):
+        async with self._lock:
+            if self.nodes:
+                return
+            secret = secrets.token_hex(16)
+            nodes = [AudioNode(index, secret, ffmpeg_path) for index in range(self.count)]
+            await asyncio.gather(*(node.start() for node in nodes))
+            self.nodes = nodes
+
+    async def close(self):
+        await asyncio.gather(*(node.close() for node in self.nodes))
+        self.nodes = []
+
+    def node_for(self, guild_id):
+        # Same snowflake timestamp bits the progress scheduler spreads guilds with
+        return self.nodes[(guild_id >> 22) % len(self.nodes)]
+
+    def stats(self):
+        return [node.stats() for node in self.nodes]
+
+class NodeVoiceClient(discord.VoiceProtocol):
+    """Voice protocol whose connection and player live in an audio node process.
+
+    It offers the parts of discord.VoiceClient the music cog uses, but play() takes the
+    source spec of music_audio.open_ffmpeg_source instead of an AudioSource, since ffmpeg
+    is started by the node. Voice gateway events received by the bot are forwarded to the node.
+    """
+
+    def __init__(self, client, channel):
+        super().__init__(client, channel)
+        self.guild = channel.guild
+        self.node = audio_nodes.node_for(self.guild.id)
+        self._connected = False
+        self._playing = False
+        self._paused = False
+        self._track = 0
+        self._after = None
+        self._connect_waiter = None
+        self._disconnect_waiter = None
+
+    async def connect(self, *, timeout, reconnect, self_deaf=False, self_mute=False):
+        loop = asyncio.get_running_loop()
+        self._connect_waiter = loop.create_future()
+        self.node.clients[self.guild.id] = self
+        try:
+            await self.node.send(
+                'connect',
+                ready_timeout=timeout,
+                guild_id=self.guild.id,
+                channel_id=self.channel.id,
+                user_id=self.client.user.id,
+                timeout=timeout,
+                reconnect=reconnect,
+                self_deaf=self_deaf,
+                self_mute=self_mute,
+            )
+        except AudioNodeUnavailable:
+            self.cleanup()
+            raise
+        try:
+            await asyncio.wait_for(self._connect_waiter, timeout)
+        except discord.ClientException:
+            self.cleanup()
+            raise
+
+    async def on_voice_state_update(self, data):
+        if data['channel_id'] is not None:
+            self.channel = self.guild.get_channel(int(data['channel_id'])) or self.channel
+        await self.node.send('voice_state', guild_id=self.guild.id, data=data)
+
+    async def on_voice_server_update(self, data):
+        await self.node.send('voice_server', guild_id=self.guild.id, data=data)
+
+    async def disconnect(self, *, force=False):
+        if not self._connected and not force:
+            return
+        self._disconnect_waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self.node.send('disconnect', guild_id=self.guild.id, force=force)
+        except AudioNodeUnavailable:
+            # The voice connection went down with the node
+            self._finish_disconnect()
+            return
+        try:
+            # Keep forwarding voice events until the node has seen itself leave
+            await asyncio.wait_for(self._disconnect_waiter, AUDIO_NODE_DISCONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"Audio node did not confirm leaving voice in guild {self.guild.id}")
+            self._finish_disconnect()
+
+    def cleanup(self):
+        if self.node.clients.get(self.guild.id) is self:
+            del self.node.clients[self.guild.id]
+        super().cleanup()
+
+    def handle(self, message):
+        op = message['op']
+        if op == 'gateway':
+            channel_id = message['channel_id']
+            channel = discord.Object(id=int(channel_id)) if channel_id else None
+            asyncio.create_task(
+                self.guild.change_voice_state(channel=channel, self_mute=message['self_mute'], self_deaf=message['self_deaf'])
+            )
+        elif op == 'connected':
+            self._connected = True
+            if self._connect_waiter and not self._connect_waiter.done():
+                self._connect_waiter.set_result(None)
+        elif op == 'connect_failed':
+            if self._connect_waiter and not self._connect_waiter.done():
+                self._connect_waiter.set_exception(discord.ClientException(message['error']))
+        elif op == 'track_end':
+            # A track replaced by a newer play() reports its end late, only the current one counts
+            if message['track'] != self._track:
+                return
+            self._playing = False
+            self._paused = False
+            after, self._after = self._after, None
+            if after is not None:
+                error = message.get('error')
+                after(discord.ClientException(error) if error else None)
+        elif op == 'disconnected':
+            self._finish_disconnect()
+
+    def _finish_disconnect(self):
+        self._connected = False
+        if self._connect_waiter and not self._connect_waiter.done():
+            self._connect_waiter.set_exception(discord.ClientException("Audio node lost the voice connection."))
+        if self._disconnect_waiter and not self._disconnect_waiter.done():
+            self._disconnect_waiter.set_result(None)
+        if self.node.clients.get(self.guild.id) is self:
+            self.cleanup()
+        if self._playing or self._paused:
+            self.handle({'op': 'track_end', 'guild_id': self.guild.id, 'track': self._track, 'error': None})
+
+    def play(self, source, *, after=None):
+        if not self._connected:
+            raise discord.ClientException('Not connected to voice.')
+        if self._playing or self._paused:
+            raise discord.ClientException('Already playing audio.')
+        self._track += 1
+        self._after = after
+        self._playing = True
+        self._paused = False
+        self.node.post('play', guild_id=self.guild.id, track=self._track, source=source)
+
+    def pause(self):
+        if self._playing and not self._paused:
+            self._paused = True
+            self.node.post('pause', guild_id=self.guild.id)
+
+    def resume(self):
+        if self._paused:
+            self._paused = False
+            self.node.post('resume', guild_id=self.guild.id)
+
+    def stop(self):
+        if self._playing or self._paused:
+            self.node.post('stop', guild_id=self.guild.id)
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._playing and not self._paused
+
+    def is_paused(self):
+        return self._paused
+
+# Shared by every guild, and kept across reloads of the music extension
+audio_nodes = AudioNodePool()
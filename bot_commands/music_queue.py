@@ -0,0 +1,110 @@
+import random
+from collections import deque
+from datetime import timedelta
+from itertools import islice
+
+QUEUE_PAGE_SIZE = 10
+# Discord rejects embed field values longer than this
+FIELD_LIMIT = 1024
+# Titles are cut to this length so a full page always fits in one field
+TITLE_LIMIT = 80
+
+class MusicQueue:
+    """Song queue of (url, title, duration) entries.
+
+    Adding and taking songs is O(1), the total duration is kept up to date as entries
+    come and go, and rendered pages are cached until the queue changes.
+    """
+
+    def __init__(self, entries=()):
+        self._entries = deque()
+        self._total_duration = 0
+        self._page_cache = {}
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def _changed(self):
+        self._page_cache.clear()
+
+    @property
+    def total_duration(self):
+        return self._total_duration
+
+    def append(self, entry):
+        self._entries.append(entry)
+        self._total_duration += entry[2]
+        self._changed()
+
+    def appendleft(self, entry):
+        self._entries.appendleft(entry)
+        self._total_duration += entry[2]
+        self._changed()
+
+    def extend(self, entries):
+        for entry in entries:
+            self._entries.append(entry)
+            self._total_duration += entry[2]
+        self._changed()
+
+    def popleft(self):
+        entry = self._entries.popleft()
+        self._total_duration -= entry[2]
+        self._changed()
+        return entry
+
+    def peek(self, count):
+        return list(islice(self._entries, count))
+
+    def remove(self, index):
+        """Remove and return the entry at a 0-based index."""
+        entry = self._entries[index]
+        del self._entries[index]
+        self._total_duration -= entry[2]
+        self._changed()
+        return entry
+
+    def move(self, source, destination):
+        """Move the entry at source to destination, both 0-based."""
+        entry = self._entries[source]
+        del self._entries[source]
+        self._entries.insert(destination, entry)
+        self._changed()
+        return entry
+
+    def shuffle(self):
+        entries = list(self._entries)
+        random.shuffle(entries)
+        self._entries = deque(entries)
+        self._changed()
+
+    def clear(self):
+        self._entries.clear()
+        self._total_duration = 0
+        self._changed()
+
+    def page_count(self, page_size=QUEUE_PAGE_SIZE):
+        return max(1, -(-len(self._entries) // page_size))
+
+    def render_page(self, page=0, page_size=QUEUE_PAGE_SIZE):
+        """Render one page of the queue as an embed field value, only formatting that page."""
+        key = (page, page_size)
+        if key not in self._page_cache:
+            start = page * page_size
+            lines = []
+            for i, (_, title, duration) in enumerate(islice(self._entries, start, start + page_size), start=start + 1):
+                if len(title) > TITLE_LIMIT:
+                    title = title[:TITLE_LIMIT - 1] + "…"
+                lines.append(f"{i}. {title} `{timedelta(seconds=int(duration))}`" if duration else f"{i}. {title}")
+            self._page_cache[key] = "\n".join(lines)[:FIELD_LIMIT] or "No songs in queue."
+        return self._page_cache[key]
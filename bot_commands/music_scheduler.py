@@ -0,0 +1,111 @@
+import logging
+
+# Every playing guild gets its progress bar refreshed once per interval
+PROGRESS_INTERVAL = 10.0
+# The interval is split into this many ticks, each refreshing only the guilds in its slot
+PROGRESS_WHEEL_SLOTS = 20
+# Under rate-limit pressure the interval doubles per level, up to PROGRESS_INTERVAL * 2**MAX
+MAX_PRESSURE = 3
+# An edit slower than this means discord.py is sleeping on a rate limit
+SLOW_EDIT_SECONDS = 1.0
+# Full turns without slow edits before the interval is narrowed again
+CALM_TURNS_TO_RELAX = 3
+
+class ProgressScheduler:
+    """Timing wheel spreading progress-bar refreshes evenly over the refresh interval.
+
+    A guild sits in a fixed slot derived from its ID, and one slot is visited per tick.
+    Every guild is refreshed once per turn of the wheel, and each tick only handles a
+    1/PROGRESS_WHEEL_SLOTS share of them instead of all guilds landing in one burst.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL, slots=PROGRESS_WHEEL_SLOTS):
+        self.interval = interval
+        self.slots = [set() for _ in range(slots)]
+        self.cursor = 0
+        self.pressure = 0
+        self._slow_this_turn = False
+        self._calm_turns = 0
+
+        self.ticks = 0
+        self.edits = 0
+        self.skipped = 0
+        self.slow_edits = 0
+        self.last_tick = 0.0
+        self.max_tick = 0.0
+        self.avg_tick = 0.0
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def _slot(self, guild_id):
+        # The timestamp part of the snowflake is spread far better than its low bits
+        return (guild_id >> 22) % len(self.slots)
+
+    def add(self, guild_id):
+        self.slots[self._slot(guild_id)].add(guild_id)
+
+    def discard(self, guild_id):
+        self.slots[self._slot(guild_id)].discard(guild_id)
+
+    @property
+    def period(self):
+        return self.interval * 2 ** self.pressure
+
+    @property
+    def tick_interval(self):
+        return self.period / len(self.slots)
+
+    def advance(self):
+        """Return the guilds due on this tick and move the wheel forward."""
+        due = list(self.slots[self.cursor])
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        return due
+
+    def record_tick(self, duration, edits, skipped, slow):
+        """Record one tick. Returns True when the tick interval changed."""
+        self.ticks += 1
+        self.edits += edits
+        self.skipped += skipped
+        self.slow_edits += slow
+        self.last_tick = duration
+        self.max_tick = max(self.max_tick, duration)
+        self.avg_tick += (duration - self.avg_tick) * 0.05
+
+        # A tick that overruns its own interval counts as pressure as well
+        if slow or duration > self.tick_interval:
+            self._slow_this_turn = True
+
+        if self.cursor != 0:
+            return False
+
+        # A full turn just ended
+        if self._slow_this_turn:
+            self._slow_this_turn = False
+            self._calm_turns = 0
+            if self.pressure < MAX_PRESSURE:
+                self.pressure += 1
+                logging.warning(f"Progress refreshes under pressure, period widened to {self.period:.0f}s")
+                return True
+        elif self.pressure:
+            self._calm_turns += 1
+            if self._calm_turns >= CALM_TURNS_TO_RELAX:
+                self._calm_turns = 0
+                self.pressure -= 1
+                logging.info(f"Progress refresh pressure eased, period narrowed to {self.period:.0f}s")
+                return True
+        return False
+
+    def stats(self):
+        return {
+            'guilds': len(self),
+            'period': self.period,
+            'pressure': self.pressure,
+            'ticks': self.ticks,
+            'edits': self.edits,
+            'skipped': self.skipped,
+            'slow_edits': self.slow_edits,
+            'last_tick_ms': self.last_tick * 1000,
+            'avg_tick_ms': self.avg_tick * 1000,
+            'max_tick_ms': self.max_tick * 1000,
+        }
@@ -0,0 +1,210 @@
+import asyncio
+import html
+import logging
+import random
+import re
+import aiohttp
+from bot_commands.cluster_ipc import cluster_path
+from bot_commands.music_cache import TTLCache
+
+SPOTIFY_MAX_RETRIES = 5
+# Full jitter exponential backoff: attempt n sleeps a random time up to min(MAX, BASE * 2**n)
+SPOTIFY_BACKOFF_BASE = 0.5
+SPOTIFY_BACKOFF_MAX = 8.0
+SPOTIFY_TIMEOUT = 10
+SPOTIFY_MAX_CONNECTIONS = 20
+# The <head> of a Spotify page is well below this, stop reading if it never shows up
+HEAD_READ_LIMIT = 512 * 1024
+USER_AGENT_POOL_SIZE = 20
+
+# Spotify track ID -> YouTube video ID. Both IDs are stable, so entries live for a long time
+TRACK_MAP_FILE = 'spotify_youtube_map.json'
+TRACK_MAP_MAX_ENTRIES = 50000
+TRACK_MAP_TTL = 30 * 24 * 60 * 60
+
+# Used when fake_useragent is not installed or cannot load its data
+FALLBACK_USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0',
+]
+
+META_TAG_RE = re.compile(r'<meta\b[^>]*>', re.IGNORECASE)
+META_ATTR_RE = re.compile(r'([\w:-]+)\s*=\s*"([^"]*)"')
+TRACK_ID_RE = re.compile(r'open\.spotify\.com/(?:intl-\w+/)?track/([a-zA-Z0-9]+)')
+COLLECTION_RE = re.compile(r'open\.spotify\.com/(?:intl-\w+/)?(album|playlist)/([a-zA-Z0-9]+)')
+EMBED_TRACK_URI_RE = re.compile(r'spotify:track:([a-zA-Z0-9]+)')
+
+class SpotifyScrapeError(Exception):
+    """Raised when track information cannot be scraped from a Spotify page."""
+
+class _RetryableStatus(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"Status code {status}")
+        self.retry_after = retry_after
+
+def spotify_track_id(url: str):
+    match = TRACK_ID_RE.search(url)
+    return match.group(1) if match else None
+
+def spotify_collection(url: str):
+    """Return (kind, id) for album and playlist URLs, None otherwise."""
+    match = COLLECTION_RE.search(url)
+    return (match.group(1), match.group(2)) if match else None
+
+def parse_meta_tags(head: str):
+    """Map every meta property/name in head to the list of its content values."""
+    meta = {}
+    for tag in META_TAG_RE.findall(head):
+        attrs = dict(META_ATTR_RE.findall(tag))
+        key = attrs.get('property') or attrs.get('name')
+        if key and 'content' in attrs:
+            meta.setdefault(key, []).append(html.unescape(attrs['content']))
+    return meta
+
+class SpotifyScraper:
+    """Scrapes Spotify pages over a shared aiohttp connection pool."""
+
+    def __init__(self):
+        self._session = None
+        self._user_agents = None
+        self.track_map = TTLCache(max_entries=TRACK_MAP_MAX_ENTRIES, default_ttl=TRACK_MAP_TTL, persist_path=cluster_path(TRACK_MAP_FILE))
+        self.requests = 0
+        self.retries = 0
+        self.full_parses = 0
+
+    def get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=SPOTIFY_MAX_CONNECTIONS, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=SPOTIFY_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def user_agent(self):
+        if self._user_agents is None:
+            try:
+                from fake_useragent import UserAgent
+                ua = UserAgent()
+                self._user_agents = list({ua.random for _ in range(USER_AGENT_POOL_SIZE)})
+            except Exception as e:
+                logging.warning(f"Could not load fake_useragent, using built-in user agents: {e}")
+                self._user_agents = list(FALLBACK_USER_AGENTS)
+        return random.choice(self._user_agents)
+
+    async def fetch(self, url: str, head_only=True):
+        """Fetch a Spotify page, retrying with jittered exponential backoff.
+
+        With head_only the response is only read up to the closing </head> tag.
+        """
+        session = self.get_session()
+        for attempt in range(SPOTIFY_MAX_RETRIES):
+            self.requests += 1
+            try:
+                headers = {"User-Agent": self.user_agent(), "Accept-Language": "en"}
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 429 or response.status >= 500:
+                        raise _RetryableStatus(response.status, response.headers.get('Retry-After'))
+                    if response.status != 200:
+                        raise SpotifyScrapeError(f"Status code {response.status}")
+                    if head_only:
+                        return await self._read_head(response)
+                    return await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus) as e:
+                if attempt == SPOTIFY_MAX_RETRIES - 1:
+                    raise SpotifyScrapeError(f"Failed to fetch Spotify page after {SPOTIFY_MAX_RETRIES} attempts: {e}") from e
+
+                delay = random.uniform(0, min(SPOTIFY_BACKOFF_MAX, SPOTIFY_BACKOFF_BASE * 2 ** attempt))
+                if isinstance(e, _RetryableStatus) and e.retry_after and e.retry_after.isdigit():
+                    delay = max(delay, int(e.retry_after))
+                self.retries += 1
+                logging.warning(f"Spotify request failed: {e}. Retrying in {delay:.1f}s ({attempt + 1}/{SPOTIFY_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+
+    async def _read_head(self, response):
+        # get_encoding() refuses to guess before the whole body was read
+        encoding = response.charset or 'utf-8'
+        data = bytearray()
+        async for chunk in response.content.iter_chunked(16 * 1024):
+            data += chunk
+            end = data.find(b'</head>')
+            if end != -1:
+                return data[:end].decode(encoding, errors='replace')
+            if len(data) > HEAD_READ_LIMIT:
+                break
+        return data.decode(encoding, errors='replace')
+
+    async def fetch_track_info(self, url: str):
+        """Return the "title artist" search string for a Spotify track URL."""
+        meta = parse_meta_tags(await self.fetch(url))
+        track_title = meta.get('og:title', [None])[0]
+        description = meta.get('og:description', [None])[0]
+        track_artist = description.split(' · ')[0] if description else None
+        if not track_artist:
+            track_artist = (meta.get('music:musician_description') or meta.get('twitter:audio:artist_name') or [None])[0]
+
+        if not track_title or not track_artist:
+            track_title, track_artist = await self._parse_full_page(url, track_title, track_artist)
+
+        return f"{track_title} {track_artist}"
+
+    async def fetch_collection_tracks(self, url: str):
+        """Return the track URLs of a Spotify album or playlist, in order."""
+        kind, collection_id = spotify_collection(url)
+        # Album and playlist pages list their tracks as music:song meta tags in the head
+        track_urls = parse_meta_tags(await self.fetch(url)).get('music:song', [])
+
+        if not track_urls:
+            # The embed player page carries the track list as JSON
+            body = await self.fetch(f"https://open.spotify.com/embed/{kind}/{collection_id}", head_only=False)
+            track_urls = [f"https://open.spotify.com/track/{track_id}" for track_id in EMBED_TRACK_URI_RE.findall(body)]
+
+        if not track_urls:
+            raise SpotifyScrapeError(f"No tracks found in Spotify {kind}")
+        return list(dict.fromkeys(track_urls))
+
+    async def _parse_full_page(self, url, track_title, track_artist):
+        # Slow path for pages whose head lacks the usual meta tags
+        from bs4 import BeautifulSoup
+
+        self.full_parses += 1
+        soup = BeautifulSoup(await self.fetch(url, head_only=False), 'html.parser')
+        if not track_title:
+            track_title = soup.title.string if soup.title else None
+        if not track_artist:
+            possible_artist_selectors = [
+                'meta[property="music:musician"]',
+                'meta[name="twitter:audio:artist_name"]',
+                'meta[property="og:audio:artist"]',
+                'div.creator-name',
+                'span[data-testid="creator-link"]',
+                'a[href*="/artist/"]'
+            ]
+            for selector in possible_artist_selectors:
+                artist_tag = soup.select_one(selector)
+                if artist_tag:
+                    track_artist = artist_tag.get('content') or artist_tag.text.strip()
+                    if track_artist:
+                        break
+        if not track_title or not track_artist:
+            raise SpotifyScrapeError("Title or artist not found")
+        return track_title, track_artist
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'full_parses': self.full_parses,
+            'mapped_tracks': len(self.track_map),
+            'map_hits': self.track_map.hits,
+            'map_misses': self.track_map.misses,
+        }
+
+# Shared by every guild, and kept across reloads of the music extension
+spotify_scraper = SpotifyScraper()
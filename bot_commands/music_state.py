@@ -0,0 +1,127 @@
+import sys
+import time
+from collections import Counter
+from bot_commands.music_filters import FilterSettings
+from bot_commands.music_metrics import PlaybackMetrics, playback_totals
+from bot_commands.music_queue import MusicQueue
+
+# Guilds with nothing playing and no music commands for this long have their state released
+GUILD_STATE_IDLE_TIMEOUT = 30 * 60
+
+class GuildState:
+    """Music state of a single guild."""
+
+    __slots__ = (
+        'is_playing',
+        'is_paused',
+        'current_channel',
+        'queue',
+        'current_song',
+        'current_entry',  # Queue entry of the current song, replayed after a voice recovery
+        'embed_message',
+        'embed_channel',  # Where the controls embed is sent if it has to be re-sent
+        'embed_payload',  # Last rendered embed, used to skip identical edits
+        'render_task',
+        'render_pending',
+        'render_resend',
+        'song_start_time',
+        'song_duration',
+        'paused_time',
+        'elapsed_paused_time',
+        'prefetched',  # Queue entry URL -> task resolving its stream URL
+        'ingests',  # Progress of every URL list still being queued, one per !play or !addlist
+        'player',  # GaplessSource attached to the voice client
+        'preroll_task',
+        'preroll_entry',  # Queue entry being opened ahead of time
+        'filters',  # FilterSettings applied to PCM playback
+        'source_paths',  # Sources opened per playback path, 'opus' (passthrough), 'pcm' or 'disk'
+        'metrics',  # PlaybackMetrics of this guild's audio path
+        'play_ctx',  # Context playback was last started from, used to resume after a voice recovery
+        'recovery_task',
+        'disconnect_check',  # Task telling a server-side disconnect from discord.py reconnecting by itself
+        'resume_position',  # Seconds to seek into the next song that is opened
+        'leaving',  # Set before disconnecting on purpose, so it is not taken for a lost connection
+        'last_active',
+    )
+
+    def __init__(self):
+        self.is_playing = False
+        self.is_paused = False
+        self.current_channel = None
+        self.queue = MusicQueue()
+        self.current_song = None
+        self.current_entry = None
+        self.embed_message = None
+        self.embed_channel = None
+        self.embed_payload = None
+        self.render_task = None
+        self.render_pending = False
+        self.render_resend = False
+        self.song_start_time = None
+        self.song_duration = 0
+        self.paused_time = None
+        self.elapsed_paused_time = 0
+        self.prefetched = {}
+        self.ingests = []
+        self.player = None
+        self.preroll_task = None
+        self.preroll_entry = None
+        self.filters = FilterSettings()
+        self.source_paths = Counter()
+        self.metrics = PlaybackMetrics(playback_totals)
+        self.play_ctx = None
+        self.recovery_task = None
+        self.disconnect_check = None
+        self.resume_position = 0
+        self.leaving = False
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def cancel_ingests(self):
+        """Stop every URL list being queued, their lookups still running are cancelled."""
+        for progress in self.ingests:
+            progress['cancelled'] = True
+            for task in progress['tasks']:
+                task.cancel()
+        self.ingests.clear()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_active
+
+    def release(self):
+        """Cancel background work and drop references so the state can be garbage collected."""
+        if self.render_task:
+            self.render_task.cancel()
+        if self.preroll_task:
+            self.preroll_task.cancel()
+        if self.recovery_task:
+            self.recovery_task.cancel()
+        if self.disconnect_check:
+            self.disconnect_check.cancel()
+        for task in self.prefetched.values():
+            task.cancel()
+        self.prefetched.clear()
+        self.queue.clear()
+        self.cancel_ingests()
+        self.embed_message = None
+        self.embed_channel = None
+        self.embed_payload = None
+        self.current_channel = None
+        self.render_task = None
+        self.preroll_task = None
+        self.preroll_entry = None
+        self.player = None
+        self.recovery_task = None
+        self.disconnect_check = None
+        self.play_ctx = None
+
+    def memory_size(self):
+        """Approximate bytes held by this state, including queued entries."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.prefetched)
+        for url, title, duration in self.queue:
+            size += sys.getsizeof((url, title, duration)) + sys.getsizeof(url) + sys.getsizeof(title)
+        if self.embed_payload:
+            size += sys.getsizeof(self.embed_payload)
+        return size
@@ -18,7 +18,9 @@ class PaginatedHelp(commands.Cog):
             ['serverinfo', 'mute', 'unmute'],
             ['kick', 'ban', 'unban'],
             ['clear', 'cc', 'rc', 'mc'],
-            ['play', 'skip', 'stop','addqueue','pause','resume']
+            ['play', 'skip', 'stop','addqueue','pause','resume'],
+            ['queue', 'remove', 'move', 'shuffle'],
+            ['volume', 'normalize', 'eq']
         ]
 
         for layout in page_layouts:
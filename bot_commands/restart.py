@@ -4,6 +4,7 @@ import logging
 import os
 import sys
 import asyncio
+from bot_commands.cluster_ipc import cluster_client
 
 OWNER_ID = 957578507649683457  # Updated owner ID
 
@@ -11,6 +12,14 @@ class Restart(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        # Lets `!rs <target> cluster` in any cluster process restart the target here too
+        cluster_client.handlers['restart'] = self.restart_from_cluster
+
+    async def cog_unload(self):
+        if cluster_client.handlers.get('restart') == self.restart_from_cluster:
+            del cluster_client.handlers['restart']
+
     async def cog_check(self, ctx):
         if ctx.author.id != OWNER_ID:
             await ctx.send("You do not have permission to use this command.")
@@ -18,21 +27,26 @@ class Restart(commands.Cog):
         return True
 
     @commands.command(name='rs')
-    async def restart(self, ctx, target: str):
-        """Restart a bot extension, all extensions except main, or the entire bot"""
+    async def restart(self, ctx, target: str, scope: str = None):
+        """Restart a bot extension, all extensions except main, or the entire bot. Add 'cluster' to do it in every cluster process"""
         if ctx.author.id != OWNER_ID:
             await ctx.send("You do not have permission to use this command.")
             return
 
+        if scope == "cluster":
+            await ctx.send(f"Restarting {target} in every cluster...")
+            results = await cluster_client.request('restart', target=target)
+            await ctx.send("\n".join(
+                f"Cluster {result['cluster']}: {result.get('result') or result.get('error')}"
+                for result in sorted(results, key=lambda result: result['cluster'])
+            ))
+            return
+
         try:
             if target.lower() in ["bot", "main"]:
                 await ctx.send("Restarting the bot...")
                 logging.info("Restarting the bot...")
-                await self.bot.close()
-                # Change the working directory to the script's location
-                os.chdir(os.path.dirname(os.path.abspath(sys.argv[0])))
-                # Restart the bot process with the correct command
-                os.execv(sys.executable, [sys.executable] + sys.argv)
+                await self.restart_process()
             elif target.lower() == "all":
                 await ctx.send("Restarting all extensions except main...")
                 logging.info("Restarting all extensions except main...")
@@ -47,25 +61,30 @@ class Restart(commands.Cog):
             await ctx.send(f"Failed to restart the {target} extension: {e}")
             logging.error(f"Failed to restart the {target} extension: {e}")
 
+    async def restart_process(self):
+        await self.bot.close()
+        # Change the working directory to the script's location
+        os.chdir(os.path.dirname(os.path.abspath(sys.argv[0])))
+        # Restart the bot process with the correct command, cluster.py's environment is kept
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    async def restart_from_cluster(self, target):
+        logging.info(f"Restarting {target} for a cluster-wide restart")
+        if target.lower() in ["bot", "main"]:
+            # Answer first, the process is replaced once the bot has closed
+            asyncio.get_running_loop().call_later(1.0, lambda: asyncio.create_task(self.restart_process()))
+            return "Restarting the bot..."
+        if target.lower() == "all":
+            await self.restart_all_extensions_except_main(None)
+            return "All extensions restarted successfully."
+        await self.bot.unload_extension(f'bot_commands.{target}')
+        await self.bot.load_extension(f'bot_commands.{target}')
+        return f"Successfully restarted the {target} extension."
+
     async def restart_all_extensions_except_main(self, ctx):
         """Restart all extensions except the main bot script"""
-        extensions = [
-            'bot_commands.paginated_help',
-            'bot_commands.ping',
-            'bot_commands.userinfo',
-            'bot_commands.serverinfo',
-            'bot_commands.mute',
-            'bot_commands.unmute',
-            'bot_commands.kick',
-            'bot_commands.ban',
-            'bot_commands.unban',
-            'bot_commands.clear',
-            'bot_commands.roll',  
-            'bot_commands.clone_category',
-            'bot_commands.ulearn_command',
-            'bot_commands.restart',
-            'bot_commands.music'
-        ]
+        # Whatever main.py loaded at startup, so this list can't drift from it
+        extensions = list(self.bot.extensions)
         for extension in extensions:
             try:
                 await self.bot.unload_extension(extension)
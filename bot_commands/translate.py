@@ -1,8 +1,6 @@
 import discord
 from discord.ext import commands
 from discord import ui, Interaction
-import opencc
-from googletrans import Translator
 
 # In-memory dictionary to store user language settings
 user_language_settings = {}
@@ -38,9 +36,22 @@ class TranslateSettings(commands.Cog):
 class Translate(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.translator = Translator()
-        self.cc_t2s = opencc.OpenCC('t2s')
-        self.cc_s2t = opencc.OpenCC('s2t')
+        # googletrans and opencc are slow to import, so they are loaded on the first translation
+        self.translator = None
+        self.converters = {}
+
+    def get_translator(self):
+        if self.translator is None:
+            from googletrans import Translator
+            self.translator = Translator()
+        return self.translator
+
+    def get_converter(self, config):
+        converter = self.converters.get(config)
+        if converter is None:
+            import opencc
+            converter = self.converters[config] = opencc.OpenCC(config)
+        return converter
 
     @commands.command(name='trans')
     async def translate_text(self, ctx, *, text: str):
@@ -48,11 +59,11 @@ class Translate(commands.Cog):
         target_language = user_language_settings.get(user_id, 'en')
 
         if target_language == 'zh-CN':
-            translated_text = self.cc_t2s.convert(text)
+            translated_text = self.get_converter('t2s').convert(text)
         elif target_language == 'zh-TW':
-            translated_text = self.cc_s2t.convert(text)
+            translated_text = self.get_converter('s2t').convert(text)
         else:
-            translated_text = self.translator.translate(text, dest=target_language).text
+            translated_text = self.get_translator().translate(text, dest=target_language).text
 
         await ctx.send(translated_text)
 
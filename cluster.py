@@ -0,0 +1,220 @@
+"""Cluster supervisor: runs the bot as several processes, each owning a range of shards.
+
+    python cluster.py --processes 4 [--shards 16]
+
+Without --shards the shard count Discord recommends is used. Every worker is main.py
+started with SHARD_IDS/SHARD_COUNT for its range and CLUSTER_* for the IPC channel to
+this supervisor, which relays queries between the workers (see bot_commands/cluster_ipc.py).
+Workers are started one after another, each once the previous one is ready, since
+Discord only lets a bot identify a shard every few seconds. A worker that exits is started again.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+import aiohttp
+from dotenv import load_dotenv
+
+DISCORD_API_BASE = 'https://discord.com/api/v10'
+IPC_HOST = '127.0.0.1'
+IPC_PORT = 47700
+# Longest wait for a worker to report ready before the next one is started anyway
+WORKER_READY_TIMEOUT = 120.0
+WORKER_RESTART_DELAY = 5.0
+HELLO_TIMEOUT = 5.0
+
+def shard_ranges(shard_count, processes):
+    """Split shards 0..shard_count-1 into contiguous ranges, one per process, as even as possible."""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        size = base + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+async def recommended_shards(token, api_base):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{api_base}/gateway/bot", headers={'Authorization': f"Bot {token}"}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data['shards']
+
+class Worker:
+    def __init__(self, cluster_id, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.writer = None
+        self.ready = asyncio.Event()
+        self.restarts = 0
+        self.pending = {}  # request ID -> future of the worker's response
+
+    def send(self, op, **fields):
+        if self.writer is None or self.writer.is_closing():
+            return False
+        self.writer.write(json.dumps({'op': op, **fields}).encode() + b'\n')
+        return True
+
+class Supervisor:
+    def __init__(self, shard_count, processes, ipc_port):
+        self.shard_count = shard_count
+        self.ipc_port = ipc_port
+        self.secret = secrets.token_hex(16)
+        self.workers = [Worker(index, shards, shard_count) for index, shards in enumerate(shard_ranges(shard_count, processes))]
+        self._next_request = 0
+        self._stopping = False
+
+    async def run(self):
+        server = await asyncio.start_server(self.handle_worker, IPC_HOST, self.ipc_port, limit=1024 * 1024)
+        logging.info(f"Supervising {len(self.workers)} clusters over {self.shard_count} shards")
+        async with server:
+            for worker in self.workers:
+                await self.spawn(worker)
+                ready = asyncio.create_task(worker.ready.wait())
+                exited = asyncio.create_task(worker.process.wait())
+                await asyncio.wait((ready, exited), timeout=WORKER_READY_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+                ready.cancel()
+                exited.cancel()
+                if not worker.ready.is_set():
+                    # watch() restarts it if it exited, the remaining clusters need not wait for that
+                    logging.warning(f"Cluster {worker.cluster_id} did not become ready, starting the next one")
+            await asyncio.gather(*(self.watch(worker) for worker in self.workers))
+
+    async def spawn(self, worker):
+        env = {
+            **os.environ,
+            'SHARD_IDS': ','.join(map(str, worker.shard_ids)),
+            'SHARD_COUNT': str(worker.shard_count),
+            'CLUSTER_ID': str(worker.cluster_id),
+            'CLUSTER_IPC': f"{IPC_HOST}:{self.ipc_port}",
+            'CLUSTER_SECRET': self.secret,
+        }
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        worker.ready.clear()
+        worker.process = await asyncio.create_subprocess_exec(sys.executable, main, env=env)
+        logging.info(f"Started cluster {worker.cluster_id} (shards {worker.shard_ids}) with PID {worker.process.pid}")
+
+    async def watch(self, worker):
+        while not self._stopping:
+            code = await worker.process.wait()
+            if self._stopping:
+                return
+            logging.error(f"Cluster {worker.cluster_id} exited with code {code}, restarting it in {WORKER_RESTART_DELAY:.0f}s")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            worker.restarts += 1
+            await self.spawn(worker)
+
+    async def stop(self):
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process and worker.process.returncode is None:
+                worker.process.terminate()
+        await asyncio.gather(*(worker.process.wait() for worker in self.workers if worker.process))
+
+    async def handle_worker(self, reader, writer):
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT))
+        except (asyncio.TimeoutError, ValueError):
+            writer.close()
+            return
+        if hello.get('op') != 'hello' or hello.get('secret') != self.secret or not 0 <= hello.get('cluster', -1) < len(self.workers):
+            logging.warning("Refused a cluster IPC connection without the right secret")
+            writer.close()
+            return
+
+        worker = self.workers[hello['cluster']]
+        worker.writer = writer
+        try:
+            while line := await reader.readline():
+                self.dispatch(worker, json.loads(line))
+        except (ConnectionError, ValueError) as e:
+            logging.error(f"Cluster {worker.cluster_id} IPC connection failed: {e}")
+        finally:
+            if worker.writer is writer:
+                worker.writer = None
+            for future in worker.pending.values():
+                if not future.done():
+                    future.set_result({'cluster': worker.cluster_id, 'error': "Disconnected"})
+            worker.pending.clear()
+            writer.close()
+
+    def dispatch(self, worker, message):
+        op = message['op']
+        if op == 'ready':
+            logging.info(f"Cluster {worker.cluster_id} is ready with {message['guilds']} guilds on shards {message['shards']}")
+            worker.ready.set()
+        elif op == 'query':
+            asyncio.create_task(self.fan_out(worker, message))
+        elif op == 'response':
+            future = worker.pending.pop(message['id'], None)
+            if future and not future.done():
+                future.set_result(message['result'])
+
+    async def ask(self, worker, name, fields, timeout):
+        self._next_request += 1
+        request_id = self._next_request
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        if not worker.send('request', id=request_id, name=name, fields=fields):
+            worker.pending.pop(request_id, None)
+            return {'cluster': worker.cluster_id, 'error': "Not connected"}
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return {'cluster': worker.cluster_id, 'error': "Timed out"}
+        finally:
+            worker.pending.pop(request_id, None)
+
+    async def fan_out(self, origin, message):
+        results = await asyncio.gather(
+            *(self.ask(worker, message['name'], message.get('fields', {}), message.get('timeout', 10.0)) for worker in self.workers)
+        )
+        origin.send('results', id=message['id'], results=results)
+
+async def main_async(args):
+    token = os.getenv('DISCORD_BOT_TOKEN')
+    shard_count = args.shards
+    if shard_count is None:
+        if not token:
+            raise ValueError("No token found in the environment variables. Ensure the .env file is set correctly.")
+        shard_count = await recommended_shards(token, os.getenv('DISCORD_API_BASE', DISCORD_API_BASE))
+
+    supervisor = Supervisor(shard_count, args.processes, args.ipc_port)
+    loop = asyncio.get_running_loop()
+    run_task = asyncio.create_task(supervisor.run())
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, run_task.cancel)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await run_task
+    except asyncio.CancelledError:
+        logging.info("Stopping clusters")
+    finally:
+        await supervisor.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, help="Total shard count, Discord's recommendation by default")
+    parser.add_argument('--ipc-port', type=int, default=IPC_PORT)
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:[supervisor] %(message)s')
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Logging for the bot process.
+
+Records are put on a queue by whichever thread logs them and written out by a
+QueueListener thread, so the event loop never waits on the console or bot.log.
+Configured from the environment (.env):
+
+    LOG_LEVEL=INFO
+    LOG_LEVELS=discord=INFO,discord.http=WARNING,bot_commands.music_scheduler=WARNING
+
+The cogs log through the root logger, so bot_commands.<module> entries apply to the
+records logged from that module. They can make a module quieter than LOG_LEVEL, not louder.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_FILE = 'bot.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_FORMAT = '%(asctime)s %(levelname)s:%(message)s'
+
+DEFAULT_LOG_LEVEL = 'INFO'
+# discord.py logs every gateway event and HTTP request at DEBUG
+DEFAULT_LOGGER_LEVELS = {'discord': 'INFO'}
+# Messages logged many times a minute are only written once per this many, matched by prefix
+LOG_SAMPLE_RATES = {
+    'Updated progress bar in existing embed': 100,
+    'Using cached info for': 20,
+}
+
+class ModuleLevelFilter(logging.Filter):
+    """Per-module levels for records logged through the root logger."""
+
+    def __init__(self, levels):
+        super().__init__()
+        self.levels = levels  # module name -> level
+
+    def filter(self, record):
+        if record.name != 'root':
+            return True
+        level = self.levels.get(record.module)
+        return level is None or record.levelno >= level
+
+class SamplingFilter(logging.Filter):
+    """Passes one in every N records of the high-volume messages in rates."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.seen = dict.fromkeys(rates, 0)
+
+    def filter(self, record):
+        if not isinstance(record.msg, str) or record.levelno > logging.INFO:
+            return True
+        for prefix, rate in self.rates.items():
+            if record.msg.startswith(prefix):
+                self.seen[prefix] += 1
+                if self.seen[prefix] % rate != 1 % rate:
+                    return False
+                record.msg = f"{record.msg} (1 in {rate} logged, {self.seen[prefix]} so far)"
+                return True
+        return True
+
+def parse_levels(value):
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging():
+    """Install the queued logging pipeline on the root logger. Call once, before anything logs."""
+    root_level = os.getenv('LOG_LEVEL', DEFAULT_LOG_LEVEL).upper()
+    levels = {**DEFAULT_LOGGER_LEVELS, **parse_levels(os.getenv('LOG_LEVELS', ''))}
+    # getLevelName() turns an unknown name into the string "Level <name>" instead of failing
+    for name, level in {'LOG_LEVEL': root_level, **levels}.items():
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level} for {name}")
+
+    log_file = LOG_FILE
+    log_format = LOG_FORMAT
+    cluster_id = os.getenv('CLUSTER_ID')
+    if cluster_id is not None:
+        # Processes started by cluster.py can't share one rotating file
+        log_file = f"bot-{cluster_id}.log"
+        log_format = LOG_FORMAT.replace('%(message)s', f'[cluster {cluster_id}] %(message)s')
+
+    formatter = logging.Formatter(log_format)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+    # Consoles that can't show a character print an escape instead of failing the record
+    if hasattr(sys.stderr, 'reconfigure'):
+        sys.stderr.reconfigure(errors='backslashreplace')
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    module_levels = {}
+    for name, level in levels.items():
+        if name.startswith('bot_commands.'):
+            module_levels[name.split('.', 1)[1]] = logging.getLevelName(level)
+        else:
+            logging.getLogger(name).setLevel(level)
+    if module_levels:
+        queue_handler.addFilter(ModuleLevelFilter(module_levels))
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(root_level)
+
+    listener = logging.handlers.QueueListener(records, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    # Writes out whatever is still queued when the bot exits
+    atexit.register(listener.stop)
+    return listener
@@ -1,31 +1,62 @@
+import time
+STARTED = time.perf_counter()
+
 import os
+import asyncio
+import importlib
 import logging
 from dotenv import load_dotenv
 from discord.ext import commands
 import discord
+import yarl
+from logging_setup import setup_logging
+from bot_commands.cluster_ipc import cluster_client
+from bot_commands.member_cache import member_cache_options
+from bot_commands.lag_monitor import lag_monitor
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 
-if not TOKEN:
-    raise ValueError("No token found in the environment variables. Ensure the .env file is set correctly.")
-
 # Define intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True  # Required for member join events
 
-# Create bot instance
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Set by cluster.py, each cluster process owns a range of the shards. Otherwise this
+# process runs every shard, as many as Discord recommends.
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id]
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0)) or None
+
+# Point the bot at tools/fake_gateway.py instead of Discord, for testing the cluster launcher
+if os.getenv('DISCORD_API_BASE'):
+    discord.http.Route.BASE = os.getenv('DISCORD_API_BASE')
+if os.getenv('DISCORD_GATEWAY_URL'):
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(os.getenv('DISCORD_GATEWAY_URL'))
+
+class Bot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Runs once before connecting, unlike on_ready which fires again on every reconnect
+        # The lag monitor starts first so stalls while loading the extensions are caught too
+        lag_monitor.start()
+        await cluster_client.start(self)
+        await load_extensions(self)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, 
-                    format='%(asctime)s %(levelname)s:%(message)s',
-                    handlers=[
-                        logging.FileHandler("bot.log"),
-                        logging.StreamHandler()
-                    ])
+    async def on_ready(self):
+        logging.info(f'Logged in as {self.user}, ready {time.perf_counter() - STARTED:.2f}s after start')
+        cluster_client.post_ready()
+
+    async def on_connect(self):
+        logging.info("Bot connected.")
+
+    async def on_command_error(self, ctx, error):
+        if isinstance(error, commands.CommandNotFound):
+            await ctx.send("Command not found.")
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(f"Missing required argument: {error.param}")
+        else:
+            await ctx.send("An error occurred.")
+            logging.error(f"An error occurred: {error}")
 
 # List of extensions to load
 extensions = [
@@ -44,36 +75,84 @@ extensions = [
     'bot_commands.restart',
     'bot_commands.music',
     'bot_commands.translate',
-    'bot_commands.autorole'
+    'bot_commands.autorole',
+    'bot_commands.cluster',
+    'bot_commands.lag'
 ]
 
-# Function to load extensions
-async def load_extensions():
+def import_extension(extension):
+    """Import an extension's module and everything it imports, returns the seconds it took."""
+    started = time.perf_counter()
+    importlib.import_module(extension)
+    return time.perf_counter() - started
+
+async def load_extension(bot, extension):
+    started = time.perf_counter()
+    try:
+        await bot.load_extension(extension)
+    except Exception as e:
+        logging.error(f"Failed to load extension {extension}: {e}")
+        return None
+    return time.perf_counter() - started
+
+async def load_extensions(bot):
+    started = time.perf_counter()
+    # Imports run in threads, concurrently, so the loop keeps running and they overlap where they wait on disk
+    results = await asyncio.gather(
+        *(asyncio.to_thread(import_extension, extension) for extension in extensions), return_exceptions=True
+    )
+    imported = time.perf_counter()
+
+    import_times = {}
+    for extension, result in zip(extensions, results):
+        if isinstance(result, BaseException):
+            logging.error(f"Failed to import extension {extension}: {result}")
+        else:
+            import_times[extension] = result
+
+    # load_extension runs the extension module once more, cheap now that its imports are cached, then its setup()
+    setup_times = {}
+    for extension in import_times:
+        setup_times[extension] = await load_extension(bot, extension)
+        await asyncio.sleep(0)
+
+    lines = []
     for extension in extensions:
-        try:
-            await bot.load_extension(extension)
-            logging.info(f"Loaded extension {extension}")
-        except Exception as e:
-            logging.error(f"Failed to load extension {extension}: {e}")
-
-@bot.event
-async def on_ready():
-    logging.info(f'Logged in as {bot.user}')
-    await load_extensions()
-
-@bot.event
-async def on_connect():
-    logging.info("Bot connected.")
-
-@bot.event
-async def on_command_error(ctx, error):
-    if isinstance(error, commands.CommandNotFound):
-        await ctx.send("Command not found.")
-    elif isinstance(error, commands.MissingRequiredArgument):
-        await ctx.send(f"Missing required argument: {error.param}")
-    else:
-        await ctx.send("An error occurred.")
-        logging.error(f"An error occurred: {error}")
-
-# Run the bot
-bot.run(TOKEN)
+        if extension not in import_times:
+            status = "import failed"
+        elif setup_times[extension] is None:
+            status = f"import {import_times[extension] * 1000:7.1f} ms  setup failed"
+        else:
+            status = f"import {import_times[extension] * 1000:7.1f} ms  setup {setup_times[extension] * 1000:7.1f} ms"
+        lines.append(f"  {extension:<32} {status}")
+    loaded = sum(1 for setup_time in setup_times.values() if setup_time is not None)
+    lines.append(
+        f"  {loaded}/{len(extensions)} extensions in {time.perf_counter() - started:.2f}s "
+        f"(imports {imported - started:.2f}s, setup {time.perf_counter() - imported:.2f}s)"
+    )
+    logging.info("Startup report:\n" + "\n".join(lines))
+
+def main():
+    if not TOKEN:
+        raise ValueError("No token found in the environment variables. Ensure the .env file is set correctly.")
+
+    # Configure logging, levels and sampling are set in logging_setup.py and .env
+    setup_logging()
+
+    # Create bot instance
+    # Which members are kept in memory and whether guilds are chunked at startup is set by MEMBER_CACHE, see member_cache.py
+    bot = Bot(
+        command_prefix='!', intents=intents, shard_ids=SHARD_IDS or None, shard_count=SHARD_COUNT,
+        **member_cache_options()
+    )
+    # Stalls of the event loop are attributed to the command running in the blocked task, see !lag
+    bot.before_invoke(lag_monitor.note_command)
+
+    # Run the bot
+    # Logging is already set up, discord.py should not add its own handler
+    bot.run(TOKEN, log_handler=None)
+
+# The extractor pools start worker processes with spawn, which import this module again as
+# __mp_main__. Only the process started from the command line may run the bot.
+if __name__ == '__main__':
+    main()
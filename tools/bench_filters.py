@@ -0,0 +1,66 @@
+"""Micro-benchmark of the music filter chain.
+
+Run from the repository root:
+
+    python -m tools.bench_filters [--frames 2000] [--guilds 1 10 50 100]
+
+Every frame is 20 ms of audio, so a player thread has a 20 ms budget per frame.
+Each configuration is timed per frame, then for many guilds each filtering their own
+frame in turn, which is what one core sees with that many guilds playing PCM.
+"""
+import argparse
+import time
+import numpy as np
+from bot_commands.music_filters import FilterChain, FilterSettings
+
+FRAME_MS = 20.0
+SAMPLES_PER_FRAME = 960
+
+CONFIGS = {
+    'volume': FilterSettings(volume=80),
+    'normalize': FilterSettings(normalize=True),
+    'eq': FilterSettings(eq='bass'),
+    'all': FilterSettings(volume=80, normalize=True, eq='vocal'),
+}
+
+def make_frames(count):
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal((count * SAMPLES_PER_FRAME, 2)) * 3000).astype(np.int16)
+    return [chunk.tobytes() for chunk in np.split(audio, count)]
+
+def time_chain(settings, frames):
+    chain = FilterChain(settings)
+    started = time.perf_counter()
+    for frame in frames:
+        chain.process(frame)
+    return (time.perf_counter() - started) / len(frames) * 1000
+
+def time_guilds(settings, frames, guilds):
+    chains = [FilterChain(settings) for _ in range(guilds)]
+    rounds = max(1, len(frames) // guilds)
+    started = time.perf_counter()
+    for frame in frames[:rounds]:
+        for chain in chains:
+            chain.process(frame)
+    return (time.perf_counter() - started) / rounds * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--guilds', type=int, nargs='+', default=[1, 10, 50, 100])
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames)
+    print(f"{'filters':<10} {'per frame':>10} {'guilds/core':>12}")
+    for name, settings in CONFIGS.items():
+        per_frame = time_chain(settings, frames)
+        print(f"{name:<10} {per_frame * 1000:>8.1f}us {int(FRAME_MS / per_frame):>12}")
+
+    print()
+    print(f"{'filters':<10} " + " ".join(f"{f'{guilds} guilds':>11}" for guilds in args.guilds) + "   (ms per 20 ms tick)")
+    for name, settings in CONFIGS.items():
+        results = [time_guilds(settings, frames, guilds) for guilds in args.guilds]
+        print(f"{name:<10} " + " ".join(f"{result:>9.2f}ms" for result in results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Local stand-in for the Discord gateway and the few REST routes the bot needs to log in.
+
+Run from the repository root:
+
+    python -m tools.fake_gateway [--port 8900] [--guilds 2000] [--shards 4]
+
+then start the bot or cluster.py against it:
+
+    DISCORD_BOT_TOKEN=fake DISCORD_API_BASE=http://127.0.0.1:8900/api/v10 \\
+    DISCORD_GATEWAY_URL=ws://127.0.0.1:8900/gateway python cluster.py --processes 2
+
+Every identify is checked against Discord's shard formula, (guild_id >> 22) % shard_count,
+and answered with the guilds that shard owns. The supervisor's shard assignment is checked
+by the report printed every few seconds: shards identified more than once or not at all,
+disagreement on the shard count, and guilds per shard. Nothing else is emulated,
+commands sent to the bot go nowhere.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from aiohttp import web, WSMsgType
+
+BOT_ID = 100000000000000000
+APPLICATION_ID = BOT_ID
+# Gateway opcodes
+DISPATCH, HEARTBEAT, IDENTIFY, RESUME, HELLO, HEARTBEAT_ACK = 0, 1, 2, 6, 10, 11
+HEARTBEAT_INTERVAL_MS = 41250
+
+BOT_USER = {'id': str(BOT_ID), 'username': 'fake-bot', 'discriminator': '0', 'global_name': None, 'avatar': None, 'bot': True}
+
+def json_response(data, status=200):
+    # discord.py only parses bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode(), status=status, content_type='application/json')
+
+def guild_payload(guild_id):
+    return {
+        'id': str(guild_id),
+        'name': f"Guild {guild_id}",
+        'icon': None,
+        'owner_id': str(BOT_ID),
+        'afk_timeout': 300,
+        'verification_level': 0,
+        'default_message_notifications': 0,
+        'explicit_content_filter': 0,
+        'mfa_level': 0,
+        'nsfw_level': 0,
+        'premium_tier': 0,
+        'preferred_locale': 'en-US',
+        'features': [],
+        'roles': [{
+            'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+            'hoist': False, 'managed': False, 'mentionable': False, 'flags': 0,
+        }],
+        'emojis': [],
+        'stickers': [],
+        'channels': [],
+        'threads': [],
+        'voice_states': [],
+        'presences': [],
+        'stage_instances': [],
+        'guild_scheduled_events': [],
+        # Only the bot is a member, so the guild counts as fully chunked and no member requests follow
+        'members': [{'user': BOT_USER, 'roles': [], 'joined_at': '2020-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}],
+        'member_count': 1,
+        'large': False,
+        'unavailable': False,
+    }
+
+class FakeGateway:
+    def __init__(self, host, port, guild_count, shards):
+        self.host = host
+        self.port = port
+        self.shards = shards
+        # Snowflake-like IDs spread over time, like real guilds
+        self.guild_ids = [(1_000_000_000 + index * 7919) << 22 for index in range(guild_count)]
+        self.identifies = defaultdict(list)  # shard ID -> [(peer, shard count, time)]
+        self.sessions = 0
+
+    @property
+    def ws_url(self):
+        return f"ws://{self.host}:{self.port}/gateway"
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', self.users_me)
+        app.router.add_get('/api/v10/oauth2/applications/@me', self.application)
+        app.router.add_get('/api/v10/gateway/bot', self.gateway_bot)
+        app.router.add_get('/api/v10/gateway', self.gateway)
+        app.router.add_get('/gateway', self.websocket)
+        app.router.add_route('*', '/{tail:.*}', self.unknown)
+        return app
+
+    async def users_me(self, request):
+        return json_response({**BOT_USER, 'flags': 0, 'verified': True, 'mfa_enabled': False})
+
+    async def application(self, request):
+        return json_response({
+            'id': str(APPLICATION_ID), 'name': 'fake-bot', 'icon': None, 'description': '', 'bot_public': True,
+            'bot_require_code_grant': False, 'owner': BOT_USER, 'team': None, 'verify_key': '', 'flags': 0,
+        })
+
+    async def gateway_bot(self, request):
+        return json_response({
+            'url': self.ws_url, 'shards': self.shards,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1},
+        })
+
+    async def gateway(self, request):
+        return json_response({'url': self.ws_url})
+
+    async def unknown(self, request):
+        logging.warning(f"Unhandled route {request.method} {request.path}")
+        return json_response({'message': 'Unknown route', 'code': 0}, status=404)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sequence = 0
+
+        async def dispatch(event, data):
+            nonlocal sequence
+            sequence += 1
+            await ws.send_str(json.dumps({'op': DISPATCH, 't': event, 's': sequence, 'd': data}))
+
+        await ws.send_str(json.dumps({'op': HELLO, 'd': {'heartbeat_interval': HEARTBEAT_INTERVAL_MS}}))
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data)
+            op = payload['op']
+            if op == HEARTBEAT:
+                await ws.send_str(json.dumps({'op': HEARTBEAT_ACK}))
+            elif op == IDENTIFY:
+                shard_id, shard_count = payload['d'].get('shard', [0, 1])
+                self.identifies[shard_id].append((request.remote, shard_count, time.monotonic()))
+                self.sessions += 1
+                guilds = [guild_id for guild_id in self.guild_ids if (guild_id >> 22) % shard_count == shard_id]
+                logging.info(f"Shard {shard_id}/{shard_count} identified, sending {len(guilds)} guilds")
+                await dispatch('READY', {
+                    'v': 10, 'user': BOT_USER, 'session_id': f"session-{self.sessions}", 'resume_gateway_url': self.ws_url,
+                    'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guilds],
+                    'shard': [shard_id, shard_count], 'application': {'id': str(APPLICATION_ID), 'flags': 0},
+                    'private_channels': [], 'relationships': [],
+                })
+                for guild_id in guilds:
+                    await dispatch('GUILD_CREATE', guild_payload(guild_id))
+            elif op == RESUME:
+                await dispatch('RESUMED', {})
+        return ws
+
+    def report(self):
+        lines = [f"{self.sessions} identifies on {len(self.identifies)} shards"]
+        counts = {count for identifies in self.identifies.values() for _, count, _ in identifies}
+        if len(counts) > 1:
+            lines.append(f"  Shards disagree on the shard count: {sorted(counts)}")
+        shard_count = max(counts, default=0)
+        missing = [shard_id for shard_id in range(shard_count) if shard_id not in self.identifies]
+        repeated = {shard_id: len(identifies) for shard_id, identifies in self.identifies.items() if len(identifies) > 1}
+        if missing:
+            lines.append(f"  Never identified: {missing}")
+        if repeated:
+            lines.append(f"  Identified more than once: {repeated}")
+        identify_times = sorted(identified for identifies in self.identifies.values() for _, _, identified in identifies)
+        gaps = [later - earlier for earlier, later in zip(identify_times, identify_times[1:])]
+        if gaps:
+            lines.append(f"  Shortest gap between identifies: {min(gaps):.1f}s")
+        for shard_id in sorted(self.identifies):
+            guilds = sum(1 for guild_id in self.guild_ids if (guild_id >> 22) % shard_count == shard_id) if shard_count else 0
+            lines.append(f"  Shard {shard_id}: {guilds} guilds")
+        return "\n".join(lines)
+
+async def serve(args):
+    gateway = FakeGateway(args.host, args.port, args.guilds, args.shards)
+    runner = web.AppRunner(gateway.app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logging.info(f"Fake gateway on {gateway.ws_url}, API at http://{args.host}:{args.port}/api/v10")
+    last = None
+    try:
+        while True:
+            await asyncio.sleep(args.report_every)
+            report = gateway.report()
+            if report != last:
+                print(report, flush=True)
+                last = report
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--guilds', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=4, help="Shard count recommended by /gateway/bot")
+    parser.add_argument('--report-every', type=float, default=5.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:[gateway] %(message)s')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
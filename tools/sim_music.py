@@ -0,0 +1,438 @@
+"""Offline load simulator for the music cog.
+
+Run from the repository root:
+
+    python -m tools.sim_music [--guilds 1000] [--duration 60] [--track-seconds 8]
+
+No Discord connection, yt-dlp or ffmpeg is used. The cog is driven through its real
+commands (play, skip, stop), play_next, update_embed_task and send_or_update_embed
+against fakes: voice clients whose player thread reads frames every 20 ms like
+discord.py's, text channels that count REST calls, and an extractor and ffmpeg
+that only wait for their configured latency before returning silence.
+
+Reported are event loop lag, REST calls per action, memory per guild and the time
+from the first !play to the first audio frame.
+"""
+import argparse
+import asyncio
+import contextvars
+import logging
+import random
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+import discord
+import bot_commands.music as music
+from bot_commands.music_filters import FilteredSource
+from bot_commands.music_metrics import playback_totals
+
+FRAME_MS = 20.0
+# Tag REST calls with the action that caused them, tasks created along the way inherit it
+ACTION = contextvars.ContextVar('action', default='other')
+
+rest_calls = defaultdict(Counter)  # action -> REST method -> calls
+actions = Counter()  # action -> times invoked
+
+def rest_call(method):
+    rest_calls[ACTION.get()][method] += 1
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class FakeExtractorPool:
+    """Answers yt-dlp presets after a random latency around the configured mean."""
+
+    def __init__(self, latency, track_seconds, playlist_size):
+        self.latency = latency
+        self.track_seconds = track_seconds
+        self.playlist_size = playlist_size
+        self.calls = Counter()
+
+    def stats(self):
+        return {'workers': 0, 'pending': 0, 'completed': sum(self.calls.values()), 'failed': 0, 'timeouts': 0, 'rejected': 0}
+
+    def video(self, video_id):
+        return {
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'title': f"Simulated song {video_id}",
+            'duration': self.track_seconds,
+            'url': f"https://sim.invalid/audio/{video_id}?expire={int(time.time()) + 6 * 3600}",
+            'acodec': 'opus',
+        }
+
+    async def extract(self, preset, url, params=None, download=False):
+        self.calls[preset] += 1
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if 'list=' not in url:
+            return self.video(url.rsplit('=', 1)[-1])
+
+        # Playlists answer the requested playlist_items range, "1-50" or "51:"
+        items = (params or {}).get('playlist_items', '1:')
+        first, _, last = items.replace(':', '-').partition('-')
+        last = min(int(last), self.playlist_size) if last else self.playlist_size
+        list_id = url.rsplit('=', 1)[-1]
+        return {'entries': [self.video(f"{list_id}-{index}") for index in range(int(first), last + 1)]}
+
+class FakeSource(discord.AudioSource):
+    """Silence for the length of the song, opened after a simulated ffmpeg start."""
+
+    SILENCE = bytes(discord.opus.Encoder.FRAME_SIZE)
+
+    def __init__(self, duration):
+        self.frames = int(duration * 1000 / FRAME_MS)
+
+    def read(self):
+        if self.frames <= 0:
+            return b''
+        self.frames -= 1
+        return self.SILENCE
+
+    def cleanup(self):
+        self.frames = 0
+
+def fake_ffmpeg(latency, track_seconds):
+    def open_ffmpeg_source(spec, executable='ffmpeg', filters=None):
+        # Called in a worker thread like the real one, which blocks while ffmpeg starts
+        time.sleep(random.uniform(0.5, 1.5) * latency)
+        duration = track_seconds
+        before_options = spec.get('before_options') or ''
+        if before_options.startswith('-ss '):
+            duration -= float(before_options.split()[1])
+        source = FakeSource(duration)
+        return FilteredSource(source, filters) if filters is not None and filters.active else source
+    return open_ffmpeg_source
+
+class FakePlayerThread(threading.Thread):
+    """One thread reading a frame from every playing voice client each 20 ms.
+
+    discord.py runs a thread per player, which would be thousands here. A single thread
+    still competes with the event loop for the GIL the same way.
+    """
+
+    def __init__(self, loop):
+        super().__init__(daemon=True)
+        self.loop = loop
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.running = True
+        self.overruns = 0
+
+    def run(self):
+        # Callbacks handed to the loop from here run with this tag, track ends and gapless
+        # switches start the next song without any command
+        ACTION.set('track_end')
+        next_tick = time.perf_counter()
+        while self.running:
+            with self.lock:
+                clients = list(self.clients)
+            for client in clients:
+                client.tick()
+            next_tick += FRAME_MS / 1000
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                next_tick = time.perf_counter()
+
+class FakeVoiceClient:
+    def __init__(self, guild, channel, player_thread):
+        self.guild = guild
+        self.channel = channel
+        self.player_thread = player_thread
+        self.source = None
+        self.after = None
+        self.paused = False
+        self.stopping = False
+        self.connected = True
+        self.first_frame_at = None
+
+    def tick(self):
+        # Player thread
+        if self.paused:
+            return
+        data = b'' if self.stopping else self.source.read()
+        if data:
+            if self.first_frame_at is None:
+                self.first_frame_at = time.perf_counter()
+            return
+        with self.player_thread.lock:
+            self.player_thread.clients.discard(self)
+        source, after, self.source, self.after = self.source, self.after, None, None
+        source.cleanup()
+        if after is not None:
+            self.loop.call_soon_threadsafe(after, None)
+
+    @property
+    def loop(self):
+        return self.player_thread.loop
+
+    def play(self, source, *, after=None):
+        if self.source is not None:
+            raise discord.ClientException('Already playing audio.')
+        self.source = source
+        self.after = after
+        self.paused = False
+        self.stopping = False
+        with self.player_thread.lock:
+            self.player_thread.clients.add(self)
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        if self.source is not None:
+            self.stopping = True
+            self.paused = False
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.connected = False
+        self.guild.voice_client = None
+
+class FakeMessage:
+    def __init__(self, channel, rest_latency):
+        self.channel = channel
+        self.rest_latency = rest_latency
+
+    async def edit(self, **fields):
+        rest_call('edit')
+        await asyncio.sleep(self.rest_latency)
+        return self
+
+    async def delete(self):
+        rest_call('delete')
+        await asyncio.sleep(self.rest_latency)
+
+class FakeTextChannel:
+    def __init__(self, guild, rest_latency):
+        self.guild = guild
+        self.id = guild.id + 1
+        self.rest_latency = rest_latency
+
+    async def send(self, content=None, **fields):
+        rest_call('send')
+        await asyncio.sleep(self.rest_latency)
+        return FakeMessage(self, self.rest_latency)
+
+class FakeVoiceChannel:
+    def __init__(self, guild, connect_latency, player_thread):
+        self.guild = guild
+        self.id = guild.id + 2
+        self.name = f"voice-{guild.id}"
+        self.connect_latency = connect_latency
+        self.player_thread = player_thread
+
+    async def connect(self, *, cls=None, **kwargs):
+        await asyncio.sleep(self.connect_latency)
+        self.guild.voice_client = FakeVoiceClient(self.guild, self, self.player_thread)
+        return self.guild.voice_client
+
+    def __str__(self):
+        return self.name
+
+class FakeGuild:
+    def __init__(self, guild_id, args, player_thread):
+        self.id = guild_id
+        self.voice_client = None
+        self.text_channel = FakeTextChannel(self, args.rest_latency)
+        self.voice_channel = FakeVoiceChannel(self, args.connect_latency, player_thread)
+
+class FakeAuthor:
+    def __init__(self, guild):
+        self.id = guild.id + 3
+        self.voice = type('VoiceState', (), {'channel': guild.voice_channel})()
+
+class FakeContext:
+    def __init__(self, guild):
+        self.guild = guild
+        self.channel = guild.text_channel
+        self.author = FakeAuthor(guild)
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **fields):
+        return await self.channel.send(content, **fields)
+
+class FakeBot:
+    def __init__(self, loop):
+        self.loop = loop  # Used from player threads as well, like discord.py's
+        self.guilds = {}
+        self.cogs = {}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def add_view(self, view, message_id=None):
+        pass
+
+async def run_action(name, coroutine):
+    # Commands are called through their callbacks, the cog is never added to a real bot
+    # Run in a copied context, so the tag stays with this action and the tasks it creates
+    async def tagged():
+        ACTION.set(name)
+        actions[name] += 1
+        return await coroutine
+    return await asyncio.create_task(tagged())
+
+async def measure_lag(samples, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - expected) * 1000)
+
+async def drive_guild(cog, guild, args, deadline, play_latencies, rng):
+    ctx = FakeContext(guild)
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+
+    started = time.perf_counter()
+    if args.playlist_size:
+        await run_action('play', cog.play.callback(cog, ctx, f"https://www.youtube.com/playlist?list=sim{guild.id}"))
+    else:
+        await run_action('play', cog.play.callback(cog, ctx, f"https://www.youtube.com/watch?v=sim{guild.id}-0"))
+    for index in range(1, args.queue + 1):
+        await run_action('queue', cog.play.callback(cog, ctx, f"https://www.youtube.com/watch?v=sim{guild.id}-q{index}"))
+
+    while time.perf_counter() < deadline:
+        remaining = deadline - time.perf_counter()
+        if not args.skip_every:
+            await asyncio.sleep(remaining)
+            break
+        await asyncio.sleep(min(args.skip_every * rng.uniform(0.5, 1.5), remaining))
+        if time.perf_counter() < deadline:
+            await run_action('skip', cog.skip.callback(cog, ctx))
+
+    voice_client = guild.voice_client
+    if voice_client and voice_client.first_frame_at:
+        play_latencies.append((voice_client.first_frame_at - started) * 1000)
+    await run_action('stop', cog.stop.callback(cog, ctx))
+
+def report(args, cog, player_thread, lag, play_latencies, elapsed, memory_before):
+    print(f"Simulated {args.guilds} guilds for {elapsed:.0f}s")
+    print()
+    print("Event loop lag (50 ms probe)")
+    print(f"  p50 {percentile(lag, 0.5):.1f}ms  p99 {percentile(lag, 0.99):.1f}ms  max {max(lag, default=0):.1f}ms")
+    print(f"  Player thread overruns: {player_thread.overruns}")
+    print()
+    print("First audio")
+    print(
+        f"  !play to first frame: p50 {percentile(play_latencies, 0.5):.0f}ms  p99 {percentile(play_latencies, 0.99):.0f}ms"
+        f"  ({len(play_latencies)} guilds)"
+    )
+    stats = playback_totals.summary()
+    print(f"  Track open to first frame: p50 {stats['first_audio_p50_ms']:.0f}ms  max {stats['first_audio_max_ms']:.0f}ms  ({stats['tracks']} tracks)")
+    print(f"  Frames: {stats['frames']}  late: {stats['late_frames']}  dropped: {stats['dropped_frames']}")
+    print()
+    print("REST calls")
+    print(f"  {'action':<10} {'times':>7} {'send':>7} {'edit':>7} {'delete':>7} {'per action':>11}")
+    for action in sorted(rest_calls, key=lambda name: -sum(rest_calls[name].values())):
+        calls = rest_calls[action]
+        total = sum(calls.values())
+        per_action = f"{total / actions[action]:.2f}" if actions[action] else "-"
+        print(f"  {action:<10} {actions[action] or '-':>7} {calls['send']:>7} {calls['edit']:>7} {calls['delete']:>7} {per_action:>11}")
+    total = sum(sum(calls.values()) for calls in rest_calls.values())
+    print(f"  {total} calls, {total / elapsed:.1f}/s")
+    print()
+    print("Memory")
+    states = list(cog.guild_states.values())
+    if states:
+        print(f"  GuildState.memory_size: {statistics.mean(state.memory_size() for state in states) / 1024:.1f} KiB per guild")
+    if memory_before is not None:
+        current, _ = tracemalloc.get_traced_memory()
+        print(f"  Allocated since start: {(current - memory_before) / len(states or [None]) / 1024:.1f} KiB per guild (tracemalloc)")
+    print(f"  Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+    print(f"  Extractor calls: {dict(music.extractor_pool.calls)}")
+
+async def simulate(args):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+    music.extractor_pool = FakeExtractorPool(args.extract_latency, args.track_seconds, args.playlist_size)
+    music.open_ffmpeg_source = fake_ffmpeg(args.ffmpeg_latency, args.track_seconds)
+
+    player_thread = FakePlayerThread(loop)
+    player_thread.start()
+    bot = FakeBot(loop)
+
+    # The progress refresh loop is created here and keeps this tag for its edits
+    ACTION.set('progress')
+    cog = music.Music(bot)
+    ACTION.set('other')
+    # These only touch files on disk and idle guilds
+    cog.save_cache_task.cancel()
+    cog.evict_idle_task.cancel()
+    await cog.cog_load()
+    bot.cogs['Music'] = cog
+
+    memory_before = None
+    if args.tracemalloc:
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+
+    lag = []
+    lag_task = asyncio.create_task(measure_lag(lag))
+    play_latencies = []
+    started = time.perf_counter()
+    deadline = started + args.duration
+    # Snowflake-like IDs, the scheduler and node pool spread guilds by their timestamp bits
+    guilds = [FakeGuild((1_000_000_000 + index * 7919) << 22, args, player_thread) for index in range(args.guilds)]
+    bot.guilds = {guild.id: guild for guild in guilds}
+    await asyncio.gather(*(drive_guild(cog, guild, args, deadline, play_latencies, rng) for guild in guilds))
+    elapsed = time.perf_counter() - started
+
+    # Let the last debounced renders go out before counting
+    await asyncio.sleep(music.EMBED_DEBOUNCE * 2)
+    lag_task.cancel()
+    report(args, cog, player_thread, lag, play_latencies, elapsed, memory_before)
+
+    player_thread.running = False
+    cog.update_embed_task.cancel()
+    for guild_state in cog.guild_states.values():
+        guild_state.release()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds each guild keeps playing")
+    parser.add_argument('--ramp', type=float, default=10.0, help="Guilds start spread over this many seconds")
+    parser.add_argument('--track-seconds', type=float, default=8.0)
+    parser.add_argument('--queue', type=int, default=3, help="Songs queued after the first")
+    parser.add_argument('--playlist-size', type=int, default=0, help="Start with a playlist of this many songs instead")
+    parser.add_argument('--skip-every', type=float, default=15.0, help="Mean seconds between skips, 0 never skips")
+    parser.add_argument('--extract-latency', type=float, default=0.8, help="Mean seconds per yt-dlp extraction")
+    parser.add_argument('--ffmpeg-latency', type=float, default=0.15, help="Mean seconds for ffmpeg to start")
+    parser.add_argument('--connect-latency', type=float, default=0.5, help="Seconds to join a voice channel")
+    parser.add_argument('--rest-latency', type=float, default=0.08, help="Seconds per REST call")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true', help="Measure allocations, slows the run down")
+    parser.add_argument('--verbose', action='store_true', help="Show the cog's own logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    asyncio.run(simulate(args))
+
+if __name__ == '__main__':
+    main()